@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+"""
+Collect the hourly usage for many eneco and vattenfall accounts in one process.
+
+Accounts are configured in ~/.energierc, in sections named `eneco:<name>`
+or `vattenfall:<name>`, with the same keys as the `[eneco]` and `[vattenfall]`
+sections, and optionally a `store` for that account:
+
+    [eneco:home]
+    user=itsme@xs4all.nl
+    pass=xyz
+    store=~/energie/eneco-home/
+
+    [vattenfall:office]
+    auth=The-Authorization-header-content
+    customerid=<customerid>/<contractid>
+
+All accounts log in concurrently, and share one connection pool and one set of
+worker threads for their window requests, with a rate limit per provider.
+Each account is synced to its own store, see the `--sync` option of eneco.py.
+"""
+import os
+import copy
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from fetcher import RateLimit
+from httppool import ConnectionPool
+from retry import Retrier
+from stats import STATS
+
+
+def readaccounts(cfg, datadir):
+    """
+    Returns a list of (provider, name, options) for all account sections.
+    """
+    accounts = []
+    for section in cfg:
+        provider, _, name = section.partition(':')
+        if provider not in ('eneco', 'vattenfall') or not name:
+            continue
+        options = dict(cfg[section])
+        options['store'] = os.path.expanduser(options.get('store') or os.path.join(datadir, "%s-%s" % (provider, name), ""))
+        accounts.append((provider, name, options))
+    return accounts
+
+
+def collect(provider, name, options, args, pool, executor, ratelimit):
+    """
+    Login to one account, and sync it's store.
+    """
+    acargs = copy.copy(args)
+    t1 = datetime.now()
+    t0 = t1 - timedelta(days=7)*args.weeks
+    with STATS.timer('account_sync', provider=provider, account=name):
+        if provider == 'eneco':
+            import eneco
+            en = eneco.Eneco(acargs, pool)
+            en.ratelimit = ratelimit
+            try:
+                if not en.login(options.get('user'), options.get('pass')):
+                    print("%s: login failed" % name)
+                    return
+                eneco.sync(en, options['store'], t0, t1, args.jobs, executor)
+            finally:
+                en.close()
+        else:
+            import vattenfall
+            acargs.auth = options.get('auth')
+            acargs.customerid = options.get('customerid')
+            en = vattenfall.Vattenfall(acargs, pool)
+            en.ratelimit = ratelimit
+            vattenfall.sync(en, options['store'], t0, t1, 5, args.jobs, executor)
+
+
+def main():
+    import argparse
+    import stats
+    parser = argparse.ArgumentParser(description='collect the hourly usage for all accounts in the config')
+    parser.add_argument('--debug', '-d', action='store_true', help=argparse.SUPPRESS) # 'print all intermediate steps'
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--weeks', '-w', type=int, default=0, help='weeks to get for accounts with an empty store')
+    parser.add_argument('--jobs', '-j', type=int, default=2, help='windows in flight per account')
+    parser.add_argument('--workers', type=int, default=8, help='total number of requests in flight')
+    parser.add_argument('--rate', type=str, action='append', default=[], help='requests per second for a provider, default: eneco=5, vattenfall=5', metavar='PROVIDER=N')
+    parser.add_argument('--timeout', type=float, default=60, help='timeout per request in seconds')
+    parser.add_argument('--retries', type=int, default=5, help='number of tries per request')
+    stats.addarguments(parser)
+    parser.add_argument('--datadir', type=str, default='.', help='directory for the stores of accounts without a `store` option')
+    parser.add_argument('--account', '-a', type=str, action='append', help='only collect these accounts')
+    parser.add_argument('--cache', type=str, default='~/.cache/energie', help='directory for caching past usage, default=~/.cache/energie')
+    parser.add_argument('--nocache', dest='cache', action='store_const', const=None, help='do not use the usage cache')
+    parser.add_argument('--tokens', type=str, default='~/.cache/energie/eneco-tokens.json', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS, default='~/.energierc') # 'specify configuration file.'
+    args = parser.parse_args()
+    stats.fromargs(args)
+    # these are used by the eneco and vattenfall clients
+    args.noninteractive = True
+    args.poolsize = args.workers
+
+    from config import loadconfig
+    cfg = loadconfig(os.path.expanduser(args.config))
+
+    accounts = readaccounts(cfg, args.datadir)
+    if args.account:
+        accounts = [ a for a in accounts if a[1] in args.account or "%s:%s" % a[:2] in args.account ]
+    if not accounts:
+        print("no accounts configured, add [eneco:<name>] or [vattenfall:<name>] sections to %s" % args.config)
+        return
+
+    rates = dict(eneco=5.0, vattenfall=5.0)
+    for r in args.rate:
+        provider, _, rate = r.partition('=')
+        rates[provider] = float(rate)
+    ratelimits = { provider: RateLimit(rate) for provider, rate in rates.items() }
+
+    pool = ConnectionPool(args.workers, args.timeout, debuglevel=1 if args.debug else 0, retrier=Retrier(args.retries))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, ThreadPoolExecutor(max_workers=len(accounts)) as collectors:
+        futures = []
+        for provider, name, options in accounts:
+            futures.append((name, collectors.submit(collect, provider, name, options, args, pool, executor, ratelimits[provider])))
+        for name, f in futures:
+            try:
+                f.result()
+                if args.verbose:
+                    print("%s: done" % name)
+            except Exception as e:
+                print("%s: %s" % (name, e))
+                if args.debug:
+                    traceback.print_exc()
+    if args.verbose:
+        print(pool.retrier.stats())
+
+
+if __name__ == '__main__':
+    main()
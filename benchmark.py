@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+"""
+Benchmarks for the fetch, parse and summarize paths, using synthetic data.
+
+    python3 benchmark.py --years 5
+    python3 benchmark.py --fetch --years 1 --latency 50 --jobs 8
+
+The summarize benchmarks generate eneco and vattenfall dump files with the
+requested number of years of hourly data, and time the steps of both
+summarize tools. The fetch benchmarks run the eneco.py and vattenfall.py
+window loops against a local http server which generates the responses,
+with a simulated latency per request.
+"""
+import io
+import json
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from argparse import Namespace
+from array import array
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from zoneinfo import ZoneInfo
+
+AMS = ZoneInfo("Europe/Amsterdam")
+HOUR = timedelta(hours=1)
+
+
+def localhours(start, days):
+    """
+    yields the utc hours from local midnight `start` for `days` days.
+    """
+    t0 = datetime(start.year, start.month, start.day, tzinfo=AMS)
+    t = t0.astimezone(timezone.utc)
+    t1 = (t0 + timedelta(days=days)).astimezone(timezone.utc)
+    while t < t1:
+        yield t
+        t += HOUR
+
+
+def measurement(rnd, value, double, status="MEASURED", collector="P4", errors=None):
+    # a single tariff meter reports everything in high, as in the real dumps
+    high = value if not double or rnd.random() < 0.6 else 0
+    low = value - high
+    return dict(
+        status = status,
+        isDoubleTariff = double,
+        isDoubleMeter = double,
+        collectorType = collector,
+        high = high,
+        highCostInclVat = high * 0.4,
+        low = low,
+        lowCostInclVat = low * 0.35,
+        fixedCostInclVat = -0.05,
+        totalUsageCostInclVat = value * 0.4,
+        totalCostInclVat = value * 0.4 - 0.05,
+        errorCodes = errors,
+    )
+
+
+def enecoactual(rnd, t):
+    r = rnd.random()
+    gas = measurement(rnd, round(rnd.random() * 0.3, 5), False,
+            collector = "Interpolated" if r < 0.02 else "P4",
+            errors = ["EP4_012"] if r < 0.002 else None)
+    if r > 0.995:
+        elec = measurement(rnd, 0, True, status="NOT_MEASURED", collector="NotMeasured")
+    else:
+        elec = measurement(rnd, round(rnd.random() * 0.8, 5), True)
+    return dict(date = f"{t:%Y-%m-%dT%H:%M:%S}Z", warmth = None, gas = gas, electricity = elec,
+            redelivery = None, produced = None, tapWater = None,
+            totalCostInclVat = gas['totalCostInclVat'] + elec['totalCostInclVat'],
+            totalUsageCostInclVat = gas['totalUsageCostInclVat'] + elec['totalUsageCostInclVat'],
+            totalFixedCostInclVat = -0.1)
+
+
+def enecoweek(start):
+    """
+    A synthetic eneco usage response for the week starting at local date `start`.
+    """
+    rnd = random.Random(start.toordinal())
+    entries = []
+    for t in localhours(start, 7):
+        actual = enecoactual(rnd, t)
+        entries.append(dict(actual = actual, previousYear = actual, budget = None, weather = None))
+    return dict(data = dict(
+        metadata = dict(interval = "Hour", aggregation = "Week"),
+        usages = [ dict(
+            period = { "from": f"{start:%Y-%m-%d}", "to": f"{start+timedelta(days=6):%Y-%m-%d}" },
+            entries = entries,
+            summary = dict(aggregationTotals = None),
+        ) ]
+    ))
+
+
+def vattenfallwindow(tstart, tend):
+    """
+    A synthetic vattenfall hourly consumption response, `tend` is inclusive.
+    """
+    rnd = random.Random(tstart.toordinal())
+    headers = []
+    for product in ('E', 'G'):
+        items = []
+        for t in localhours(tstart, (tend - tstart).days + 1):
+            lt = t.astimezone(AMS)
+            items.append(dict(
+                DateFrom = f"{lt:%Y-%m-%d}",
+                TimeFrom = f"{lt:%H:%M}",
+                DeliveryQuantity = "%.3f" % (rnd.random() * (0.8 if product == 'E' else 0.3)),
+                BackDeliveryQuantity = "%.3f" % (rnd.random() * 0.2 if product == 'E' else 0),
+            ))
+        headers.append(dict(Product = product, ConsumptionSet = items))
+    return dict(ConsumptionHeaderSet = headers)
+
+
+def generate(dirname, years, start=datetime(2018, 1, 1)):
+    """
+    Write an eneco and a vattenfall dump with `years` years of data, returns their filenames.
+    """
+    enecofn = os.path.join(dirname, "eneco.dat")
+    vattenfn = os.path.join(dirname, "vattenfall.dat")
+    weeks = int(years * 52.18)
+    with open(enecofn, "w") as fh:
+        for w in range(weeks):
+            print(json.dumps(enecoweek(start + timedelta(days=7*w))), file=fh)
+    with open(vattenfn, "w") as fh:
+        for w in range(weeks):
+            t = start + timedelta(days=7*w)
+            print(json.dumps(vattenfallwindow(t, t + timedelta(days=6))), file=fh)
+    return enecofn, vattenfn
+
+
+class Benchmark:
+    def __init__(self, trackmemory=True):
+        self.trackmemory = trackmemory
+        print("%-32s %9s %9s %12s %9s" % ("benchmark", "records", "seconds", "records/sec", "peak MB"))
+
+    def run(self, name, fn):
+        """
+        Time `fn`, which returns the number of records processed,
+        then run it again to measure the peak memory use.
+        """
+        t0 = time.perf_counter()
+        n = fn()
+        t1 = time.perf_counter()
+        peak = float('nan')
+        if self.trackmemory:
+            tracemalloc.start()
+            fn()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            peak /= 1024*1024
+        print("%-32s %9d %9.3f %12.0f %9.1f" % (name, n, t1-t0, n/(t1-t0) if t1 > t0 else 0, peak))
+
+
+def benchsummarize(bm, enecofn, vattenfn):
+    import summarizeeneco as se
+    import summarizevatten as sv
+    import usagedb
+    import costs
+    from rollup import rollup, hournumber
+    from timestamps import isohour, AMSTERDAM
+
+    def count(fn, reader):
+        with open(fn, "r") as fh:
+            return sum(1 for _ in reader(fh))
+
+    def records(fn, reader, getdata):
+        with open(fn, "r") as fh:
+            return list(getdata(reader(fh)))
+
+    bm.run("eneco readlines", lambda: count(enecofn, se.readlines))
+    bm.run("eneco getdata", lambda: len(records(enecofn, se.readlines, se.getdata)))
+
+    recs = records(enecofn, se.readlines, se.getdata)
+    bm.run("eneco check", lambda: sum(1 for d in recs if se.check(d) or True))
+    bm.run("eneco deviations", lambda: sum(1 for d in recs if se.deviations(d) or True))
+
+    hours = array('l', [hournumber(se.cvdate(d['date'])) for d in recs])
+    gas = array('d', [se.get(d, 'gas', 'high') or 0 for d in recs])
+    elec = array('d', [se.get(d, 'electricity', 'high') or se.get(d, 'electricity', 'low') or 0 for d in recs])
+    bm.run("eneco cvdate", lambda: len([se.cvdate(d['date']) for d in recs]))
+    bm.run("eneco cvdate hournumber", lambda: len([hournumber(se.cvdate(d['date'])) for d in recs]))
+    bm.run("eneco isohour", lambda: len([isohour(d['date']) for d in recs]))
+    for period in ('hour', 'day', 'week', 'month', 'year'):
+        bm.run("eneco rollup %s" % period, lambda: rollup(hours, [gas, elec], period, unique=True) and len(hours))
+    import report
+    tables = list(zip(('gas', 'electricity'), rollup(hours, [gas, elec], 'hour', unique=True)))
+    bm.run("eneco columns text", lambda: report.writetext(io.StringIO(), tables) or len(hours))
+    bm.run("eneco columns csv", lambda: report.writecsv(io.StringIO(), tables) or len(hours))
+    bm.run("eneco rollup contract period", lambda: rollup(hours, [gas, elec], se.ENECOCONTRACTS, unique=True) and len(hours))
+
+    tariffs = costs.Tariffs([dict(gas=0.8, electricity_high=0.24, electricity_low=0.2, gas_fixed=0.5, electricity_fixed=0.6, vat=21, **{"from": "2018-01-01"}),
+            { "from": "2019-07-01", "vat": 9 }, { "from": "2020-01-01", "vat": 21, "electricity": 0.3 }])
+    low = array('d', [se.get(d, 'electricity', 'low') or 0 for d in recs])
+    double = array('d', [1]) * len(hours)
+    redelivery = array('d', bytes(8*len(hours)))
+    bm.run("eneco costs", lambda: len(tariffs.costs(hours, gas, elec, low, redelivery, double)[0]))
+
+    dbfn = os.path.join(os.path.dirname(enecofn), "usage.db")
+    def loaddb(rows):
+        db = usagedb.UsageDB(dbfn)
+        n = db.upsert(rows)
+        db.close()
+        return n
+    bm.run("eneco usagedb upsert", lambda: loaddb(usagedb.enecorows('bench', recs)))
+    bm.run("eneco usagedb columns", lambda: len(usagedb.enecocolumns(dbfn, 'bench')[0]))
+    bm.run("eneco usagedb totals month", lambda: len(usagedb.accounttotals(dbfn, 'eneco', 'month', 'bench')[0]) and len(hours))
+
+    bm.run("vattenfall readlines", lambda: count(vattenfn, sv.readlines))
+    bm.run("vattenfall getdata", lambda: len(records(vattenfn, sv.readlines, sv.getdata)))
+
+    bm.run("vattenfall tztable", lambda: len([AMSTERDAM.local(h) for h in hours]))
+    recs = records(vattenfn, sv.readlines, sv.getdata)
+    hours = array('l', [hournumber(t) for p, t, q, qr in recs])
+    bm.run("vattenfall getdata hournumber", lambda: len([hournumber(t) for p, t, q, qr in records(vattenfn, sv.readlines, sv.getdata)]))
+    bm.run("vattenfall gethours", lambda: len(records(vattenfn, sv.readlines, sv.gethours)))
+    values = array('d', [q - qr for p, t, q, qr in recs])
+    for period in ('hour', 'day', 'week', 'month', 'year'):
+        bm.run("vattenfall rollup %s" % period, lambda: rollup(hours, [values], period) and len(hours))
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    Replays synthetic eneco and vattenfall usage responses.
+    """
+    protocol_version = "HTTP/1.1"
+    latency = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        u = urllib.parse.urlsplit(self.path)
+        q = dict(urllib.parse.parse_qsl(u.query))
+        if u.path.endswith("/usages"):
+            j = enecoweek(datetime.strptime(q['start'], "%Y-%m-%d"))
+        elif "/consumptions/" in u.path:
+            j = vattenfallwindow(datetime.strptime(q['DateFrom'], "%Y-%m-%d"), datetime.strptime(q['DateTo'], "%Y-%m-%d"))
+        else:
+            self.send_error(404)
+            return
+        body = json.dumps(j).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def clientargs(**kwargs):
+    """
+    The args used by the Eneco and Vattenfall clients.
+    """
+    args = Namespace(debug=False, verbose=False, noninteractive=True, poolsize=4, timeout=60, retries=5, cache=None, tokens=None,
+            auth=None, customerid="1/1")
+    for k, v in kwargs.items():
+        setattr(args, k, v)
+    return args
+
+
+def benchfetch(bm, years, latency, jobs):
+    import eneco
+    import vattenfall
+
+    StandIn.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    baseurl = "http://127.0.0.1:%d" % server.server_port
+
+    t0 = datetime(2018, 1, 1)
+    t1 = t0 + timedelta(days=int(years*365.25))
+    hours = (t1-t0).days * 24
+
+    en = eneco.Eneco(clientargs(poolsize=jobs))
+    en.baseurl = baseurl
+    en.customerid = 1
+    bm.run("eneco fetch, %d jobs" % jobs, lambda: sum(1 for _ in eneco.fetchweeks(en, t0, t1, jobs)) and hours)
+
+    vf = vattenfall.Vattenfall(clientargs(poolsize=jobs))
+    vf.baseurl = baseurl
+    bm.run("vattenfall fetch, %d jobs" % jobs, lambda: sum(1 for _ in vattenfall.fetchconsumptions(vf, t0, t1, 5, jobs)) and hours)
+
+    async def afetch(client, responses):
+        client.baseurl = baseurl
+        client.customerid = client.customerid or 1
+        n = 0
+        async for _ in responses(client):
+            n += 1
+        await client.close()
+        await client.pool.close()
+        return n
+
+    def arun(cls, responses):
+        return asyncio.run(afetch(cls(clientargs(poolsize=jobs)), responses)) and hours
+    bm.run("eneco async fetch, %d jobs" % jobs, lambda: arun(eneco.AsyncEneco, lambda en: eneco.afetchweeks(en, t0, t1, jobs)))
+    bm.run("vattenfall async fetch, %d jobs" % jobs, lambda: arun(vattenfall.AsyncVattenfall, lambda en: vattenfall.afetchconsumptions(en, t0, t1, 5, jobs)))
+
+    server.shutdown()
+
+
+def main():
+    import argparse
+    import stats
+    parser = argparse.ArgumentParser(description='benchmark the fetch, parse and summarize paths')
+    parser.add_argument('--years', '-y', type=float, default=5, help='years of hourly data')
+    parser.add_argument('--fetch', action='store_true', help='benchmark the fetch loops against a local http server')
+    parser.add_argument('--latency', type=float, default=20, help='simulated latency per request in ms')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='concurrent requests for the fetch benchmark')
+    parser.add_argument('--nomemory', action='store_true', help='skip the peak memory measurements')
+    parser.add_argument('--keep', type=str, help='write the generated dumps to this directory', metavar='DIR')
+    stats.addarguments(parser)
+    args = parser.parse_args()
+    stats.fromargs(args)
+
+    bm = Benchmark(not args.nomemory)
+    if args.fetch:
+        benchfetch(bm, args.years, args.latency/1000, args.jobs)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        enecofn, vattenfn = generate(args.keep or tmpdir, args.years)
+        benchsummarize(bm, enecofn, vattenfn)
+
+
+if __name__ == '__main__':
+    main()
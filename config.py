@@ -0,0 +1,31 @@
+"""
+Reading the configuration from ~/.energierc.
+"""
+import os
+
+
+def parseconfig(txt):
+    """
+    Returns { section: { option: value } } for the text of a config file,
+    the lines before the first section are in section `root`.
+    """
+    import configparser
+    config = configparser.ConfigParser()
+    config.read_string("[root]\n" + txt)
+    sections = {}
+    for section in config.sections():
+        sections[section] = options = {}
+        for option in config.options(section):
+            try:
+                options[option] = config.get(section, option)
+            except configparser.InterpolationError:
+                options[option] = config.get(section, option, raw=True)
+    return sections
+
+
+def loadconfig(cfgfile):
+    """
+    Load config from .energierc, returns { section: { option: value } }.
+    """
+    with open(os.path.expanduser(cfgfile), 'r') as fh:
+        return parseconfig(fh.read())
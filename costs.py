@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""
+Recompute the costs of the hourly usage from a table of historical tariffs.
+
+The eneco `InclVat` fields always use the current price, not the price at the
+time of the measurement. A tariff file is a json list of the prices from a
+date on, each entry only needs the prices which changed at that date:
+
+    [
+      { "from": "2021-03-24", "gas": 0.85, "electricity_high": 0.24, "electricity_low": 0.22,
+        "redelivery": 0.07, "gas_fixed": 0.55, "electricity_fixed": 0.65, "vat": 21 },
+      { "from": "2022-07-01", "vat": 9 },
+      { "from": "2023-01-01", "vat": 21, "electricity": 0.40 }
+    ]
+
+Prices are excluding VAT, per m3 or kWh, the fixed costs per day. Double
+tariff hours use the high and low prices, single tariff hours `electricity`,
+each falls back to the other when missing. A tariff starts at midnight in
+Amsterdam. The fixed costs are charged once for every day from the first
+to the last day with data, also for days with missing hours, at the first
+hour of the day.
+
+The hours are sorted once, the tariff boundaries are located with bisect, and
+each run of hours with the same tariff is computed as one batch.
+
+    python3 costs.py tariffs.json [--permonth] usage.db store/ eneco.dat ...
+"""
+import os
+import json
+from array import array
+from bisect import bisect_left
+
+from rollup import rollup, sortcolumns, daynumber
+from timestamps import AMSTERDAM
+
+FIELDS = ['gas', 'electricity', 'electricity_high', 'electricity_low', 'redelivery', 'gas_fixed', 'electricity_fixed', 'vat']
+
+
+class Tariffs:
+    def __init__(self, entries):
+        """
+        `entries` is a list of dicts with a "from" date and the changed prices.
+        """
+        self.days = []
+        self.starts = []
+        self.table = []
+        current = dict.fromkeys(FIELDS, 0.0)
+        for e in sorted(entries, key=lambda e: e['from']):
+            unknown = set(e) - set(FIELDS) - {'from'}
+            if unknown:
+                raise ValueError("unknown tariff fields: %s" % ", ".join(sorted(unknown)))
+            current = dict(current, **{ k: float(v) for k, v in e.items() if k != 'from' })
+            day = daynumber(*map(int, e['from'].split('-')))
+            self.days.append(day)
+            self.starts.append(AMSTERDAM.utc(day*24))
+            self.table.append(current)
+
+    @classmethod
+    def load(cls, filename):
+        with open(os.path.expanduser(filename), "r") as fh:
+            return cls(json.load(fh))
+
+    def prices(self, i):
+        """
+        Returns the prices including VAT for entry `i`:
+        gas, single, high, low and redelivery.
+        """
+        t = self.table[i]
+        vat = 1 + t['vat'] / 100
+        single = t['electricity'] or t['electricity_high']
+        return (t['gas'] * vat, single * vat,
+                (t['electricity_high'] or single) * vat, (t['electricity_low'] or single) * vat,
+                t['redelivery'] * vat)
+
+    def fixed(self, i):
+        """
+        Returns the gas and electricity fixed costs per day including VAT for entry `i`.
+        """
+        t = self.table[i]
+        vat = 1 + t['vat'] / 100
+        return t['gas_fixed'] * vat, t['electricity_fixed'] * vat
+
+    def costs(self, hours, gas, high, low, redelivery, double):
+        """
+        Returns arrays with the gas and electricity usage costs for each hour,
+        for sorted utc `hours` and arrays of usage, and 'double tariff' flags.
+        Hours before the first tariff have no costs.
+        """
+        n = len(hours)
+        gascost = array('d', bytes(8*n))
+        eleccost = array('d', bytes(8*n))
+        bounds = [bisect_left(hours, h) for h in self.starts] + [n]
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:])):
+            if a == b:
+                continue
+            pg, ps, ph, pl, pr = self.prices(i)
+            gascost[a:b] = array('d', [g*pg for g in gas[a:b]])
+            eleccost[a:b] = array('d', [(h*ph + l*pl if d else (h+l)*ps) - r*pr
+                    for h, l, r, d in zip(high[a:b], low[a:b], redelivery[a:b], double[a:b])])
+        return gascost, eleccost
+
+    def fixedcosts(self, first, last):
+        """
+        Returns the day numbers from `first` upto `last`, inclusive, and arrays
+        with the gas and electricity fixed costs for each day.
+        Days before the first tariff have no costs.
+        """
+        if self.days:
+            first = max(first, self.days[0])
+        n = max(0, last+1 - first) if self.days else 0
+        gascost = array('d', bytes(8*n))
+        eleccost = array('d', bytes(8*n))
+        bounds = [min(n, max(0, day - first)) for day in self.days] + [n]
+        for i, (a, b) in enumerate(zip(bounds, bounds[1:])):
+            if a == b:
+                continue
+            fg, fe = self.fixed(i)
+            gascost[a:b] = array('d', [fg]) * (b-a)
+            eleccost[a:b] = array('d', [fe]) * (b-a)
+        return array('l', range(first, first+n)), gascost, eleccost
+
+
+def rowcolumns(rows):
+    """
+    Returns hours, and the gas, high, low, redelivery and double tariff arrays from store rows.
+    """
+    from hourstore import FLAG_ELEC_DOUBLETARIFF
+    hours, cols = array('l'), [array('d') for _ in range(5)]
+    for r in rows:
+        hours.append(r['hour'])
+        for col, v in zip(cols, (r.get('gas'), r.get('elec_high'), r.get('elec_low'), r.get('redelivery'), (r.get('flags') or 0) & FLAG_ELEC_DOUBLETARIFF)):
+            col.append(v or 0)
+    return hours, cols
+
+
+def loadcolumns(path, provider='eneco'):
+    """
+    yields (name, provider, hours, [gas, high, low, redelivery, double]) for a
+    dump file, an hourly store, or each account in a usage database.
+    """
+    from usagedb import isdb, UsageDB
+    from hourstore import HourStore, FLAG_ELEC_DOUBLETARIFF
+    if isdb(path):
+        db = UsageDB(path, readonly=True)
+        for provider, account in db.accounts():
+            hours, cols = db.hourcolumns(provider, account, [
+                "CASE product WHEN 'G' THEN IFNULL(high, 0) + IFNULL(low, 0) - IFNULL(redelivery, 0) END",
+                "CASE product WHEN 'E' THEN IFNULL(high, 0) END",
+                "CASE product WHEN 'E' THEN IFNULL(low, 0) END",
+                "CASE product WHEN 'E' THEN IFNULL(redelivery, 0) END",
+                "CASE product WHEN 'E' THEN IFNULL(doubletariff, 0) END"])
+            yield "%s:%s" % (provider, account), provider, hours, cols
+        db.close()
+        return
+    if os.path.isdir(path):
+        store = HourStore(path)
+        c = store.load(['hour', 'gas', 'elec_high', 'elec_low', 'redelivery', 'flags'])
+        yield path, store.provider, c['hour'], [c['gas'], c['elec_high'], c['elec_low'], c['redelivery'],
+                array('d', [f & FLAG_ELEC_DOUBLETARIFF for f in c['flags']])]
+        return
+    with open(path, "r") as fh:
+        if provider == 'eneco':
+            from summarizeeneco import readlines, getdata
+            from hourstore import enecorow
+            rows = (enecorow(d) for d in getdata(readlines(fh)) if d and d.get('date'))
+        else:
+            from summarizevatten import readlines
+            from hourstore import vattenfallrows
+            rows = (r for j in readlines(fh) for r in vattenfallrows(j))
+        yield (path, provider) + rowcolumns(rows)
+
+
+def main():
+    import argparse
+    import stats
+    parser = argparse.ArgumentParser(description='recompute the costs from historical tariffs')
+    parser.add_argument('--provider', choices=['eneco', 'vattenfall'], default='eneco', help='provider of the dump files')
+    parser.add_argument('--perday', '-d', action='store_true')
+    parser.add_argument('--perweek', '-w', action='store_true')
+    parser.add_argument('--permonth', '-m', action='store_true')
+    parser.add_argument('--peryear', '-y', action='store_true')
+    stats.addarguments(parser)
+    parser.add_argument('tariffs', type=str, help='json file with the tariffs')
+    parser.add_argument('filenames', type=str, nargs='+', help='dump files, store directories or usage databases')
+    args = parser.parse_args()
+    stats.fromargs(args)
+
+    if args.perday:
+        period = 'day'
+    elif args.perweek:
+        period = 'week'
+    elif args.permonth:
+        period = 'month'
+    elif args.peryear:
+        period = 'year'
+    else:
+        period = 'hour'
+
+    from usagedb import timeline
+    tariffs = Tariffs.load(args.tariffs)
+    for fn in args.filenames:
+        for name, provider, hours, columns in stats.STATS.iter('load', loadcolumns(fn, args.provider)):
+            # repeated hours are dropped in utc, before converting to the timeline of the
+            # summarize tools, where the hour at the end of DST is repeated for vattenfall.
+            hours, columns = sortcolumns(hours, columns, unique=True)
+            with stats.STATS.timer('costs'):
+                g_cost, e_cost = tariffs.costs(hours, *columns)
+            hours = array('l', map(timeline(provider), hours))
+            if len(hours):
+                # the fixed costs per day of the timeline, at it's first hour
+                days, g_fixed, e_fixed = tariffs.fixedcosts(hours[0]//24, hours[-1]//24)
+                hours.extend(array('l', [day*24 for day in days]))
+                g_cost.extend(g_fixed)
+                e_cost.extend(e_fixed)
+            g_cost, e_cost = rollup(hours, [g_cost, e_cost], period)
+            print("--", name)
+            for t in sorted(e_cost.keys()):
+                print("%s %10.2f %10.2f %10.2f" % (t, g_cost[t], e_cost[t], g_cost[t] + e_cost[t]))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Streaming reader for the output of eneco.py and vattenfall.py.
+
+The dumps contain one json object per line, older dumps contain python
+reprs instead, and concatenated dumps can have several objects on one line.
+Lines are parsed one at a time, the python repr conversion is only tried
+for lines which are not valid json.
+
+Several dumps are read in parallel with `mapfiles`, each file in it's own process.
+"""
+import re
+import os
+import json
+from collections import deque
+
+decoder = json.JSONDecoder()
+
+
+def pythontojson(line):
+    """
+    convert a python dict repr to json
+    """
+    line = re.sub(r'\'', '"', line)
+    line = re.sub(r': (True|False)', lambda m:': %s' % m[1].lower(), line)
+    line = re.sub(r': None', ': null', line)
+    return line
+
+
+def decodeall(line):
+    """
+    yields all json objects from `line`, raises JSONDecodeError on invalid input.
+    """
+    i = 0
+    n = len(line)
+    while True:
+        while i < n and line[i].isspace():
+            i += 1
+        if i == n:
+            return
+        obj, i = decoder.raw_decode(line, i)
+        yield obj
+
+
+def readlines(fh, stop=(), skip=()):
+    """
+    yields the json or python dicts from the lines in `fh`.
+
+    Reading ends at a line starting with one of the `stop` prefixes,
+    lines starting with one of the `skip` prefixes are ignored.
+    """
+    for line in fh:
+        if stop and line.startswith(stop):
+            break
+        if skip and line.startswith(skip):
+            continue
+        try:
+            yield json.loads(line)
+            continue
+        except json.decoder.JSONDecodeError:
+            pass
+        try:
+            objs = list(decodeall(line))
+        except json.decoder.JSONDecodeError:
+            try:
+                objs = list(decodeall(pythontojson(line)))
+            except json.decoder.JSONDecodeError:
+                continue
+        yield from objs
+
+
+class RecentSet:
+    """
+    A set remembering only the last `size` items added.
+
+    Used to drop duplicate hours from overlapping windows, which are always
+    near each other in the dumps, without keeping every hour seen.
+    """
+    def __init__(self, size=4096):
+        self.size = size
+        self.items = set()
+        self.order = deque()
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def add(self, item):
+        if item in self.items:
+            return
+        self.items.add(item)
+        self.order.append(item)
+        if len(self.order) > self.size:
+            self.items.discard(self.order.popleft())
+
+
+class HourSet:
+    """
+    A set of hour numbers, stored as a bitmap: ten years of hours take 11 kB.
+    """
+    def __init__(self):
+        self.bits = bytearray()
+        self.other = set()
+
+    def __contains__(self, h):
+        if h < 0:
+            return h in self.other
+        i = h >> 3
+        return i < len(self.bits) and bool(self.bits[i] & (1 << (h & 7)))
+
+    def add(self, h):
+        if h < 0:
+            self.other.add(h)
+            return
+        i = h >> 3
+        if i >= len(self.bits):
+            self.bits.extend(bytes(i + 1 - len(self.bits)))
+        self.bits[i] |= 1 << (h & 7)
+
+
+# the characters which make a path a glob pattern
+GLOBCHARS = re.compile(r'[*?[]')
+
+def expandpaths(patterns):
+    """
+    Returns the filenames for a list of filenames and glob patterns,
+    the matches of each pattern are sorted by name.
+    Raises FileNotFoundError when a pattern matches nothing.
+    """
+    paths = []
+    for p in patterns:
+        if not GLOBCHARS.search(p):
+            paths.append(p)
+            continue
+        import glob
+        matches = sorted(glob.glob(os.path.expanduser(p)))
+        if not matches:
+            raise FileNotFoundError("no files match %s" % p)
+        paths += matches
+    return paths
+
+
+def mapfiles(fn, filenames, jobs=None, *args):
+    """
+    Returns [fn(filename, *args) for filename in filenames], computed in a
+    pool of `jobs` processes, default one per cpu, when there are several files.
+    `fn` must be a module level function, it's results are pickled.
+    """
+    jobs = min(jobs or os.cpu_count() or 1, len(filenames))
+    if jobs <= 1:
+        return [fn(f, *args) for f in filenames]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(fn, filenames, *[[a]*len(filenames) for a in args]))
@@ -6,16 +6,27 @@ Authentication works most of the time with username/password, but
 occasionally eneco wants you to verify yourself using a token sent to your email address.
 """
 import re
-import urllib.request
 import urllib.parse
-import http.cookiejar
 import json
 from datetime import datetime, timezone, timedelta
 import binascii
+import os
+import time
+import threading
+import tempfile
+import contextlib
+from fetcher import fetchwindows, afetchwindows
+from httppool import ConnectionPool, AsyncConnectionPool
+from retry import Retrier, requesterrors
+from usagecache import UsageCache, isclosed
+from hourstore import HourStore, isstore, enecorow, hourtime
+from journal import Journal
+from config import loadconfig
+from stats import STATS
 
 
 class Eneco:
-    def __init__(self, args):
+    def __init__(self, args, pool=None):
         self.args = args
         """
           The apikey is from "https://www.eneco.nl/" -> 'private'
@@ -33,23 +44,25 @@ class Eneco:
         self.baseurl = "https://api-digital.enecogroup.com"
         self.customerid = None
 
-        handlers = []
-        if args.debug:
-            handlers.append(urllib.request.HTTPSHandler(debuglevel=1))
-        self.opener = urllib.request.build_opener(*handlers)
+        self.pool = pool or ConnectionPool(args.poolsize, args.timeout, debuglevel=1 if args.debug else 0, retrier=Retrier(args.retries))
+        self.cache = UsageCache(args.cache) if args.cache else None
+        self.tokens = TokenCache(args.tokens) if args.tokens else None
+        self.ratelimit = None
+        # the cached token used, and the (username, password) to replace it
+        self.cachedauth = None
+        self.reauth = None
+        self.loginlock = threading.Lock()
+        # the thread or task refreshing a token which expires soon
+        self.refreshing = None
 
     def logprint(self, *args):
         if self.args.debug:
             print(*args)
 
-    def httpreq(self, url, data=None):
+    def requestheaders(self, data):
         """
-        Generic http request function.
-        Does a http-POST when the 'data' argument is present.
-
-        Adds the nesecesary xsrf and auth headers.
+        Returns the encoded request body, and the headers with the apikey and auth headers.
         """
-        self.logprint(">", url)
         hdrs = { }
         if data and type(data)==str:
             data = data.encode('utf-8')
@@ -58,30 +71,54 @@ class Eneco:
             hdrs["apikey"] = self.apikey
         if self.auth:
             hdrs['Authorization'] = self.auth
-        req = urllib.request.Request(url, headers=hdrs)
-        kwargs = dict()
-        if data:
-            kwargs["data"] = data
+        return data, hdrs
 
-        for tries in range(3):
-            try:
-                response = self.opener.open(req, **kwargs)
-            except urllib.error.HTTPError as e:
-                self.logprint("!", str(e))
-                response = e
-            try:
-                data = response.read()
-            except http.client.IncompleteRead as e:
-                continue
-            if response.headers.get("content-type", '').find("application/json")>=0:
+    def decoderesponse(self, response, host, t0):
+        """
+        Returns the decoded json, or the raw data of a response.
+        """
+        if response.status >= 400:
+            self.logprint("!", str(response))
+        data = response.read()
+        STATS.observe('http_request', time.perf_counter() - t0, host=host, status=response.status)
+        STATS.count('http_received_bytes', len(data), host=host)
+        if response.headers.get("content-type", '').find("application/json")>=0:
+            with STATS.timer('json_decode'):
                 js = json.loads(data)
-                self.logprint(js)
-                self.logprint()
-                return js
-            self.logprint(data)
+            self.logprint(js)
             self.logprint()
-            return data
-        raise Excepion("failed to connect to eneco")
+            return js
+        self.logprint(data)
+        self.logprint()
+        return data
+
+    def httpreq(self, url, data=None):
+        """
+        Generic http request function.
+        Does a http-POST when the 'data' argument is present.
+
+        Adds the nesecesary xsrf and auth headers.
+        """
+        self.logprint(">", url)
+        data, hdrs = self.requestheaders(data)
+
+        def send():
+            if self.ratelimit:
+                self.ratelimit.wait()
+            return self.pool.request(url, data or None, hdrs)
+
+        host = urllib.parse.urlsplit(url).hostname
+        t0 = time.perf_counter()
+        try:
+            response = self.pool.retrier.call(send, url, idempotent=data is None)
+        except requesterrors() as e:
+            STATS.count('http_failures', host=host)
+            raise Exception("failed to connect to %s: %s" % (url, e))
+        if response.status in (401, 403) and self.cachedauth and hdrs.get('Authorization') == self.cachedauth:
+            response.read()
+            if self.relogin(hdrs.get('Authorization')):
+                return self.httpreq(url, data)
+        return self.decoderesponse(response, host, t0)
 
     def unescapestring(self, txt):
         return re.sub(r'\\x(\w\w)', lambda m:chr(int(m[1], 16)), txt)
@@ -99,10 +136,17 @@ class Eneco:
         if m := re.search(r'clientId: "(\d+)"', html.decode('utf-8')):
             return int(m[1])
 
-    def extractCustomerIdFromToken(self, token):
+    def decodeToken(self, token):
+        """
+        Returns the claims from a JWT.
+        """
         a, b, c = token.split('.', 2)
 
-        props = json.loads(binascii.a2b_base64(b+"===="))
+        # the token uses the urlsafe base64 alphabet
+        return json.loads(binascii.a2b_base64(b.replace('-', '+').replace('_', '/')+"===="))
+
+    def extractCustomerIdFromToken(self, token):
+        props = self.decodeToken(token)
         return props.get('klantnummer') or props.get('customerId')
 
     def dump_auth_status(self, auth):
@@ -112,6 +156,107 @@ class Eneco:
 
     def login(self, username, password):
         """
+        Login using a cached id-token when that is still valid long enough,
+        otherwise do the full okta login.
+
+        When the cached token expires soon, it is used while a new token is
+        requested in the background, `close` waits for it. When the server refuses the cached token,
+        it is removed from the cache and the full login is done.
+        """
+        if (remaining := self.cachedtoken(username)) is not None:
+            self.cachedauth, self.reauth = self.auth, (username, password)
+            if remaining < TokenCache.REFRESH:
+                self.refreshing = threading.Thread(target=self.refreshtoken, args=(username, password), daemon=True)
+                self.refreshing.start()
+            return True
+
+        STATS.count('login', method='okta')
+        with STATS.timer('login', step='total'):
+            if not self.oktalogin(username, password):
+                return
+        if self.tokens:
+            self.tokens.save(username, self.auth, self.customerid)
+        return True
+
+    def cachedtoken(self, username):
+        """
+        Uses the cached token when it is valid long enough, returns the seconds it remains valid, or None.
+        """
+        if self.tokens and (cached := self.tokens.load(username)):
+            token, customerid = cached
+            remaining = self.decodeToken(token).get('exp', 0) - time.time()
+            if remaining > TokenCache.MINVALID:
+                self.auth, self.customerid = token, customerid
+                STATS.count('login', method='cached')
+                return remaining
+
+    def relogin(self, refused):
+        """
+        Replaces the cached token `refused` by the server with a full login,
+        returns True when the request can be sent again with a new token.
+        """
+        with self.loginlock:
+            if self.auth != refused:
+                # another thread did the login already
+                return True
+            if not self.reauth:
+                return False
+            username, password = self.reauth
+            self.reauth = None
+            self.dropcachedtoken(username)
+            if not self.oktalogin(username, password):
+                raise Exception("login failed after the cached token was refused")
+            if self.tokens:
+                self.tokens.save(username, self.auth, self.customerid)
+            return True
+
+    def dropcachedtoken(self, username):
+        self.logprint("cached token refused, logging in again")
+        STATS.count('login', method='refused')
+        if self.tokens:
+            self.tokens.drop(username)
+
+    def close(self, timeout=60):
+        """
+        Wait at most `timeout` seconds for a token refresh started by login,
+        so the new token is saved before the process exits.
+        """
+        if self.refreshing is not None:
+            refreshing, self.refreshing = self.refreshing, None
+            refreshing.join(timeout)
+
+    def refreshtoken(self, username, password):
+        """
+        Does a non-interactive login in a separate session, and replaces the current token.
+        """
+        en = Eneco(self.args, self.pool)
+        try:
+            if not en.oktalogin(username, password, interactive=False):
+                return
+        except Exception as e:
+            self.logprint("token refresh failed: %s" % e)
+            return
+        self.auth, self.customerid = en.auth, en.customerid
+        self.tokens.save(username, en.auth, en.customerid)
+
+    def oktalogin(self, username, password, interactive=True):
+        """
+        Does the okta login steps from `oktasteps`.
+        """
+        steps = self.oktasteps(username, password, interactive)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(self.httpreq(*request))
+        except StopIteration as e:
+            return e.value
+
+    def oktasteps(self, username, password, interactive=True):
+        """
+        A generator yielding the (url, data) of each login request, the response
+        is sent back into it, so the same steps are used by the async client.
+        Returns True when the login succeeded.
+
 /api/v1/sessions/me
 /api/v1/sessions/me/lifecycle/refresh
 /api/v1/interact
@@ -124,7 +269,8 @@ see exhar/eu1static.oktacdn.com/assets/js/sdk/okta-signin-widget/6.4.3/js/okta-s
         """
         # html = self.httpreq("https://www.eneco.nl/mijn-eneco/")
         #  (20221223) -> now redirects to /identity/login/website_eneco_main/OktaNL?returnUrl=/mijn-eneco/
-        html = self.httpreq("https://mijn.eneco.nl/")
+        with STATS.timer('login', step='mainpage'):
+            html = yield "https://mijn.eneco.nl/", None
         # -> redir to /login?returnUrl=...
         # -> redir to https://inloggen.eneco.nl/oauth2
         # extract 'oktaData' -> signIn -> stateToken
@@ -137,7 +283,8 @@ see exhar/eu1static.oktacdn.com/assets/js/sdk/okta-signin-widget/6.4.3/js/okta-s
         # note: optional steps:  introspect  and device/nonce
 
         # NOTE: when passing a null stateToken to 'authn', you get a sessionToken from 'password/verify'  instead of the step-up redirect.
-        auth1 = self.httpreq("https://inloggen.eneco.nl/api/v1/authn", json.dumps( {"username":username,"options":{"warnBeforePasswordExpired":True,"multiOptionalFactorEnroll":True},"stateToken":token}))
+        with STATS.timer('login', step='authn'):
+            auth1 = yield "https://inloggen.eneco.nl/api/v1/authn", json.dumps( {"username":username,"options":{"warnBeforePasswordExpired":True,"multiOptionalFactorEnroll":True},"stateToken":token})
         if self.args.verbose:
             self.dump_auth_status(auth1)
         # check if status == UNAUTHENTICATED
@@ -147,18 +294,19 @@ see exhar/eu1static.oktacdn.com/assets/js/sdk/okta-signin-widget/6.4.3/js/okta-s
         #     and factorType == password
         #   when MFA_REQUIRED -> return
 
-        auth2 = self.httpreq("https://inloggen.eneco.nl/api/v1/authn/factors/password/verify?rememberDevice=false", json.dumps( {"password":password,"stateToken":token}))
+        with STATS.timer('login', step='password'):
+            auth2 = yield "https://inloggen.eneco.nl/api/v1/authn/factors/password/verify?rememberDevice=false", json.dumps( {"password":password,"stateToken":token})
         if self.args.verbose:
             self.dump_auth_status(auth2)
         if auth2.get('status') == 'MFA_REQUIRED':
-            if self.args.noninteractive:
+            if self.args.noninteractive or not interactive:
                 raise Exception("MFA_REQUIRED")
             factors = auth2.get("_embedded", {}).get("factors", [])
-            auth3 = self.httpreq(factors.pop().get("_links").get("verify").get("href"), json.dumps({"passCode":"", "stateToken":token}))
+            auth3 = yield factors.pop().get("_links").get("verify").get("href"), json.dumps({"passCode":"", "stateToken":token})
             if self.args.verbose:
                 self.dump_auth_status(auth3)
             code = input("Check your mail, enter MFA code:")
-            auth2 = self.httpreq(auth3.get("_links").get("next").get("href"), json.dumps({"passCode":code, "stateToken":token}))
+            auth2 = yield auth3.get("_links").get("next").get("href"), json.dumps({"passCode":code, "stateToken":token})
             if self.args.verbose:
                 self.dump_auth_status(auth2)
         # check if status == SUCCESS
@@ -167,7 +315,8 @@ see exhar/eu1static.oktacdn.com/assets/js/sdk/okta-signin-widget/6.4.3/js/okta-s
 
         #  get _links.next.href
 
-        html2 = self.httpreq(f"https://inloggen.eneco.nl/login/step-up/redirect?stateToken={token}")
+        with STATS.timer('login', step='stepup'):
+            html2 = yield f"https://inloggen.eneco.nl/login/step-up/redirect?stateToken={token}", None
 
         self.auth = self.extractIdToken(html2)
         if not self.auth:
@@ -270,6 +419,20 @@ each measurement has this:
   "totalCostInclVat": 0.02,
   "errorCodes": null
 }
+        """
+        url, key = self.usagerequest(start, per, interval)
+        if key is None:
+            return self.httpreq(url)
+        j = self.cache.get(key)
+        if j is None:
+            j = self.httpreq(url)
+            if type(j)==dict and j.get('data', {}).get('usages'):
+                self.cache.put(key, j)
+        return j
+
+    def usagerequest(self, start, per, interval):
+        """
+        Returns the url for a usage window, and it's cache key, or None when it is not cached.
         """
         q = dict(
             aggregation = per,
@@ -279,37 +442,354 @@ each measurement has this:
             addWeather = True,
             extrapolate = False
         )
-        return self.httpreq(f"{self.baseurl}/dxpweb/nl/eneco/customers/{self.customerid}/accounts/2/usages?"+urllib.parse.urlencode(q))
+        url = f"{self.baseurl}/dxpweb/nl/eneco/customers/{self.customerid}/accounts/2/usages?"+urllib.parse.urlencode(q)
+
+        # only windows which ended a while ago are cached.
+        if not self.cache or not isclosed(windowend(start, per)):
+            return url, None
+        return url, self.cache.key("eneco", self.customerid, "usages", start, per, interval)
+
+
+class AsyncEneco(Eneco):
+    """
+    The Eneco client for asyncio, using an AsyncConnectionPool.
+
+    Many clients can share one pool, and fetch their windows from one event loop.
+    """
+    def __init__(self, args, pool=None):
+        super().__init__(args, pool or AsyncConnectionPool(args.poolsize, args.timeout, debuglevel=1 if args.debug else 0, retrier=Retrier(args.retries)))
+        self.relogging = None
+
+    async def httpreq(self, url, data=None):
+        self.logprint(">", url)
+        data, hdrs = self.requestheaders(data)
+
+        async def send():
+            import asyncio
+            if self.ratelimit and (delay := self.ratelimit.delay()) > 0:
+                await asyncio.sleep(delay)
+            return await self.pool.request(url, data or None, hdrs)
+
+        host = urllib.parse.urlsplit(url).hostname
+        t0 = time.perf_counter()
+        try:
+            response = await self.pool.retrier.acall(send, url, idempotent=data is None)
+        except requesterrors() as e:
+            STATS.count('http_failures', host=host)
+            raise Exception("failed to connect to %s: %s" % (url, e))
+        if response.status in (401, 403) and self.cachedauth and hdrs.get('Authorization') == self.cachedauth:
+            response.read()
+            if await self.relogin(hdrs.get('Authorization')):
+                return await self.httpreq(url, data)
+        return self.decoderesponse(response, host, t0)
+
+    async def relogin(self, refused):
+        import asyncio
+        if self.relogging is None:
+            self.relogging = asyncio.Lock()
+        async with self.relogging:
+            if self.auth != refused:
+                return True
+            if not self.reauth:
+                return False
+            username, password = self.reauth
+            self.reauth = None
+            self.dropcachedtoken(username)
+            if not await self.oktalogin(username, password):
+                raise Exception("login failed after the cached token was refused")
+            if self.tokens:
+                self.tokens.save(username, self.auth, self.customerid)
+            return True
+
+    async def login(self, username, password):
+        if (remaining := self.cachedtoken(username)) is not None:
+            self.cachedauth, self.reauth = self.auth, (username, password)
+            if remaining < TokenCache.REFRESH:
+                import asyncio
+                self.refreshing = asyncio.ensure_future(self.refreshtoken(username, password))
+            return True
+
+        STATS.count('login', method='okta')
+        with STATS.timer('login', step='total'):
+            if not await self.oktalogin(username, password):
+                return
+        if self.tokens:
+            self.tokens.save(username, self.auth, self.customerid)
+        return True
+
+    async def refreshtoken(self, username, password):
+        en = AsyncEneco(self.args, self.pool)
+        try:
+            if not await en.oktalogin(username, password, interactive=False):
+                return
+        except Exception as e:
+            self.logprint("token refresh failed: %s" % e)
+            return
+        self.auth, self.customerid = en.auth, en.customerid
+        self.tokens.save(username, en.auth, en.customerid)
 
-def loadconfig(cfgfile):
+    async def close(self):
+        """
+        Wait for a token refresh started by login, so the new token is saved before
+        the event loop ends. The pool is not closed, it can be shared by other clients.
+        """
+        if self.refreshing is not None:
+            refreshing, self.refreshing = self.refreshing, None
+            await refreshing
+
+    async def oktalogin(self, username, password, interactive=True):
+        steps = self.oktasteps(username, password, interactive)
+        try:
+            request = next(steps)
+            while True:
+                request = steps.send(await self.httpreq(*request))
+        except StopIteration as e:
+            return e.value
+
+    async def getprofile(self):
+        return await self.httpreq(f"{self.baseurl}/dxpweb/nl/eneco/customers/{self.customerid}/profile")
+    async def getinsights(self):
+        return await self.httpreq(f"{self.baseurl}/dxpweb/nl/eneco/customers/{self.customerid}/accounts/2/usages/services/insights")
+    async def getproducts(self):
+        return await self.httpreq(f"{self.baseurl}/dxpweb/nl/eneco/customers/{self.customerid}/accounts/2/products?includeproductrates=true")
+
+    async def getusage(self, start, per="Day", interval="Hour"):
+        url, key = self.usagerequest(start, per, interval)
+        if key is None:
+            return await self.httpreq(url)
+        j = self.cache.get(key)
+        if j is None:
+            j = await self.httpreq(url)
+            if type(j)==dict and j.get('data', {}).get('usages'):
+                self.cache.put(key, j)
+        return j
+
+class TokenCache:
+    """
+    Stores the id-token and customer id per username, in a file only readable by the user.
     """
-    Load config from .energierc
+    # refresh the token in the background when it expires within REFRESH seconds
+    REFRESH = 15*60
+    # tokens expiring within MINVALID seconds are not used
+    MINVALID = 2*60
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        self.lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.filename, "r") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def load(self, username):
+        """
+        Returns (token, customerid) or None
+        """
+        if ent := self.read().get(username or ''):
+            return ent.get('token'), ent.get('customerid')
+
+    def save(self, username, token, customerid):
+        self.update(username, dict(token=token, customerid=customerid))
+
+    def drop(self, username):
+        self.update(username, None)
+
+    def update(self, username, entry):
+        """
+        Replaces or, when `entry` is None, removes the entry for `username`.
+        """
+        dirname = os.path.dirname(self.filename) or '.'
+        os.makedirs(dirname, mode=0o700, exist_ok=True)
+        with self.lock, self.filelock():
+            tokens = self.read()
+            if entry:
+                tokens[username or ''] = entry
+            else:
+                tokens.pop(username or '', None)
+            # mkstemp creates the file readable only by the user
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix=os.path.basename(self.filename), suffix='.tmp')
+            try:
+                with os.fdopen(fd, "w") as fh:
+                    json.dump(tokens, fh)
+                os.replace(tmp, self.filename)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    @contextlib.contextmanager
+    def filelock(self):
+        """
+        Serializes updates of the cache file by other clients and processes,
+        when fcntl is available.
+        """
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        fd = os.open(self.filename + ".lock", os.O_WRONLY|os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+def fetchweeks(en, t0, t1, jobs=1, executor=None, journal=None):
     """
-    with open(cfgfile, 'r') as fh:
-        txt = fh.read()
-    txt = "[root]\n" + txt
-    import configparser
-    config = configparser.ConfigParser()
-    config.read_string(txt)
+    yields the hourly usage responses per week, from t0 until t1.
 
-    return config
+    With a `journal`, weeks already completed are skipped, and each week is
+    recorded as completed once the caller has processed it's response.
+    """
+    td = timedelta(days=7)
+    def fetchweek(t):
+        return en.getusage("%d-%d-%d" % (t.year, t.month, t.day), "Week", "Hour")
+
+    if journal:
+        t0 = journal.align(t0, td)
+    weeks = windows(t0, t1, td)
+    if journal:
+        weeks = journal.pending(weeks, td)
+    for t, j in fetchwindows(fetchweek, weeks, jobs, executor):
+        yield j
+        if journal:
+            journal.complete(t, t+td)
+
+async def afetchweeks(en, t0, t1, jobs=1, journal=None):
+    """
+    Like fetchweeks, for an AsyncEneco client.
+    """
+    td = timedelta(days=7)
+    def fetchweek(t):
+        return en.getusage("%d-%d-%d" % (t.year, t.month, t.day), "Week", "Hour")
+
+    if journal:
+        t0 = journal.align(t0, td)
+    weeks = windows(t0, t1, td)
+    if journal:
+        weeks = journal.pending(weeks, td)
+    async for t, j in afetchwindows(fetchweek, weeks, jobs):
+        yield j
+        if journal:
+            journal.complete(t, t+td)
+
+def sync(en, path, t0, t1, jobs=1, executor=None):
+    """
+    Append the hours newer than the newest in `path`, a dump file or store.
+    When `path` has no data yet, t0 upto t1 is fetched.
+    """
+    last = lastsample(path)
+    if last:
+        # eneco windows start at local midnight, while the samples are in UTC,
+        # so start a day early, the overlap is skipped by `SyncFilter`.
+        t0 = datetime(last.year, last.month, last.day) - timedelta(days=1)
+        t1 = datetime.now()
+    if t0==t1:
+        print("nothing to do, %s is empty, specify nr of weeks(-w), or --from + --until" % path)
+        return
 
+    sf = SyncFilter(last)
+    if isstore(path):
+        store = HourStore(path, 'eneco')
+        for j in fetchweeks(en, t0, t1, jobs, executor):
+            store.append([enecorow(d) for d in sf.add(j)])
+        return
+    with open(path, "a") as fh:
+        for j in fetchweeks(en, t0, t1, jobs, executor):
+            for d in sf.add(j):
+                print(json.dumps(d), file=fh)
+            fh.flush()
 
 def applyconfig(cfg, args):
     """
     Apply the configuration read from .energierc to the `args` dictionary,
     which is used to configure everything.
     """
-    if not args.username and cfg.has_option('eneco', 'user'):
-        args.username = cfg.get('eneco', 'user')
-    if not args.password and cfg.has_option('eneco', 'pass'):
-        args.password = cfg.get('eneco', 'pass')
+    section = cfg.get('eneco', {})
+    if not args.username and 'user' in section:
+        args.username = section['user']
+    if not args.password and 'pass' in section:
+        args.password = section['pass']
+
+def lastsample(filename):
+    """
+    Returns the (utc) time of the newest hourly record in a dump file or store,
+    or None when there are no records.
+    """
+    from summarizeeneco import readlines, getdata
+    from timestamps import isohour
+    if isstore(filename):
+        h = HourStore(filename).lasthour()
+        return hourtime(h) if h is not None else None
+    last = None
+    try:
+        with open(filename, "r") as fh:
+            for d in getdata(readlines(fh)):
+                if date := d.get('date'):
+                    h = isohour(date)
+                    if last is None or h > last:
+                        last = h
+    except FileNotFoundError:
+        pass
+    return hourtime(last) if last is not None else None
+
+def ismeasured(d):
+    return (d.get('gas') or {}).get('status') == 'MEASURED' or (d.get('electricity') or {}).get('status') == 'MEASURED'
+
+class SyncFilter:
+    """
+    Selects the hourly records newer than `last` from the usage responses.
+
+    Records which are not yet measured are held back until a measured record
+    follows, so the still open hours at the end are fetched again in the next sync.
+    """
+    def __init__(self, last):
+        self.last = last
+        self.pending = []
+
+    def add(self, j):
+        from summarizeeneco import getdata, cvdate
+        for d in getdata([j]):
+            if not (d and d.get('date')):
+                continue
+            t = cvdate(d['date'])
+            if self.last and t <= self.last:
+                continue
+            if not ismeasured(d):
+                self.pending.append(d)
+                continue
+            yield from self.pending
+            self.pending = []
+            self.last = t
+            yield d
 
 def decode_datetime(t):
     return datetime.strptime(t, "%Y-%m-%d")
 
+def windowend(start, per):
+    """
+    Returns the end of the `per` sized usage window starting at `start`.
+    """
+    days = dict(Day=1, Week=7, Month=31, Year=366)
+    return decode_datetime(start) + timedelta(days=days.get(per, 366))
+
+def windows(t0, t1, td):
+    """
+    list of the start times of all `td` sized windows from t0 upto t1.
+    """
+    l = []
+    t = t0
+    while t < t1:
+        l.append(t)
+        t += td
+    return l
+
 def main():
     import argparse
+    import stats
     parser = argparse.ArgumentParser(description='per uur gegevens van de mijn-eneco gebruiksgegevens')
     parser.add_argument('--debug', '-d', action='store_true', help=argparse.SUPPRESS) # 'print all intermediate steps'
     parser.add_argument('--verbose', action='store_true')
@@ -320,16 +800,31 @@ def main():
     parser.add_argument('--since', '--from', type=str, help='get usage from', metavar='DATE')
     parser.add_argument('--until', type=str, help='get usage until, default=now', metavar='DATE')
     parser.add_argument('--weeks', '-w', type=int, default=0, help='hoeveel weken')
+    parser.add_argument('--poolsize', type=int, default=4, help=argparse.SUPPRESS) # 'number of keep-alive connections per host'
+    parser.add_argument('--cache', type=str, default='~/.cache/energie', help='directory for caching past usage, default=~/.cache/energie')
+    parser.add_argument('--nocache', dest='cache', action='store_const', const=None, help='do not use the usage cache')
+    parser.add_argument('--tokens', type=str, default='~/.cache/energie/eneco-tokens.json', help=argparse.SUPPRESS) # 'file for caching the login token'
+    parser.add_argument('--notokencache', dest='tokens', action='store_const', const=None, help='always do the full login')
+    parser.add_argument('--timeout', type=float, default=60, help='timeout per request in seconds')
+    parser.add_argument('--retries', type=int, default=5, help='number of tries per request')
+    stats.addarguments(parser)
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='aantal weken dat tegelijk wordt opgehaald')
+    parser.add_argument('--sync', type=str, help='append the hours newer than the last one in STORE to STORE, a dump file or store directory', metavar='STORE')
+    parser.add_argument('--summarize', '-s', choices=['hour', 'day', 'week', 'month', 'year', 'eneco'], help='print the totals per period, instead of the json data')
+    parser.add_argument('--resume', action='store_true', help='skip the weeks completed by a previous interrupted run')
+    parser.add_argument('--journal', type=str, default='~/.cache/energie/eneco-journal.txt', help=argparse.SUPPRESS) # 'file recording the completed weeks'
     parser.add_argument('--username', '-u', type=str, help=argparse.SUPPRESS)
     parser.add_argument('--password', '-p', type=str, help=argparse.SUPPRESS)
     parser.add_argument('--config', help=argparse.SUPPRESS, default='~/.energierc') # 'specify configuration file.'
     args = parser.parse_args()
+    stats.fromargs(args)
 
     if args.config.startswith("~/"):
         import os
         homedir = os.environ['HOME']
         args.config = args.config.replace("~", homedir)
 
+    cfg = None
     try:
         cfg = loadconfig(args.config)
 
@@ -338,7 +833,16 @@ def main():
         print("Error in config: %s" % e)
 
     en = Eneco(args)
+    try:
+        run(en, args, cfg)
+    finally:
+        en.close()
+
 
+def run(en, args, cfg):
+    """
+    Login, and print or store the requested data.
+    """
     if not en.login(args.username, args.password):
         return
 
@@ -370,14 +874,25 @@ def main():
     if t0 is None:
         t0 = t1 - td*args.weeks
 
+    if args.sync:
+        sync(en, args.sync, t0, t1, args.jobs)
+        return
+
     if t0==t1:
         print("nothing to do, specify nr of weeks(-w), or --from + --until")
         return
-    t = t0
-    while t < t1:
-        j = en.getusage("%d-%d-%d" % (t.year, t.month, t.day), "Week", "Hour")
-        print(json.dumps(j))
-        t += td
+    if args.summarize:
+        from summarizeeneco import getdata, hourvalues, enecoperiod, contractperiods
+        from rollup import streamrollup
+        records = (d for j in fetchweeks(en, t0, t1, args.jobs) for d in STATS.iter('parse', getdata([j])))
+        for t, (g, e) in streamrollup(hourvalues(records), enecoperiod(args.summarize, contractperiods(cfg))):
+            print("%s %10.5f %10.5f" % (t, g, e), flush=True)
+        return
+
+    journal = Journal(args.journal, dict(provider='eneco', customerid=en.customerid, per='Week', interval='Hour'), args.resume)
+    for j in fetchweeks(en, t0, t1, args.jobs, journal=journal):
+        print(json.dumps(j), flush=True)
+    journal.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+"""
+One entry point for all tools, importing only the module of the command which is run.
+
+    python3 energie.py eneco --sync store/
+    python3 energie.py --timing summarizeeneco -d eneco.dat
+
+With `--timing` the time spent importing the command, running it, and the
+total since startup are printed to stderr. With `--stats` the import time is
+also recorded as the `import` timer.
+"""
+import time
+T0 = time.perf_counter()
+
+import sys
+import importlib
+
+COMMANDS = {
+    'eneco': 'fetch the hourly usage from eneco',
+    'vattenfall': 'fetch the hourly usage from vattenfall',
+    'batch': 'sync the stores of many accounts',
+    'summarizeeneco': 'summarize eneco dumps, stores or databases',
+    'summarizevatten': 'summarize vattenfall dumps, stores or databases',
+    'hourstore': 'import dumps into an hourly store',
+    'usagedb': 'load dumps or stores into a usage database',
+    'quality': 'report the quality flags of eneco hours',
+    'costs': 'compute the costs of the hourly usage',
+    'benchmark': 'time the parse, summarize and fetch steps',
+}
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Energy usage tools',
+            epilog="commands: " + ", ".join("%s - %s" % kv for kv in COMMANDS.items()))
+    parser.add_argument('--timing', action='store_true', help='print the import and run time of the command to stderr')
+    parser.add_argument('command', choices=list(COMMANDS), metavar='command')
+    parser.add_argument('args', nargs=argparse.REMAINDER, help='the arguments of the command, see energie.py COMMAND --help')
+    args = parser.parse_args()
+
+    t1 = time.perf_counter()
+    module = importlib.import_module(args.command)
+    t2 = time.perf_counter()
+
+    sys.argv = ["energie.py " + args.command] + args.args
+    try:
+        module.main()
+    finally:
+        t3 = time.perf_counter()
+        if args.timing:
+            print("startup %.1f ms, import %s %.1f ms, run %.1f ms, total %.1f ms" % (
+                1000*(t1-T0), args.command, 1000*(t2-t1), 1000*(t3-t2), 1000*(t3-T0)), file=sys.stderr)
+        from stats import STATS
+        STATS.observe('import', t2-t1, module=args.command)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Fetch a series of usage windows, optionally with several requests in flight.
+
+Used by both eneco.py and vattenfall.py, the `fetch` callback does the actual
+request over the already authenticated client session. `afetchwindows` does
+the same for the async clients.
+"""
+from collections import deque
+import threading
+import time
+
+from stats import STATS
+
+
+def fetchwindows(fetch, windows, jobs=1, executor=None):
+    """
+    Calls `fetch(w)` for each window in `windows`.
+    Yields (w, result) tuples in the same order as `windows`.
+
+    With jobs>1 at most `jobs` requests are in flight, and at most `jobs`
+    finished results are held back waiting for an earlier window.
+    The requests run in `executor` when specified, so several window
+    series can share one set of worker threads.
+    """
+    if STATS.enabled:
+        fetch = timedfetch(fetch)
+    if jobs <= 1 and not executor:
+        for w in windows:
+            yield w, fetch(w)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+    pending = deque()
+    pool = executor or ThreadPoolExecutor(max_workers=jobs)
+    try:
+        for w in windows:
+            if len(pending) >= jobs:
+                pw, f = pending.popleft()
+                yield pw, f.result()
+            pending.append((w, pool.submit(fetch, w)))
+        while pending:
+            pw, f = pending.popleft()
+            yield pw, f.result()
+    finally:
+        for _, f in pending:
+            f.cancel()
+        if not executor:
+            pool.shutdown()
+
+
+async def afetchwindows(fetch, windows, jobs=1):
+    """
+    Awaits `fetch(w)` for each window in `windows`, with at most `jobs` in flight.
+    Yields (w, result) tuples in the same order as `windows`.
+    """
+    import asyncio
+    if STATS.enabled:
+        fetch = atimedfetch(fetch)
+    pending = deque()
+    try:
+        for w in windows:
+            if len(pending) >= jobs:
+                pw, task = pending.popleft()
+                yield pw, await task
+            pending.append((w, asyncio.ensure_future(fetch(w))))
+        while pending:
+            pw, task = pending.popleft()
+            yield pw, await task
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+def atimedfetch(fetch):
+    async def timed(w):
+        with STATS.timer('window_fetch'):
+            return await fetch(w)
+    return timed
+
+
+def timedfetch(fetch):
+    def timed(w):
+        with STATS.timer('window_fetch'):
+            return fetch(w)
+    return timed
+
+
+class RateLimit:
+    """
+    Allows at most `rate` requests per second, shared by all threads using it.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def delay(self):
+        """
+        Reserves the next request slot, returns the seconds to wait for it.
+        """
+        with self.lock:
+            now = time.monotonic()
+            t = max(now, self.next)
+            self.next = t + self.interval
+        return t - now
+
+    def wait(self):
+        if (delay := self.delay()) > 0:
+            time.sleep(delay)
@@ -0,0 +1,322 @@
+"""
+A columnar store for hourly gas and electricity samples.
+
+The store is a directory with one binary file per column, each containing a
+plain array of fixed size values, and a `meta.json` with the provider name and
+the string tables for the enumerated columns.
+
+    hour            int32    hours since 1970-01-01 00:00 UTC
+    gas             float64  m3
+    elec_high       float64  kWh, for vattenfall: all electricity
+    elec_low        float64  kWh
+    redelivery      float64  kWh
+    gas_status      uint8    index in enums['status']
+    gas_collector   uint8    index in enums['collector']
+    elec_status     uint8
+    elec_collector  uint8
+    gas_errors      uint8    index in enums['errors']
+    elec_errors     uint8
+    flags           uint8    isDoubleTariff / isDoubleMeter bits, see FLAG_*
+
+Columns are appended to independently, after an interrupted append the
+columns are truncated to the shortest column when loading, and before the
+next append.
+"""
+import os
+import json
+import mmap
+import calendar
+from array import array
+from datetime import datetime, timedelta
+
+COLUMNS = [
+    ('hour', 'i'),
+    ('gas', 'd'),
+    ('elec_high', 'd'),
+    ('elec_low', 'd'),
+    ('redelivery', 'd'),
+    ('gas_status', 'B'),
+    ('gas_collector', 'B'),
+    ('elec_status', 'B'),
+    ('elec_collector', 'B'),
+    ('gas_errors', 'B'),
+    ('elec_errors', 'B'),
+    ('flags', 'B'),
+]
+
+FLAG_GAS_DOUBLETARIFF = 1
+FLAG_GAS_DOUBLEMETER = 2
+FLAG_ELEC_DOUBLETARIFF = 4
+FLAG_ELEC_DOUBLEMETER = 8
+
+# enumerated columns and the enum table they use.
+ENUMS = {
+    'gas_status': 'status', 'elec_status': 'status',
+    'gas_collector': 'collector', 'elec_collector': 'collector',
+    'gas_errors': 'errors', 'elec_errors': 'errors',
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def isstore(path):
+    """
+    A path names a store when it is a directory, or ends in a slash.
+    """
+    return os.path.isdir(path) or path.endswith(os.sep)
+
+
+def localtime(h):
+    """
+    Converts hours since the epoch to a naive Europe/Amsterdam datetime.
+    """
+    from timestamps import AMSTERDAM
+    return EPOCH + timedelta(hours=AMSTERDAM.local(h))
+
+
+def utchour(t):
+    """
+    Converts a naive utc datetime to hours since the epoch.
+    """
+    return calendar.timegm(t.timetuple()) // 3600
+
+
+def hourtime(h):
+    """
+    Converts hours since the epoch to a naive utc datetime.
+    """
+    return EPOCH + timedelta(hours=h)
+
+
+class HourStore:
+    def __init__(self, path, provider=None):
+        self.path = path
+        self.meta = dict(provider=provider, version=1, enums=dict(status=[None], collector=[None], errors=[None]))
+        metafile = os.path.join(path, "meta.json")
+        if os.path.exists(metafile):
+            with open(metafile, "r") as fh:
+                self.meta = json.load(fh)
+
+    @property
+    def provider(self):
+        return self.meta.get('provider')
+
+    def columnfile(self, name):
+        return os.path.join(self.path, name + ".bin")
+
+    def savemeta(self):
+        os.makedirs(self.path, exist_ok=True)
+        metafile = os.path.join(self.path, "meta.json")
+        with open(metafile + ".tmp", "w") as fh:
+            json.dump(self.meta, fh)
+        os.replace(metafile + ".tmp", metafile)
+
+    def enum(self, column, value):
+        """
+        Returns the small int code for `value` in an enumerated column.
+        """
+        if type(value) == list:
+            value = ",".join(value)
+        table = self.meta['enums'][ENUMS[column]]
+        try:
+            return table.index(value)
+        except ValueError:
+            if len(table) >= 255:
+                raise Exception("too many different values for %s" % column)
+            table.append(value)
+            return len(table)-1
+
+    def name(self, column, code):
+        """
+        Returns the string value for code `code` in an enumerated column.
+        """
+        return self.meta['enums'][ENUMS[column]][code]
+
+    def append(self, rows):
+        """
+        Append a list of rows, each row is a dict with column values,
+        missing columns are stored as 0, enumerated columns take strings.
+        """
+        if not rows:
+            return
+        cols = { name: array(tc) for name, tc in COLUMNS }
+        for r in rows:
+            for name, tc in COLUMNS:
+                v = r.get(name)
+                if name in ENUMS:
+                    v = self.enum(name, v)
+                cols[name].append(v or 0)
+        # the meta data is saved first, so all enum codes in the columns are known.
+        self.savemeta()
+        # drop the rows left by an interrupted append, so the columns stay aligned.
+        n = self.nrows()
+        for name, tc in COLUMNS:
+            with open(self.columnfile(name), "ab") as fh:
+                fh.truncate(n * array(tc).itemsize)
+                cols[name].tofile(fh)
+
+    def nrows(self):
+        n = None
+        for name, tc in COLUMNS:
+            try:
+                size = os.path.getsize(self.columnfile(name)) // array(tc).itemsize
+            except FileNotFoundError:
+                size = 0
+            n = size if n is None else min(n, size)
+        return n
+
+    def load(self, columns=None):
+        """
+        Returns a dict of column name -> array
+        """
+        n = self.nrows()
+        result = {}
+        for name, tc in COLUMNS:
+            if columns and name not in columns:
+                continue
+            a = array(tc)
+            if n:
+                with open(self.columnfile(name), "rb") as fh:
+                    a.fromfile(fh, n)
+            result[name] = a
+        return result
+
+    def mmap(self, columns=None):
+        """
+        Returns a dict of column name -> memoryview on a read-only mapping of the column file.
+        """
+        n = self.nrows()
+        result = {}
+        for name, tc in COLUMNS:
+            if columns and name not in columns:
+                continue
+            if not n:
+                result[name] = memoryview(array(tc))
+                continue
+            with open(self.columnfile(name), "rb") as fh:
+                m = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            result[name] = memoryview(m)[:n*array(tc).itemsize].cast(tc)
+        return result
+
+    def lasthour(self):
+        """
+        Returns the newest hour in the store, or None
+        """
+        hours = self.mmap(['hour'])['hour']
+        if len(hours):
+            return max(hours)
+
+
+def measurementcolumns(prefix, m, row):
+    if not m:
+        return
+    row[prefix + '_status'] = m.get('status')
+    row[prefix + '_collector'] = m.get('collectorType')
+    row[prefix + '_errors'] = m.get('errorCodes')
+
+
+def enecorow(d):
+    """
+    Converts an eneco `actual` record to a store row.
+    """
+    from timestamps import isohour
+    gas = d.get('gas') or {}
+    elec = d.get('electricity') or {}
+    redelivery = d.get('redelivery') or {}
+    flags = 0
+    if gas.get('isDoubleTariff'): flags |= FLAG_GAS_DOUBLETARIFF
+    if gas.get('isDoubleMeter'): flags |= FLAG_GAS_DOUBLEMETER
+    if elec.get('isDoubleTariff'): flags |= FLAG_ELEC_DOUBLETARIFF
+    if elec.get('isDoubleMeter'): flags |= FLAG_ELEC_DOUBLEMETER
+    row = dict(
+        hour = isohour(d['date']),
+        # the gas usage is in high, as in summarizeeneco and usagedb
+        gas = gas.get('high'),
+        elec_high = elec.get('high'),
+        elec_low = elec.get('low'),
+        redelivery = (redelivery.get('high') or 0) + (redelivery.get('low') or 0),
+        flags = flags,
+    )
+    measurementcolumns('gas', gas, row)
+    measurementcolumns('elec', elec, row)
+    return row
+
+
+def enecorecord(store, cols, i):
+    """
+    Converts row `i` back to an eneco `actual` like record, as used by summarizeeneco.
+    """
+    def measurement(prefix, high, low, flags):
+        errors = store.name(prefix + '_errors', cols[prefix + '_errors'][i])
+        return dict(
+            status = store.name(prefix + '_status', cols[prefix + '_status'][i]),
+            collectorType = store.name(prefix + '_collector', cols[prefix + '_collector'][i]),
+            errorCodes = errors.split(",") if errors else None,
+            isDoubleTariff = bool(cols['flags'][i] & flags[0]),
+            isDoubleMeter = bool(cols['flags'][i] & flags[1]),
+            high = high,
+            low = low,
+        )
+    return dict(
+        date = f"{hourtime(cols['hour'][i]):%Y-%m-%dT%H:%M:%S}Z",
+        gas = measurement('gas', cols['gas'][i], 0, (FLAG_GAS_DOUBLETARIFF, FLAG_GAS_DOUBLEMETER)),
+        electricity = measurement('elec', cols['elec_high'][i], cols['elec_low'][i], (FLAG_ELEC_DOUBLETARIFF, FLAG_ELEC_DOUBLEMETER)),
+    )
+
+
+def vattenfallrows(j, seen=None):
+    """
+    Converts a vattenfall consumption response to store rows,
+    gas and electricity for the same hour are combined in one row.
+
+    `seen` counts the (product, local hour number) records already stored,
+    needed to convert the repeated hour at the end of DST.
+    """
+    from summarizevatten import gethours
+    from timestamps import AMSTERDAM
+    rows = {}
+    seen = dict(seen or {})
+    for product, lh, q, qr in gethours([j]):
+        # the hour repeated at the end of DST is reported twice with the same local time.
+        fold = seen.get((product, lh), 0)
+        seen[(product, lh)] = fold + 1
+        h = AMSTERDAM.utc(lh, fold)
+        row = rows.setdefault(h, dict(hour=h))
+        if product == 'E':
+            row['elec_high'] = q
+            row['redelivery'] = qr
+        else:
+            row['gas'] = q - qr
+    return [rows[h] for h in sorted(rows)]
+
+
+def main():
+    """
+    Import the output of eneco.py or vattenfall.py into a store.
+    """
+    import argparse
+    import stats
+    parser = argparse.ArgumentParser(description='import eneco or vattenfall dumps into an hourly store')
+    parser.add_argument('--provider', choices=['eneco', 'vattenfall'], default='eneco')
+    stats.addarguments(parser)
+    parser.add_argument('store', type=str)
+    parser.add_argument('filenames', type=str, nargs='+')
+    args = parser.parse_args()
+    stats.fromargs(args)
+
+    store = HourStore(args.store, args.provider)
+    if store.provider != args.provider:
+        print("store contains %s data" % store.provider)
+        return
+    for fn in args.filenames:
+        with open(fn, "r") as fh, stats.STATS.timer('import', provider=args.provider):
+            if args.provider == 'eneco':
+                from summarizeeneco import readlines, getdata
+                store.append([enecorow(d) for d in getdata(readlines(fh)) if d and d.get('date')])
+            else:
+                from summarizevatten import readlines
+                for j in readlines(fh):
+                    store.append(vattenfallrows(j))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,336 @@
+"""
+A small keep-alive http connection pool.
+
+urllib opens a new connection for every request, this keeps HTTP/1.1
+connections open and reuses them per host.
+
+AsyncConnectionPool does the same with asyncio streams, for the async
+clients, so one event loop can have many requests in flight.
+
+http.client, which also imports ssl and email, is imported when a request
+is made, so the tools start fast.
+"""
+import urllib.parse
+import threading
+import zlib
+import sys
+import io
+
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+class Response:
+    """
+    A fully read http response, with the same attributes as used from
+    the urllib response objects: status, reason, headers, url and read().
+    """
+    def __init__(self, url, status, reason, headers, data):
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.data = data
+
+    def read(self):
+        return self.data
+
+    def __str__(self):
+        return "HTTP Error %d: %s" % (self.status, self.reason)
+
+
+def decodebody(data, encoding):
+    """
+    Decode a gzip or deflate encoded response body.
+    """
+    encoding = (encoding or '').lower()
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompress(data, 16+zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        try:
+            return zlib.decompress(data)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+    return data
+
+
+def requestheaders(headers):
+    hdrs = {
+        "User-Agent": "Python-urllib/%d.%d" % sys.version_info[:2],
+        "Accept-Encoding": "gzip, deflate",
+        "Connection": "keep-alive",
+    }
+    hdrs.update(headers)
+    return hdrs
+
+
+def redirect(response, method, data, headers):
+    """
+    Returns the (url, method, data, headers) to follow a redirect response with,
+    in the same way as urllib does, or None when `response` is not a redirect.
+    """
+    location = response.headers.get('location')
+    if response.status not in REDIRECTS or not location:
+        return
+    url = urllib.parse.urljoin(response.url, location)
+    if response.status in (301, 302, 303) and method == "POST":
+        method, data = "GET", None
+        headers = { k:v for k, v in headers.items() if k.lower() != 'content-type' }
+    return url, method, data, headers
+
+
+class ConnectionPool:
+    """
+    Keeps up to `maxsize` idle connections per (scheme, host, port).
+
+    The `retrier` is used by the clients for retrying requests, it lives
+    here so all clients sharing a pool also share the per host state.
+    """
+    def __init__(self, maxsize=4, timeout=60, debuglevel=0, retrier=None):
+        from retry import Retrier
+        self.retrier = retrier or Retrier()
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.debuglevel = debuglevel
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def getconnection(self, key):
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                return conns.pop()
+        import http.client
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        conn.set_debuglevel(self.debuglevel)
+        return conn
+
+    def putconnection(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.maxsize:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def send(self, method, url, body, headers):
+        """
+        Does a single request, without following redirects.
+        A connection which was closed by the server while idle is retried once
+        with a fresh connection.
+        """
+        u = urllib.parse.urlsplit(url)
+        key = (u.scheme, u.hostname, u.port)
+        path = u.path or "/"
+        if u.query:
+            path += "?" + u.query
+        hdrs = requestheaders(headers)
+
+        import http.client
+        for attempt in range(2):
+            conn = self.getconnection(key)
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, body=body, headers=hdrs)
+                response = conn.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self.putconnection(key, conn)
+            data = decodebody(data, response.headers.get('content-encoding'))
+            return Response(url, response.status, response.reason, response.headers, data)
+
+    def request(self, url, data=None, headers={}, maxredirects=10):
+        """
+        Does a http-GET, or a http-POST when `data` is specified.
+        Redirects are followed in the same way as urllib does.
+        """
+        method = "POST" if data is not None else "GET"
+        for _ in range(maxredirects+1):
+            response = self.send(method, url, data, headers)
+            follow = redirect(response, method, data, headers)
+            if not follow:
+                return response
+            url, method, data, headers = follow
+        return response
+
+
+class AsyncConnectionPool:
+    """
+    Keeps up to `maxsize` idle asyncio stream connections per (scheme, host, port).
+
+    With `limit`, at most that many requests are in flight at once, for all hosts.
+    The pool must be used from a single event loop.
+    """
+    def __init__(self, maxsize=4, timeout=60, debuglevel=0, retrier=None, limit=None):
+        from retry import Retrier
+        self.retrier = retrier or Retrier()
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.debuglevel = debuglevel
+        self.limit = limit
+        self.slots = None
+        self.idle = {}
+
+    async def getconnection(self, key):
+        import asyncio
+        conns = self.idle.get(key)
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        scheme, host, port = key
+        if scheme == 'https':
+            import ssl
+            reader, writer = await asyncio.open_connection(host, port or 443, ssl=ssl.create_default_context())
+        else:
+            reader, writer = await asyncio.open_connection(host, port or 80)
+        return reader, writer, False
+
+    def putconnection(self, key, reader, writer):
+        conns = self.idle.setdefault(key, [])
+        if len(conns) < self.maxsize:
+            conns.append((reader, writer))
+            return
+        writer.close()
+
+    async def close(self):
+        idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for reader, writer in conns:
+                writer.close()
+
+    async def exchange(self, reader, writer, method, host, path, body, hdrs):
+        """
+        Writes one request, returns (status, reason, headers, data, will_close).
+        """
+        import http.client
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % host]
+        lines += ["%s: %s" % kv for kv in hdrs.items()]
+        if body is not None:
+            lines.append("Content-Length: %d" % len(body))
+        if self.debuglevel:
+            print("send:", lines)
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + (body or b""))
+        await writer.drain()
+
+        statusline = await reader.readline()
+        if not statusline:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        if self.debuglevel:
+            print("reply:", statusline)
+        line = statusline.decode('latin-1').rstrip("\r\n")
+        version, status, reason = (line.split(None, 2) + ["", ""])[:3]
+        if not version.startswith("HTTP/") or len(status) != 3 or not status.isdigit():
+            raise http.client.BadStatusLine(line)
+        status = int(status)
+        raw = []
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            raw.append(line)
+        headers = http.client.parse_headers(io.BytesIO(b"".join(raw) + b"\r\n"))
+
+        connection = (headers.get('connection') or '').lower()
+        will_close = connection == 'close' or (version == "HTTP/1.0" and connection != 'keep-alive')
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            data = b""
+        elif (headers.get('transfer-encoding') or '').lower() == 'chunked':
+            chunks = []
+            while size := int((await reader.readline()).split(b";")[0], 16):
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            # skip the trailers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            data = b"".join(chunks)
+        elif (length := headers.get('content-length')) is not None:
+            data = await reader.readexactly(int(length))
+        else:
+            data = await reader.read()
+            will_close = True
+        return status, reason, headers, data, will_close
+
+    async def send(self, method, url, body, headers):
+        """
+        Does a single request, without following redirects.
+        A connection which was closed by the server while idle is retried once
+        with a fresh connection.
+        """
+        import asyncio
+        import http.client
+        u = urllib.parse.urlsplit(url)
+        key = (u.scheme, u.hostname, u.port)
+        path = u.path or "/"
+        if u.query:
+            path += "?" + u.query
+        hdrs = requestheaders(headers)
+
+        for attempt in range(2):
+            # the connect and tls handshake have the same timeout as the exchange
+            try:
+                reader, writer, reused = await asyncio.wait_for(self.getconnection(key), self.timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError("connect timeout for %s" % url)
+            try:
+                status, reason, rhdrs, data, will_close = await asyncio.wait_for(
+                        self.exchange(reader, writer, method, u.netloc, path, body, hdrs), self.timeout)
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError) as e:
+                writer.close()
+                if reused and attempt == 0:
+                    continue
+                if isinstance(e, asyncio.IncompleteReadError):
+                    raise http.client.IncompleteRead(e.partial)
+                raise
+            except asyncio.TimeoutError:
+                writer.close()
+                raise TimeoutError("timeout for %s" % url)
+            except BaseException:
+                writer.close()
+                raise
+            if will_close:
+                writer.close()
+            else:
+                self.putconnection(key, reader, writer)
+            data = decodebody(data, rhdrs.get('content-encoding'))
+            return Response(url, status, reason, rhdrs, data)
+
+    async def request(self, url, data=None, headers={}, maxredirects=10):
+        """
+        Does a http-GET, or a http-POST when `data` is specified.
+        Redirects are followed in the same way as urllib does.
+        """
+        import asyncio
+        if self.limit and self.slots is None:
+            self.slots = asyncio.Semaphore(self.limit)
+        method = "POST" if data is not None else "GET"
+        for _ in range(maxredirects+1):
+            if self.slots:
+                async with self.slots:
+                    response = await self.send(method, url, data, headers)
+            else:
+                response = await self.send(method, url, data, headers)
+            follow = redirect(response, method, data, headers)
+            if not follow:
+                return response
+            url, method, data, headers = follow
+        return response
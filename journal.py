@@ -0,0 +1,109 @@
+"""
+A checkpoint journal of completed usage windows, for resuming a long backfill.
+
+The journal is a text file with a json header naming the account and the kind
+of windows, followed by one line per completed window: "<start> <end>", as
+dates, the end exclusive. Lines are appended and flushed after the output for
+a window has been written, so after a crash the journal never lists a window
+whose data is missing from the output, at worst a window is fetched twice.
+
+Only closed windows are recorded, windows which can still change, see
+`usagecache.isclosed`, are always fetched again.
+"""
+import os
+import json
+from datetime import datetime
+
+from usagecache import isclosed
+
+
+class Journal:
+    def __init__(self, filename, header, resume=False):
+        """
+        Opens the journal in `filename` for windows described by `header`, a dict.
+
+        With `resume` the windows in an existing journal with the same header
+        are treated as done. Without, all windows are fetched again, and
+        recorded in the same journal, so a plain rerun does not lose the
+        checkpoint of an interrupted backfill. A journal with another header
+        is started anew.
+        """
+        self.filename = os.path.expanduser(filename)
+        self.header = header
+        entries, complete = self.read()
+        self.done = entries if resume and entries else []
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        if entries is not None:
+            self.fh = open(self.filename, "a")
+            if not complete:
+                # end the line cut short by a crash
+                print(file=self.fh, flush=True)
+        else:
+            self.fh = open(self.filename, "w")
+            print(json.dumps(header), file=self.fh, flush=True)
+
+    def read(self):
+        """
+        Returns the windows in the journal, or None when it does not exist or
+        has another header, and whether the last line is complete.
+        """
+        entries = []
+        line = "\n"
+        try:
+            with open(self.filename, "r") as fh:
+                if json.loads(fh.readline() or "null") != self.header:
+                    return None, True
+                lines = list(fh)
+        except (FileNotFoundError, ValueError):
+            return None, True
+        for line in lines:
+            # skip a line cut short by a crash, also after it was ended by the next run
+            try:
+                start, end = (datetime.strptime(_, "%Y-%m-%d") for _ in line.split())
+            except ValueError:
+                continue
+            if line.endswith("\n"):
+                entries.append((start, end))
+        return entries, line.endswith("\n")
+
+    def iscomplete(self, tstart, tend):
+        """
+        True when [tstart, tend) is covered by the completed windows.
+        """
+        for a, b in sorted(self.done):
+            if a > tstart:
+                return False
+            if b > tstart:
+                tstart = b
+            if tstart >= tend:
+                return True
+        return tstart >= tend
+
+    def align(self, t0, td):
+        """
+        Returns the midnight at or before `t0` which is on the same `td` grid as
+        the completed windows, so a rerun on a later day requests the same windows.
+        """
+        t = datetime(t0.year, t0.month, t0.day)
+        if self.done:
+            t -= (t - min(a for a, b in self.done)) % td
+        return t
+
+    def pending(self, windows, td):
+        """
+        Returns the windows of size `td` which are not yet complete.
+        """
+        return [ t for t in windows if not self.iscomplete(t, t+td) ]
+
+    def complete(self, tstart, tend):
+        """
+        Record that the output for [tstart, tend) has been written.
+        """
+        if not isclosed(tend):
+            return
+        self.done.append((tstart, tend))
+        print("%s %s" % (f"{tstart:%Y-%m-%d}", f"{tend:%Y-%m-%d}"), file=self.fh, flush=True)
+        os.fsync(self.fh.fileno())
+
+    def close(self):
+        self.fh.close()
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+"""
+Data quality flags for the eneco measurements, encoded as a bitmask per measurement.
+
+The flags are determined once when records are loaded into a usage database,
+which keeps them in the `quality` column with an index on the flagged rows,
+so finding the flagged hours, or the fraction of flagged hours per period
+does not need to look at the other hours.
+
+    python3 quality.py usage.db --flag gas:interpolated --since 2021-01-01 --until 2022-01-01 --list
+    python3 quality.py usage.db --permonth
+"""
+from array import array
+
+NOTMEASURED = 1         # status is not MEASURED
+INTERPOLATED = 2        # collectorType Interpolated
+METERINERROR = 4        # collectorType MeterInError
+MIXED = 8               # collectorType Mixed
+COLLECTOR = 16          # any other collectorType than P4
+TARIFF = 32             # isDoubleTariff or isDoubleMeter differ from the expected value
+EP4_012 = 64            # errorCodes
+F1000 = 128
+ERROR = 256             # any other error code
+OTHERUSAGE = 512        # the record has warmth, redelivery, produced or tapWater
+
+FLAGS = {
+    'notmeasured': NOTMEASURED,
+    'interpolated': INTERPOLATED,
+    'meterinerror': METERINERROR,
+    'mixed': MIXED,
+    'collector': COLLECTOR,
+    'tariff': TARIFF,
+    'ep4_012': EP4_012,
+    'f1000': F1000,
+    'error': ERROR,
+    'otherusage': OTHERUSAGE,
+}
+
+COLLECTORS = { 'P4': 0, 'Interpolated': INTERPOLATED, 'MeterInError': METERINERROR, 'Mixed': MIXED }
+ERRORCODES = { 'EP4_012': EP4_012, 'F1000': F1000 }
+
+# the flags for which summarizeeneco.check fails, error codes alone do not.
+CHECKFLAGS = NOTMEASURED | INTERPOLATED | METERINERROR | MIXED | COLLECTOR | TARIFF | OTHERUSAGE
+
+
+def flags(status, collector, errors, doubletariff, doublemeter, double):
+    """
+    Returns the quality bitmask for one measurement, `double` is the expected
+    value of doubletariff and doublemeter, `errors` a comma separated string.
+    """
+    q = 0
+    if status != 'MEASURED':
+        q |= NOTMEASURED
+    if collector != 'P4':
+        q |= COLLECTORS.get(collector, COLLECTOR)
+    if not (doubletariff == doublemeter == double):
+        q |= TARIFF
+    for code in (errors or "").split(","):
+        if code:
+            q |= ERRORCODES.get(code, ERROR)
+    return q
+
+
+def measurementflags(m, double):
+    """
+    Returns the quality bitmask for an eneco measurement dict.
+    """
+    if not m:
+        return NOTMEASURED | COLLECTOR
+    errors = m.get('errorCodes')
+    return flags(m.get('status'), m.get('collectorType'), ",".join(errors) if errors else None,
+            m.get('isDoubleTariff'), m.get('isDoubleMeter'), double)
+
+
+def recordflags(d):
+    """
+    Returns the gas and electricity bitmasks for an eneco `actual` record,
+    the OTHERUSAGE flag is set on the electricity.
+    """
+    other = OTHERUSAGE if any(d.get(_) for _ in ('warmth', 'redelivery', 'produced', 'tapWater')) else 0
+    return measurementflags(d.get('gas'), False), measurementflags(d.get('electricity'), True) | other
+
+
+def parseflags(text):
+    """
+    Converts "gas:interpolated,error" like text to (product, mask), the product is optional.
+    """
+    product, _, names = text.rpartition(":")
+    mask = 0
+    for name in names.split(","):
+        if name.lower() not in FLAGS:
+            raise ValueError("unknown quality flag %s, use one of %s" % (name, ", ".join(FLAGS)))
+        mask |= FLAGS[name.lower()]
+    return { '': None, 'gas': 'G', 'electricity': 'E', 'elec': 'E' }[product.lower()], mask
+
+
+def describe(mask):
+    return ",".join(name for name, bit in FLAGS.items() if mask & bit)
+
+
+def main():
+    import argparse
+    import stats
+    from usagedb import UsageDB, defaultaccount
+    from datetime import datetime
+    from hourstore import utchour
+    from rollup import rollup, labeler
+    parser = argparse.ArgumentParser(description='find the eneco hours with data quality flags in a usage database')
+    parser.add_argument('--account', '-a', type=str, help='the eneco account')
+    parser.add_argument('--flag', '-f', type=str, default='', help='[gas:|electricity:]flag,..., flags: %s, default: any' % ", ".join(FLAGS))
+    parser.add_argument('--since', '--from', type=str, help='from date', metavar='DATE')
+    parser.add_argument('--until', type=str, help='until date', metavar='DATE')
+    parser.add_argument('--list', '-l', action='store_true', help='list the flagged hours')
+    parser.add_argument('--perday', '-d', action='store_true')
+    parser.add_argument('--perweek', '-w', action='store_true')
+    parser.add_argument('--permonth', '-m', action='store_true')
+    parser.add_argument('--peryear', '-y', action='store_true')
+    stats.addarguments(parser)
+    parser.add_argument('database', type=str)
+    args = parser.parse_args()
+    stats.fromargs(args)
+
+    if args.perday:
+        period = 'day'
+    elif args.perweek:
+        period = 'week'
+    elif args.permonth:
+        period = 'month'
+    else:
+        period = 'year'
+
+    product, mask = parseflags(args.flag) if args.flag else (None, sum(FLAGS.values()))
+    h0 = utchour(datetime.strptime(args.since, "%Y-%m-%d")) if args.since else None
+    h1 = utchour(datetime.strptime(args.until, "%Y-%m-%d")) if args.until else None
+
+    db = UsageDB(args.database, readonly=True)
+    account = defaultaccount(db, 'eneco', args.account)
+    with stats.STATS.timer('query', kind='flagged'):
+        rows = db.flagged('eneco', account, mask, product, h0, h1)
+    if args.list:
+        label = labeler('hour')
+        for hour, prod, q in rows:
+            print("%s %s %s" % (label(hour), prod, describe(q)))
+        return
+
+    hours = array('l', sorted({ hour for hour, prod, q in rows }))
+    flagged, = rollup(hours, [array('d', [1]) * len(hours)], period)
+    with stats.STATS.timer('query', kind='hourcounts'):
+        total = db.hourcounts('eneco', account, period, h0, h1)
+    for t in sorted(total.keys()):
+        print("%s %6d %6d %8.4f" % (t, total[t], flagged[t], flagged[t] / total[t] if total[t] else 0))
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Render hourly totals as an hour by day table, for the `--columns` output of the summarize tools.
+
+The labelled totals are pivoted once into a 24 x days array, which is then
+written as text, csv or tsv with one write per table, or as a parquet file
+with one row per hour when pyarrow is installed.
+"""
+import sys
+from array import array
+
+FORMATS = ['text', 'csv', 'tsv', 'parquet']
+
+# the hour part of the hour labels
+HOURS = { " %02d" % h: h for h in range(24) }
+
+
+def pivot(table):
+    """
+    Converts a dict "%Y-%m-%d %H" -> total to a sorted list of dates, and an
+    array with the totals per hour, 24 rows of len(dates) values.
+    Labels of other periods only add their date, without values.
+    """
+    dates = sorted({ k[:10] for k in table })
+    column = { d: i for i, d in enumerate(dates) }
+    n = len(dates)
+    matrix = array('d', bytes(8*24*n))
+    for k, v in table.items():
+        if (h := HOURS.get(k[10:])) is not None:
+            matrix[h*n + column[k[:10]]] = v
+    return dates, matrix
+
+
+def rows(dates, matrix):
+    n = len(dates)
+    for h in range(24):
+        yield h, matrix[h*n:(h+1)*n]
+
+
+def text(dates, matrix):
+    """
+    Formats the pivot as the table printed by `--columns`.
+    """
+    n = len(dates)
+    lines = ["--", "       " + "".join("%8s " % d[5:] for d in dates)]
+    cell = "%8.3f " * n
+    for h, values in rows(dates, matrix):
+        lines.append(f"{h:02d}:00  " + cell % tuple(values))
+    return "\n".join(lines) + "\n"
+
+
+def writetext(fh, tables):
+    fh.write("".join(text(*pivot(table)) for name, table in tables))
+
+
+def writecsv(fh, tables, delimiter=","):
+    """
+    Writes a row per table and hour, with the totals per date in columns.
+    """
+    import csv
+    w = csv.writer(fh, delimiter=delimiter, lineterminator="\n")
+    for name, table in tables:
+        dates, matrix = pivot(table)
+        w.writerow(['table', 'hour'] + dates)
+        w.writerows([name, "%02d:00" % h] + ["%.5f" % v for v in values] for h, values in rows(dates, matrix))
+
+
+def writeparquet(filename, tables):
+    """
+    Writes one row per date and hour, with a column per table.
+    """
+    import pyarrow
+    import pyarrow.parquet
+    pivots = [(name, pivot(table)) for name, table in tables]
+    dates = sorted(set(d for name, (dd, m) in pivots for d in dd))
+    columns = { 'date': [d for d in dates for h in range(24)], 'hour': list(range(24)) * len(dates) }
+    for name, (dd, m) in pivots:
+        n, column = len(dd), { d: i for i, d in enumerate(dd) }
+        columns[name] = [m[h*n + column[d]] if d in column else 0.0 for d in dates for h in range(24)]
+    pyarrow.parquet.write_table(pyarrow.table(columns), filename)
+
+
+def formaterror(fmt, output):
+    """
+    Returns why `fmt` can not be written to `output`, or None.
+    """
+    if fmt == 'parquet':
+        if not output:
+            return "--format parquet needs an --output file"
+        import importlib.util
+        if importlib.util.find_spec('pyarrow') is None:
+            return "--format parquet needs the pyarrow package"
+
+
+def write(tables, fmt='text', output=None):
+    """
+    Writes the (name, table) pairs in format `fmt` to `output`, default stdout.
+    """
+    if fmt == 'parquet':
+        return writeparquet(output, tables)
+    fh = open(output, "w", newline="") if output else sys.stdout
+    try:
+        if fmt == 'text':
+            writetext(fh, tables)
+        else:
+            writecsv(fh, tables, "\t" if fmt == 'tsv' else ",")
+    finally:
+        if output:
+            fh.close()
@@ -0,0 +1,185 @@
+"""
+Retry with exponential backoff for the http requests.
+
+Retries idempotent requests on timeouts, connection errors and 429/5xx
+responses, respecting the Retry-After header. After `threshold` consecutive failures for a host, the
+circuit for that host opens: all requests to it pause for `cooldown` seconds,
+so concurrent requests slow down together instead of all failing.
+
+`call` is used by the blocking clients, `acall` by the async clients, both
+share the per host state.
+"""
+import random
+import socket
+import threading
+import time
+import urllib.parse
+
+from stats import STATS
+
+RETRYSTATUS = (429, 500, 502, 503, 504)
+
+
+def retryerrors():
+    """
+    The exceptions after which a request is retried.
+
+    These, and the requesterrors, are functions so http.client is only imported
+    when an exception is caught, by then it was imported for the request.
+    """
+    import http.client
+    return (socket.timeout, TimeoutError, ConnectionError, http.client.IncompleteRead, http.client.RemoteDisconnected, OSError)
+
+
+def requesterrors():
+    """
+    The exceptions a failed request can raise.
+    """
+    import http.client
+    return (OSError, http.client.HTTPException)
+
+
+def retryafter(response):
+    """
+    Returns the delay in seconds from a Retry-After header, or None
+    """
+    value = response.headers.get('retry-after')
+    if not value:
+        return
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return
+
+
+class Retrier:
+    def __init__(self, tries=5, base=0.5, cap=60, threshold=5, cooldown=30):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.openuntil = {}
+
+        # counters
+        self.requests = 0
+        self.retries = 0
+        self.waited = 0.0
+
+    def backoff(self, attempt):
+        """
+        exponential backoff with full jitter
+        """
+        return random.uniform(0, min(self.cap, self.base * 2**attempt))
+
+    def waiting(self, delay):
+        with self.lock:
+            self.waited += delay
+        STATS.observe('retry_wait', delay)
+        return delay
+
+    def sleep(self, delay):
+        time.sleep(self.waiting(delay))
+
+    def circuitdelay(self, host):
+        with self.lock:
+            return self.openuntil.get(host, 0) - time.monotonic()
+
+    def attempt(self, host, attempt):
+        with self.lock:
+            self.requests += 1
+            if attempt:
+                self.retries += 1
+        if attempt:
+            STATS.count('http_retries', host=host)
+
+    def triesfor(self, idempotent):
+        return max(1, self.tries) if idempotent else 1
+
+    def retrydelay(self, host, attempt, tries, response):
+        """
+        Returns the delay before retrying `response`, or None when it should be returned.
+        """
+        STATS.count('http_responses', status=response.status)
+        if response.status not in RETRYSTATUS:
+            self.result(host, True)
+            return
+        self.result(host, False)
+        if attempt+1 == tries:
+            return
+        delay = retryafter(response)
+        return min(self.cap, delay) if delay is not None else self.backoff(attempt)
+
+    def result(self, host, ok):
+        with self.lock:
+            if ok:
+                self.failures[host] = 0
+                return
+            self.failures[host] = n = self.failures.get(host, 0) + 1
+            if n >= self.threshold:
+                self.openuntil[host] = time.monotonic() + self.cooldown
+                self.failures[host] = 0
+
+    def call(self, fn, url, idempotent=True):
+        """
+        Calls `fn`, which does a request for `url` and returns the response.
+        Requests which are not `idempotent`, like a login POST, are tried once.
+
+        Returns the response, which can still be a 429 or 5xx response when
+        all tries failed. Raises the last exception when all tries failed
+        with an exception.
+        """
+        host = urllib.parse.urlsplit(url).hostname
+        tries = self.triesfor(idempotent)
+        for attempt in range(tries):
+            if (delay := self.circuitdelay(host)) > 0:
+                self.sleep(delay)
+            self.attempt(host, attempt)
+            try:
+                response = fn()
+            except retryerrors() as e:
+                self.result(host, False)
+                if attempt+1 == tries:
+                    raise
+                self.sleep(self.backoff(attempt))
+                continue
+
+            delay = self.retrydelay(host, attempt, tries, response)
+            if delay is None:
+                return response
+            self.sleep(delay)
+
+    async def acall(self, fn, url, idempotent=True):
+        """
+        Like `call`, for a coroutine function `fn`.
+        """
+        import asyncio
+        host = urllib.parse.urlsplit(url).hostname
+        tries = self.triesfor(idempotent)
+        for attempt in range(tries):
+            if (delay := self.circuitdelay(host)) > 0:
+                await asyncio.sleep(self.waiting(delay))
+            self.attempt(host, attempt)
+            try:
+                response = await fn()
+            except retryerrors() as e:
+                self.result(host, False)
+                if attempt+1 == tries:
+                    raise
+                await asyncio.sleep(self.waiting(self.backoff(attempt)))
+                continue
+
+            delay = self.retrydelay(host, attempt, tries, response)
+            if delay is None:
+                return response
+            await asyncio.sleep(self.waiting(delay))
+
+    def stats(self):
+        return "%d requests, %d retries, %.1f seconds waiting" % (self.requests, self.retries, self.waited)
@@ -0,0 +1,320 @@
+"""
+Batch aggregation of hourly values into hour, day, week, month, year
+or contract period totals.
+
+The input is an array of hour numbers: hours since 1970-01-01 00:00 on the
+same timeline as the labels should be in, and one or more arrays of values.
+Instead of formatting a label for every hour, the hours are sorted once, the
+period boundaries are located with bisect, and each period is summed as an
+array slice.
+"""
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime, timedelta
+from operator import le
+from itertools import islice
+from array import array
+
+EPOCH = datetime(1970, 1, 1)
+HOUR = timedelta(hours=1)
+
+
+def hournumber(t):
+    """
+    Converts a naive datetime to an hour number.
+    """
+    return (t - EPOCH) // HOUR
+
+
+def civil(day):
+    """
+    Converts days since 1970-01-01 to (year, month, day), using integer arithmetic only.
+    """
+    z = day + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe//1460 + doe//36524 - doe//146096) // 365
+    doy = doe - (365*yoe + yoe//4 - yoe//100)
+    mp = (5*doy + 2) // 153
+    d = doy - (153*mp + 2)//5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    return yoe + era*400 + (m <= 2), m, d
+
+
+def daynumber(y, m, d):
+    """
+    Converts (year, month, day) to days since 1970-01-01.
+    """
+    y -= m <= 2
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153*(m + (-3 if m > 2 else 9)) + 2)//5 + d-1
+    doe = yoe * 365 + yoe//4 - yoe//100 + doy
+    return era * 146097 + doe - 719468
+
+
+def daylabel(day):
+    return "%04d-%02d-%02d" % civil(day)
+
+
+def dayperiods(first, last):
+    for day in range(first, last+1):
+        yield daylabel(day), day
+
+
+def monthperiods(first, last):
+    y, m, _ = civil(first)
+    while (day := daynumber(y, m, 1)) <= last:
+        yield "%04d-%02d" % (y, m), day
+        y, m = (y+1, 1) if m == 12 else (y, m+1)
+
+
+def yearperiods(first, last):
+    y, _, _ = civil(first)
+    while (day := daynumber(y, 1, 1)) <= last:
+        yield "%04d" % y, day
+        y += 1
+
+
+def weekperiods(first, last):
+    """
+    weeks as in strftime %W: weeks start on monday, and the days before the
+    first monday of the year are in week 00.
+    """
+    y, _, _ = civil(first)
+    starts = set()
+    while (jan1 := daynumber(y, 1, 1)) <= last:
+        starts.add(jan1)
+        # 1970-01-01 was a thursday, so (day+3)%7 is the weekday with monday=0
+        monday = jan1 + (-(jan1 + 3)) % 7
+        starts.update(range(monday, daynumber(y+1, 1, 1), 7))
+        y += 1
+    for day in sorted(starts):
+        yield f"{EPOCH + timedelta(days=day):%Y:%W}", day
+
+
+def labelperiods(labelfn):
+    """
+    Returns a period generator for a function converting a datetime to a label,
+    consecutive days with the same label form one period.
+    """
+    def periods(first, last):
+        prev = None
+        for day in range(first, last+1):
+            label = labelfn(EPOCH + timedelta(days=day))
+            if label != prev:
+                yield label, day
+                prev = label
+    return periods
+
+
+class ContractPeriods:
+    """
+    Contract or tariff periods, each starting at one of `dates`, "%Y-%m-%d"
+    strings, and labeled with the year of their start, or with the start
+    date when several periods start in the same year. The days before the
+    first start are labeled with the year before it.
+    """
+    # the start of the period before the first contract.
+    BEGIN = daynumber(1, 1, 1)
+
+    def __init__(self, dates):
+        self.starts = sorted(daynumber(*map(int, d.split('-'))) for d in dates)
+        if not self.starts:
+            raise ValueError("no contract dates")
+        self.labels = ["%04d" % civil(day)[0] for day in self.starts]
+        if len(set(self.labels)) != len(self.labels):
+            self.labels = [daylabel(day) for day in self.starts]
+        self.before = "%04d" % (civil(self.starts[0])[0] - 1)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Creates the periods from a space or comma separated list of dates.
+        """
+        return cls(text.replace(",", " ").split())
+
+    def __eq__(self, other):
+        return isinstance(other, ContractPeriods) and self.starts == other.starts
+
+    def __str__(self):
+        return " ".join(daylabel(day) for day in self.starts)
+
+    def label(self, day):
+        """
+        Returns the label for day number `day`.
+        """
+        i = bisect_right(self.starts, day)
+        return self.labels[i-1] if i else self.before
+
+    def periods(self, first, last):
+        """
+        yields (label, startday) for the periods containing days `first` upto `last`.
+        """
+        i = bisect_right(self.starts, first)
+        yield (self.labels[i-1], self.starts[i-1]) if i else (self.before, self.BEGIN)
+        while i < len(self.starts) and self.starts[i] <= last:
+            yield self.labels[i], self.starts[i]
+            i += 1
+
+
+PERIODS = {
+    'day': dayperiods,
+    'week': weekperiods,
+    'month': monthperiods,
+    'year': yearperiods,
+}
+
+
+def periodsfor(period):
+    """
+    Returns the period generator for one of the PERIODS, a ContractPeriods,
+    or a function converting a datetime to a label.
+    """
+    if isinstance(period, str):
+        return PERIODS[period]
+    if isinstance(period, ContractPeriods):
+        return period.periods
+    return labelperiods(period)
+
+
+def sortcolumns(hours, columns, unique=False):
+    """
+    Returns hours and columns sorted by hour, when `unique` is set only the
+    first occurrence of each hour is kept.
+    """
+    n = len(hours)
+    if not all(map(le, hours, islice(hours, 1, None))):
+        order = sorted(range(n), key=hours.__getitem__)
+        hours = array('l', [hours[i] for i in order])
+        columns = [array('d', [col[i] for i in order]) for col in columns]
+    if unique and len(set(hours)) != n:
+        keep = [0] + [i for i in range(1, n) if hours[i] != hours[i-1]]
+        hours = array('l', [hours[i] for i in keep])
+        columns = [array('d', [col[i] for i in keep]) for col in columns]
+    return hours, columns
+
+
+def concatcolumns(parts):
+    """
+    Concatenates (hours, column, ...) tuples of arrays, in order.
+    """
+    if len(parts) == 1:
+        return parts[0]
+    result = tuple(array('l' if i == 0 else 'd') for i in range(len(parts[0])))
+    for part in parts:
+        for r, a in zip(result, part):
+            r.extend(a if a.typecode == r.typecode else iter(a))
+    return result
+
+
+def hourly(hours, columns):
+    """
+    Per hour totals, labeled as "%Y-%m-%d %H".
+    """
+    days = {}
+    labels = []
+    for h in hours:
+        day, hr = divmod(h, 24)
+        dl = days.get(day)
+        if dl is None:
+            dl = days[day] = [daylabel(day) + " %02d" % _ for _ in range(24)]
+        labels.append(dl[hr])
+
+    if len(set(hours)) == len(hours):
+        return [defaultdict(float, zip(labels, col)) for col in columns]
+
+    sums = [defaultdict(float) for _ in columns]
+    for s, col in zip(sums, columns):
+        for label, v in zip(labels, col):
+            s[label] += v
+    return sums
+
+
+def rollup(hours, columns, period='hour', unique=False):
+    """
+    Sum each of the value arrays in `columns` per period.
+
+    `period` is 'hour', one of the PERIODS, a ContractPeriods, or a function
+    converting a datetime to a label, for grouping consecutive days by that label.
+
+    Returns a defaultdict(float), label -> total, for each column.
+    """
+    if period == 'hour':
+        if unique:
+            hours, columns = sortcolumns(hours, columns, unique)
+        return hourly(hours, columns)
+    periods = periodsfor(period)
+
+    sums = [defaultdict(float) for _ in columns]
+    if not len(hours):
+        return sums
+    hours, columns = sortcolumns(hours, columns, unique)
+
+    bounds = [(label, bisect_left(hours, day*24)) for label, day in periods(hours[0]//24, hours[-1]//24)]
+    bounds.append((None, len(hours)))
+    for (label, a), (_, b) in zip(bounds, bounds[1:]):
+        if a == b:
+            continue
+        # += since a label function can return a label seen before
+        for s, col in zip(sums, columns):
+            s[label] += sum(col[a:b])
+    return sums
+
+
+def labeler(period='hour'):
+    """
+    Returns a function converting an hour number to the label of its period.
+    """
+    days = {}
+    if period == 'hour':
+        def label(h):
+            day, hr = divmod(h, 24)
+            if (dl := days.get(day)) is None:
+                dl = days[day] = [daylabel(day) + " %02d" % _ for _ in range(24)]
+            return dl[hr]
+        return label
+
+    periods = periodsfor(period)
+    def label(h):
+        day = h//24
+        if (l := days.get(day)) is None:
+            l = days[day] = [l for l, start in periods(day, day) if start <= day][-1]
+        return l
+    return label
+
+
+def streamrollup(items, period='hour'):
+    """
+    Sums chronological (hour, values) items per period, and yields
+    (label, sums) as soon as the next period starts.
+    """
+    label = labeler(period)
+    current = None
+    sums = None
+    for h, values in items:
+        l = label(h)
+        if l != current:
+            if current is not None:
+                yield current, sums
+            current, sums = l, list(values)
+        else:
+            sums = [a+b for a, b in zip(sums, values)]
+    if current is not None:
+        yield current, sums
+
+
+def foldrollup(items, n, period='hour'):
+    """
+    Sums (hour, values) items with `n` values each per period, the items can
+    be in any order. Only the totals are kept, not the items.
+
+    Returns a defaultdict(float), label -> total, for each value, as `rollup`.
+    """
+    label = labeler(period)
+    sums = [defaultdict(float) for _ in range(n)]
+    for h, values in items:
+        l = label(h)
+        for s, v in zip(sums, values):
+            s[l] += v
+    return sums
@@ -0,0 +1,214 @@
+"""
+Timers and counters, to see where a run spends its time.
+
+Collection is off until `STATS.enable` is called, then the timers cost two
+perf_counter calls each. At exit a summary is printed to stderr, and/or the
+values are written to a file, as json when the name ends in .json, otherwise
+in the prometheus text format, for the node_exporter textfile collector.
+
+    python3 eneco.py --sync store/ --stats --statsfile /var/lib/node_exporter/eneco.prom
+"""
+import os
+import sys
+import time
+
+
+class Timer:
+    __slots__ = ('stats', 'key', 't0')
+
+    def __init__(self, stats, key):
+        self.stats = stats
+        self.key = key
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add(self.key, 1, time.perf_counter() - self.t0)
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+NULLTIMER = NullTimer()
+
+
+def labelkey(name, labels):
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        # nothing is collected until enabled, then the threads of the fetch tools need a lock
+        self.lock = NULLTIMER
+        self.counters = {}      # (name, labels) -> value
+        self.timers = {}        # (name, labels) -> [count, seconds, max]
+        self.started = time.perf_counter()
+
+    def enable(self, summary=True, filename=None):
+        """
+        Starts collecting, and reports at exit.
+        """
+        import threading
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.started = time.perf_counter()
+        import atexit
+        atexit.register(self.report, summary, filename)
+
+    def count(self, name, n=1, **labels):
+        if not self.enabled:
+            return
+        key = labelkey(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add(self, key, n, seconds, longest=None):
+        with self.lock:
+            t = self.timers.get(key)
+            if t is None:
+                t = self.timers[key] = [0, 0.0, 0.0]
+            t[0] += n
+            t[1] += seconds
+            t[2] = max(t[2], seconds if longest is None else longest)
+
+    def observe(self, name, seconds, **labels):
+        """
+        Records a duration measured by the caller.
+        """
+        if self.enabled:
+            self.add(labelkey(name, labels), 1, seconds)
+
+    def timer(self, name, **labels):
+        """
+        Returns a context manager timing its block.
+        """
+        if not self.enabled:
+            return NULLTIMER
+        return Timer(self, labelkey(name, labels))
+
+    def iter(self, name, iterable, **labels):
+        """
+        Yields the items of `iterable`, timing only the time spent producing them.
+        """
+        if not self.enabled:
+            return iterable
+        return self.timediter(labelkey(name, labels), iterable)
+
+    def timediter(self, key, iterable):
+        clock = time.perf_counter
+        it = iter(iterable)
+        n, total, longest = 0, 0.0, 0.0
+        try:
+            while True:
+                t0 = clock()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    break
+                dt = clock() - t0
+                n += 1
+                total += dt
+                if dt > longest:
+                    longest = dt
+                yield item
+        finally:
+            self.add(key, n, total, longest)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), { k: list(v) for k, v in self.timers.items() }
+
+    def summary(self):
+        counters, timers = self.snapshot()
+        lines = ["%-44s %9s %10s %10s %10s" % ("timer", "count", "seconds", "mean ms", "max ms")]
+        for (name, labels), (n, seconds, longest) in sorted(timers.items()):
+            lines.append("%-44s %9d %10.3f %10.3f %10.3f" % (fullname(name, labels), n, seconds, 1000*seconds/n if n else 0, 1000*longest))
+        if counters:
+            lines.append("%-44s %9s" % ("counter", "value"))
+        for (name, labels), value in sorted(counters.items()):
+            lines.append("%-44s %9d" % (fullname(name, labels), value))
+        lines.append("%-44s %20.3f" % ("elapsed", time.perf_counter() - self.started))
+        return "\n".join(lines)
+
+    def asjson(self):
+        import json
+        counters, timers = self.snapshot()
+        return json.dumps(dict(
+            elapsed = time.perf_counter() - self.started,
+            timers = [dict(name=name, labels=dict(labels), count=n, seconds=seconds, max=longest)
+                for (name, labels), (n, seconds, longest) in sorted(timers.items())],
+            counters = [dict(name=name, labels=dict(labels), value=value)
+                for (name, labels), value in sorted(counters.items())],
+        ), indent=1)
+
+    def prometheus(self, prefix="energie"):
+        counters, timers = self.snapshot()
+        lines = []
+        def metric(name, kind, values):
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for labels, value in values:
+                lines.append("%s_%s%s %s" % (prefix, name, promlabels(labels), value))
+        for name in sorted(set(name for name, labels in timers)):
+            values = [(labels, t) for (n, labels), t in sorted(timers.items()) if n == name]
+            metric(name + "_seconds_total", "counter", [(labels, repr(t[1])) for labels, t in values])
+            metric(name + "_count", "counter", [(labels, t[0]) for labels, t in values])
+            metric(name + "_seconds_max", "gauge", [(labels, repr(t[2])) for labels, t in values])
+        for name in sorted(set(name for name, labels in counters)):
+            metric(name + "_total", "counter", [(labels, v) for (n, labels), v in sorted(counters.items()) if n == name])
+        metric("elapsed_seconds", "gauge", [((), repr(time.perf_counter() - self.started))])
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        """
+        Replaces `filename` at once, so a collector never reads a partial file.
+        """
+        filename = os.path.expanduser(filename)
+        text = self.asjson() if filename.endswith(".json") else self.prometheus()
+        tmp = "%s.%d.tmp" % (filename, os.getpid())
+        with open(tmp, "w") as fh:
+            fh.write(text)
+        os.replace(tmp, filename)
+
+    def report(self, summary=True, filename=None):
+        if summary:
+            print(self.summary(), file=sys.stderr)
+        if filename:
+            self.write(filename)
+
+
+def fullname(name, labels):
+    if not labels:
+        return name
+    return "%s{%s}" % (name, ",".join("%s=%s" % kv for kv in labels))
+
+
+def promlabels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels)
+
+
+STATS = Stats()
+
+
+def addarguments(parser):
+    """
+    Adds the --stats and --statsfile options to an argparse parser.
+    """
+    parser.add_argument('--stats', action='store_true', help='print the timers and counters to stderr at exit')
+    parser.add_argument('--statsfile', type=str, help='write the timers and counters to FILE, json for *.json, otherwise prometheus text', metavar='FILE')
+
+
+def fromargs(args):
+    """
+    Enables STATS for the --stats and --statsfile options.
+    """
+    if args.stats or args.statsfile:
+        STATS.enable(args.stats, args.statsfile)
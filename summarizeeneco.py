@@ -1,7 +1,8 @@
-from collections import defaultdict
 from datetime import datetime
-import re
-import json
+from array import array
+import os
+from rollup import rollup, foldrollup, daynumber, ContractPeriods, concatcolumns
+from timestamps import isohour
 
 # note: 'twoyears.dat'  is the output of eneco.py
 #   the 'InclVat' properties always use the current price,
@@ -41,26 +42,11 @@ def get(d, *path):
     return d
 
 def readlines(fh):
-    while True:
-        line = fh.readline()
-        if not line: break
-
-        try:
-            if line.startswith('Traceback'):
-                break
-            if line.startswith('auth:'):
-                continue
-            if line.startswith(' factor'):
-                continue
-            # input is either in python, or json.
-            if re.search(r': (?:None|True|False)', line):
-                # convert python dict to json
-                line = re.sub(r'\'', '"', line)
-                line = re.sub(r': (True|False)', lambda m:': %s' % m[1].lower(), line)
-                line = re.sub(r': None', ': null', line)
-            yield json.loads(line)
-        except json.decoder.JSONDecodeError:
-            pass
+    """
+    reads the json or python dicts from the output of eneco.py
+    """
+    import dumpreader
+    return dumpreader.readlines(fh, stop=('Traceback',), skip=('auth:', ' factor'))
 
 def getdata(lines):
     for l in lines:
@@ -71,6 +57,87 @@ def getdata(lines):
         else:
             yield l
 
+def getstoredata(path):
+    """
+    yields the `actual` records from an hourly store.
+    """
+    from hourstore import HourStore, enecorecord
+    store = HourStore(path)
+    cols = store.load()
+    for i in range(len(cols['hour'])):
+        yield enecorecord(store, cols, i)
+
+def loaddata(filename, account=None):
+    """
+    yields the `actual` records from either a dump file, an hourly store, or a usage database.
+    """
+    if os.path.isdir(filename):
+        yield from getstoredata(filename)
+        return
+    from usagedb import isdb, enecorecords
+    if isdb(filename):
+        yield from enecorecords(filename, account)
+        return
+    with open(filename, "r") as fh:
+        yield from getdata(readlines(fh))
+
+def getstorecolumns(path):
+    """
+    returns the hour, gas and electricity arrays from an hourly store.
+    """
+    from hourstore import HourStore
+    cols = HourStore(path).load(['hour', 'gas', 'elec_high', 'elec_low'])
+    elec = array('d', [h or l for h, l in zip(cols['elec_high'], cols['elec_low'])])
+    return cols['hour'], cols['gas'], elec
+
+def filecolumns(filename, account=None, verbose=False, hourly=False):
+    """
+    returns the hour, gas and electricity arrays from either a dump file, an
+    hourly store, or a usage database. Duplicate hours are dropped by the caller.
+
+    With `verbose` the records are checked, and for `hourly` output the hours
+    with errors or deviations are printed.
+    """
+    import dumpreader
+    from stats import STATS
+    if os.path.isdir(filename) and not verbose:
+        with STATS.timer('load', source='store'):
+            return getstorecolumns(filename)
+    from usagedb import isdb, enecocolumns
+    if isdb(filename) and not verbose:
+        with STATS.timer('load', source='database'):
+            return enecocolumns(filename, account)
+
+    hours, gas, elec = array('l'), array('d'), array('d')
+    done = dumpreader.RecentSet()
+    for d in STATS.iter('parse', loaddata(filename, account)):
+        isok = check(d)
+        h = isohour(get(d, 'date'))
+        if h in done:
+            continue
+        done.add(h)
+        g = get(d, 'gas', 'high')
+        e = get(d, 'electricity', 'high') or get(d, 'electricity', 'low')
+        g_err = get(d, 'gas', 'errorCodes')
+        e_err = get(d, 'electricity', 'errorCodes')
+
+        if hourly and verbose:
+            if not isok or g_err or e_err:
+                from hourstore import hourtime
+                print(f"{hourtime(h):%Y-%m-%d %H:%M:%S} {g:>10.5f} {e:>10.5f}", end="")
+            if not isok:
+                print("*", end="")
+                print(deviations(d), end="")
+            if g_err or e_err:
+                print(f"  : g:{g_err}, e:{e_err}")
+            elif not isok:
+                print()
+
+        hours.append(h)
+        gas.append(g or 0)
+        elec.append(e or 0)
+    return hours, gas, elec
+
 def fixdate(d):
     if len(d)==10:
         return d+"T00:00:00"
@@ -80,16 +147,61 @@ def fixdate(d):
 def cvdate(d):
     return datetime.fromisoformat(fixdate(d))
 
+# Dit zijn de datums waarop mijn eneco contract van tarief wisselt.
+ENECOCONTRACTS = ContractPeriods(["2013-03-16", "2014-03-11", "2015-03-29", "2016-03-29", "2017-03-22", "2018-03-22", "2019-03-24", "2020-03-24", "2021-03-24", "2022-03-24" ])
+
 def enecojaar(t):
-    # Dit zijn de datums waarop mijn eneco contract van tarief wisselt.
-    datums = ["2013-03-16", "2014-03-11", "2015-03-29", "2016-03-29", "2017-03-22", "2018-03-22", "2019-03-24", "2020-03-24", "2021-03-24", "2022-03-24" ]
+    return ENECOCONTRACTS.label(daynumber(*map(int, t[:10].split('-'))))
 
-    if t<datums[0]:
-        return "2012"
-    for a, b in zip(datums, datums[1:]):
-        if a <= t < b:
-            return a[:4]
-    return "2022"
+def contractperiods(cfg, account=None):
+    """
+    Returns the contract periods from the `contracts` option in the
+    `eneco:<account>` or `eneco` config section, or the default periods.
+    """
+    for section in (account and "eneco:%s" % account, "eneco"):
+        if section and cfg and 'contracts' in cfg.get(section, {}):
+            return ContractPeriods.parse(cfg[section]['contracts'])
+    return ENECOCONTRACTS
+
+def enecoperiod(name, contracts=None):
+    """
+    Returns the rollup period for `name`, 'eneco' are the contract periods.
+    """
+    if name == 'eneco':
+        return contracts or ENECOCONTRACTS
+    return name
+
+def hourvalues(records, done=None):
+    """
+    yields (hour, (gas, electricity)) for chronological `actual` records,
+    repeated hours are skipped. `done` is the set of hours seen, by default
+    only the recent hours are remembered.
+    """
+    import dumpreader
+    if done is None:
+        done = dumpreader.RecentSet()
+    for d in records:
+        if not (d and d.get('date')):
+            continue
+        h = isohour(d['date'])
+        if h in done:
+            continue
+        done.add(h)
+        yield h, (get(d, 'gas', 'high') or 0, get(d, 'electricity', 'high') or get(d, 'electricity', 'low') or 0)
+
+def streamtotals(filenames, period):
+    """
+    Returns the gas and electricity totals per period for dump files, summed
+    while reading the records, so only the hours seen and the totals are kept.
+    The first occurrence of an hour is used, also when it is in several files.
+    """
+    import dumpreader
+    from stats import STATS
+    def records():
+        for filename in filenames:
+            with open(filename, "r") as fh:
+                yield from getdata(readlines(fh))
+    return foldrollup(hourvalues(STATS.iter('parse', records()), dumpreader.HourSet()), 2, period)
 
 def checkmeasurement(m, dbl):
     if m.get('status') != 'MEASURED':
@@ -129,8 +241,23 @@ def deviations(d):
     return ", ".join(l)
 
 
+def isstreamable(filenames, period, args):
+    """
+    The period totals of dump files are summed while reading, when the files
+    are read in one process anyway.
+    """
+    from usagedb import isdb
+    if period == 'hour' or args.columns or args.format != 'text':
+        return False
+    if len(filenames) > 1 and args.jobs != 1:
+        return False
+    return not any(os.path.isdir(f) or isdb(f) for f in filenames)
+
+
 def main():
     import argparse
+    import stats
+    from report import FORMATS, formaterror
     parser = argparse.ArgumentParser(description='Eneco per hour info')
     parser.add_argument('--verbose', '-v', action='store_true')
     parser.add_argument('--perday', '-d', action='store_true')
@@ -138,70 +265,84 @@ def main():
     parser.add_argument('--permonth', '-m', action='store_true')
     parser.add_argument('--peryear', '-y', action='store_true')
     parser.add_argument('--eneco', '-e', action='store_true')
-    parser.add_argument('--columns', action='store_true')
-    parser.add_argument('filename', type=str)
+    parser.add_argument('--columns', action='store_true', help='print the totals per hour as a table with a column per day')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='format of the --columns table')
+    parser.add_argument('--output', '-o', type=str, help='write the --columns table to a file')
+    parser.add_argument('--account', '-a', type=str, help='the account in a usage database')
+    stats.addarguments(parser)
+    parser.add_argument('--contracts', type=str, help='start dates of the contract periods for --eneco, default from the config', metavar='DATES')
+    parser.add_argument('--config', help=argparse.SUPPRESS, default='~/.energierc') # 'specify configuration file.'
+    parser.add_argument('--jobs', '-j', type=int, help='number of processes reading the files, default one per cpu')
+    parser.add_argument('filenames', type=str, nargs='+', help='output of eneco.py, an hourly store directory, or a usage database, or glob patterns', metavar='filename')
     args = parser.parse_args()
+    if err := formaterror(args.format, args.output):
+        parser.error(err)
+    stats.fromargs(args)
 
-    e_per = defaultdict(float)
-    g_per = defaultdict(float)
-
-    done = set()
-    with open(args.filename, "r") as fh:
-        for d in getdata(readlines(fh)):
-            isok = check(d)
-            t = cvdate(get(d, 'date'))
-            if t in done:
-                continue
-            done.add(t)
-            g = get(d, 'gas', 'high')
-            e = get(d, 'electricity', 'high') or get(d, 'electricity', 'low')
-            g_err = get(d, 'gas', 'errorCodes')
-            e_err = get(d, 'electricity', 'errorCodes')
-
-            if args.perday:
-                tsum = f"{t:%Y-%m-%d}"
-            elif args.perweek:
-                tsum = f"{t:%Y:%W}"
-            elif args.permonth:
-                tsum = f"{t:%Y-%m}"
-            elif args.peryear:
-                tsum = f"{t:%Y}"
-            elif args.eneco:
-                tsum = f"{t:%Y-%m-%d}"
-                tsum = enecojaar(tsum)
-            else:
-                tsum = f"{t:%Y-%m-%d %H}"
-                if args.verbose:
-                    if not isok or g_err or e_err:
-                        print(f"{t:%Y-%m-%d %H:%M:%S} {g:>10.5f} {e:>10.5f}", end="")
-                    if not isok:
-                        print("*", end="")
-                        print(deviations(d), end="")
-                    if g_err or e_err:
-                        print(f"  : g:{g_err}, e:{e_err}")
-                    elif not isok:
-                        print()
-
-            if tsum:
-                e_per[tsum] += e
-                g_per[tsum] += g
-
-    if args.columns:
-        for table in (g_per, e_per):
-            dates = set(k[:10] for k in table.keys())
-            print("--")
-            print("       ", end="")
-            for d in sorted(dates):
-                print("%8s" % d[5:], end=" ")
-            print()
-            for h in range(24):
-                print(f"{h:02d}:00  ", end="")
-                for d in sorted(dates):
-                    print("%8.3f" % table[f"{d} {h:02d}"], end=" ")
-                print()
+    if args.perday:
+        period = 'day'
+    elif args.perweek:
+        period = 'week'
+    elif args.permonth:
+        period = 'month'
+    elif args.peryear:
+        period = 'year'
+    elif args.eneco:
+        period = 'eneco'
     else:
+        period = 'hour'
+
+    if args.contracts:
+        contracts = ContractPeriods.parse(args.contracts)
+    elif period != 'eneco':
+        # the contract periods are only used for --eneco
+        contracts = None
+    else:
+        from config import loadconfig
+        try:
+            contracts = contractperiods(loadconfig(os.path.expanduser(args.config)), args.account)
+        except FileNotFoundError:
+            contracts = ENECOCONTRACTS
+
+    import dumpreader
+    try:
+        filenames = dumpreader.expandpaths(args.filenames)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    from usagedb import isdb, accounttotals
+    if len(filenames) == 1 and isdb(filenames[0]) and period != 'hour':
+        # the totals per period are materialized in the database
+        with stats.STATS.timer('load', source='rollups'):
+            g_per, e_per, _, _ = accounttotals(filenames[0], 'eneco', period, args.account, contracts)
         for t in sorted(e_per.keys()):
             print("%s %10.5f %10.5f" % (t, g_per[t], e_per[t]))
+        return
+
+    if isstreamable(filenames, period, args):
+        with stats.STATS.timer('stream', files=len(filenames)):
+            g_per, e_per = streamtotals(filenames, enecoperiod(period, contracts))
+        for t in sorted(e_per.keys()):
+            print("%s %10.5f %10.5f" % (t, g_per[t], e_per[t]))
+        return
+
+    # each file is read in a separate process, the verbose output is printed in order.
+    with stats.STATS.timer('map', files=len(filenames)):
+        parts = dumpreader.mapfiles(filecolumns, filenames, 1 if args.verbose else args.jobs, args.account, args.verbose, period == 'hour')
+    hours, gas, elec = concatcolumns(parts)
+
+    period = enecoperiod(period, contracts)
+    stats.STATS.count('hours', len(hours))
+    with stats.STATS.timer('aggregate'):
+        # the first occurrence of an hour is used, also when it is in several files.
+        g_per, e_per = rollup(hours, [gas, elec], period, unique=True)
+
+    with stats.STATS.timer('output'):
+        if args.columns or args.format != 'text':
+            from report import write
+            write([('gas', g_per), ('electricity', e_per)], args.format, args.output)
+        else:
+            for t in sorted(e_per.keys()):
+                print("%s %10.5f %10.5f" % (t, g_per[t], e_per[t]))
 
 if __name__=='__main__':
     main()
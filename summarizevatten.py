@@ -1,7 +1,9 @@
-from collections import defaultdict
 from datetime import datetime
-import re
-import json
+from array import array
+from collections import defaultdict
+import os
+from rollup import rollup, foldrollup, sortcolumns, concatcolumns
+from timestamps import clockhour, AMSTERDAM
 
 def get(d, *path):
     for p in path:
@@ -14,20 +16,8 @@ def readlines(fh):
     """
     reads lines containing either python or json dicts
     """
-    while True:
-        line = fh.readline()
-        if not line: break
-
-        try:
-            # input is either in python, or json.
-            if re.search(r': (?:None|True|False)', line):
-                # convert python dict to json
-                line = re.sub(r'\'', '"', line)
-                line = re.sub(r': (True|False)', lambda m:': %s' % m[1].lower(), line)
-                line = re.sub(r': None', ': null', line)
-            yield json.loads(line)
-        except json.decoder.JSONDecodeError:
-            pass
+    import dumpreader
+    return dumpreader.readlines(fh)
 
 def mkdate(ymd, hm):
     return datetime.fromisoformat(f"{ymd}T{hm}:00")
@@ -41,61 +31,212 @@ def getdata(lines):
                 q = float(get(c, "DeliveryQuantity"))
                 qr = float(get(c, "BackDeliveryQuantity"))
                 yield (product, t, q, qr)
- 
+
+def gethours(lines):
+    """
+    Like getdata, with the local time as an hour number instead of a datetime.
+    """
+    for l in lines:
+        for cc in get(l, 'ConsumptionHeaderSet'):
+            product = get(cc, 'Product')
+            for c in get(cc, 'ConsumptionSet'):
+                yield (product, clockhour(c.get('DateFrom'), c.get('TimeFrom')),
+                        float(get(c, "DeliveryQuantity")), float(get(c, "BackDeliveryQuantity")))
+
+def keyedhours(lines):
+    """
+    Like gethours, with the key of each record before the local hour number.
+
+    The key is the local hour number << 1, plus 1 for the second occurrence of
+    the hour repeated at the end of DST. That hour is reported twice in a
+    response, with the same local time, so the occurrences are counted per response.
+    """
+    for l in lines:
+        seen = {}
+        for product, lh, q, qr in gethours([l]):
+            fold = seen[(product, lh)] = seen.get((product, lh), -1) + 1
+            yield (product, lh << 1 | min(fold, 1), lh, q, qr)
+
+def utckey(h):
+    """
+    The key of utc hour `h`, as used by keyedhours.
+    """
+    lh = AMSTERDAM.local(h)
+    return lh << 1 | (AMSTERDAM.local(h - 1) == lh)
+
+def hourvalues(responses):
+    """
+    yields (hour, (gas, electricity, received, delivered)) in chronological order,
+    from a chronological sequence of consumption responses.
+    """
+    for j in responses:
+        hours = defaultdict(lambda: [0.0]*4)
+        for what, lh, rcvd, xmit in gethours([j]):
+            v = hours[lh]
+            if what == 'E':
+                v[1] += rcvd-xmit
+                v[2] += rcvd
+                v[3] += xmit
+            else:
+                v[0] += rcvd-xmit
+        for h in sorted(hours):
+            yield h, hours[h]
+
+def loadhours(filename, account=None):
+    """
+    yields (product, key, local hour number, quantity, backquantity) tuples,
+    like keyedhours, from either a dump file, an hourly store, or a usage database.
+    """
+    if os.path.isdir(filename):
+        from hourstore import HourStore
+        cols = HourStore(filename).load(['hour', 'gas', 'elec_high', 'elec_low', 'redelivery'])
+        for h, g, eh, el, r in zip(cols['hour'], cols['gas'], cols['elec_high'], cols['elec_low'], cols['redelivery']):
+            key = utckey(h)
+            yield ('E', key, key >> 1, eh + el, r)
+            yield ('G', key, key >> 1, g, 0.0)
+        return
+    from usagedb import isdb, vattenfallhours
+    if isdb(filename):
+        for product, h, lh, q, qr in vattenfallhours(filename, account):
+            yield (product, utckey(h), lh, q, qr)
+        return
+    with open(filename, "r") as fh:
+        yield from keyedhours(readlines(fh))
+
+def filecolumns(filename, account=None):
+    """
+    returns ((keys, received, delivered), (keys, net gas)) arrays from either a dump
+    file, an hourly store, or a usage database.
+
+    With the keys from keyedhours the hour repeated at the end of DST is kept,
+    while a repeated window, in the same or in another file, can be dropped.
+    """
+    from stats import STATS
+    e_keys, e_rcvd, e_xmit = array('l'), array('d'), array('d')
+    g_keys, g_net = array('l'), array('d')
+    for what, key, lh, rcvd, xmit in STATS.iter('parse', loadhours(filename, account)):
+        if what == 'E':
+            e_keys.append(key)
+            e_rcvd.append(rcvd)
+            e_xmit.append(xmit)
+        else:
+            g_keys.append(key)
+            g_net.append(rcvd-xmit)
+    return (e_keys, e_rcvd, e_xmit), (g_keys, g_net)
+
+def streamtotals(filenames, period):
+    """
+    Returns the gas, electricity, received and delivered totals per period for
+    dump files, summed while reading the records, so only the hours seen and the
+    totals are kept. The first occurrence of an hour is used, also when it is in
+    several files.
+    """
+    import dumpreader
+    from stats import STATS
+    done = { 'E': dumpreader.HourSet(), 'G': dumpreader.HourSet() }
+    def items():
+        for filename in filenames:
+            with open(filename, "r") as fh:
+                for what, key, lh, rcvd, xmit in STATS.iter('parse', keyedhours(readlines(fh))):
+                    seen = done.setdefault(what, dumpreader.HourSet())
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    if what == 'E':
+                        yield lh, (0.0, rcvd-xmit, rcvd, xmit)
+                    else:
+                        yield lh, (rcvd-xmit, 0.0, 0.0, 0.0)
+    return foldrollup(items(), 4, period)
+
+def isstreamable(filenames, period, args):
+    """
+    The period totals of dump files are summed while reading, when the files
+    are read in one process anyway.
+    """
+    from usagedb import isdb
+    if period == 'hour' or args.columns or args.format != 'text':
+        return False
+    if len(filenames) > 1 and args.jobs != 1:
+        return False
+    return not any(os.path.isdir(f) or isdb(f) for f in filenames)
+
 def main():
     import argparse
+    import stats
+    from report import FORMATS, formaterror
     parser = argparse.ArgumentParser(description='Vattenfall gas, elec per hour info')
     parser.add_argument('--verbose', '-v', action='store_true')
     parser.add_argument('--perday', '-d', action='store_true')
     parser.add_argument('--perweek', '-w', action='store_true')
     parser.add_argument('--permonth', '-m', action='store_true')
     parser.add_argument('--peryear', '-y', action='store_true')
-    parser.add_argument('--columns', action='store_true')
-    parser.add_argument('filename', type=str)
+    parser.add_argument('--columns', action='store_true', help='print the totals per hour as a table with a column per day')
+    parser.add_argument('--format', choices=FORMATS, default='text', help='format of the --columns table')
+    parser.add_argument('--output', '-o', type=str, help='write the --columns table to a file')
+    parser.add_argument('--account', '-a', type=str, help='the account in a usage database')
+    stats.addarguments(parser)
+    parser.add_argument('--jobs', '-j', type=int, help='number of processes reading the files, default one per cpu')
+    parser.add_argument('filenames', type=str, nargs='+', help='output of vattenfall.py, an hourly store directory, or a usage database, or glob patterns', metavar='filename')
     args = parser.parse_args()
+    if err := formaterror(args.format, args.output):
+        parser.error(err)
+    stats.fromargs(args)
 
-    e_per = defaultdict(float)
-    e_rcvd = defaultdict(float)
-    e_xmit = defaultdict(float)
-    g_per = defaultdict(float)
-
-    with open(args.filename, "r") as fh:
-        for what, when, rcvd, xmit in getdata(readlines(fh)):
-            if args.perday:
-                tsum = f"{when:%Y-%m-%d}"
-            elif args.perweek:
-                tsum = f"{when:%Y:%W}"
-            elif args.permonth:
-                tsum = f"{when:%Y-%m}"
-            elif args.peryear:
-                tsum = f"{when:%Y}"
-            else:
-                tsum = f"{when:%Y-%m-%d %H}"
-
-            if tsum:
-                if what == 'E':
-                    e_per[tsum] += rcvd-xmit
-                    e_rcvd[tsum] += rcvd
-                    e_xmit[tsum] += xmit
-                else:
-                    g_per[tsum] += rcvd-xmit
-
-    if args.columns:
-        for table in (g_per, e_per, e_rcvd, e_xmit):
-            dates = set(k[:10] for k in table.keys())
-            print("--")
-            print("       ", end="")
-            for d in sorted(dates):
-                print("%8s" % d[5:], end=" ")
-            print()
-            for h in range(24):
-                print(f"{h:02d}:00  ", end="")
-                for d in sorted(dates):
-                    print("%8.3f" % table[f"{d} {h:02d}"], end=" ")
-                print()
+    if args.perday:
+        period = 'day'
+    elif args.perweek:
+        period = 'week'
+    elif args.permonth:
+        period = 'month'
+    elif args.peryear:
+        period = 'year'
     else:
+        period = 'hour'
+
+    import dumpreader
+    try:
+        filenames = dumpreader.expandpaths(args.filenames)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    from usagedb import isdb, accounttotals
+    if len(filenames) == 1 and isdb(filenames[0]) and period != 'hour':
+        # the totals per period are materialized in the database
+        with stats.STATS.timer('load', source='rollups'):
+            g_per, e_per, e_rcvd, e_xmit = accounttotals(filenames[0], 'vattenfall', period, args.account)
+        for t in sorted(e_per.keys()):
+            print("%s %10.5f %10.5f %10.5f %10.5f" % (t, g_per[t], e_per[t], e_rcvd[t], e_xmit[t]))
+        return
+
+    if isstreamable(filenames, period, args):
+        with stats.STATS.timer('stream', files=len(filenames)):
+            g_per, e_per, e_rcvd, e_xmit = streamtotals(filenames, period)
         for t in sorted(e_per.keys()):
             print("%s %10.5f %10.5f %10.5f %10.5f" % (t, g_per[t], e_per[t], e_rcvd[t], e_xmit[t]))
+        return
+
+    # each file is read in a separate process, only the first occurrence of an hour is used.
+    with stats.STATS.timer('map', files=len(filenames)):
+        parts = dumpreader.mapfiles(filecolumns, filenames, args.jobs, args.account)
+    e_keys, *e_cols = concatcolumns([e for e, g in parts])
+    g_keys, *g_cols = concatcolumns([g for e, g in parts])
+    e_keys, (e_rcvd, e_xmit) = sortcolumns(e_keys, e_cols, unique=True)
+    g_keys, (g_net,) = sortcolumns(g_keys, g_cols, unique=True)
+    e_hours = array('l', [k >> 1 for k in e_keys])
+    g_hours = array('l', [k >> 1 for k in g_keys])
+    e_net = array('d', [r-x for r, x in zip(e_rcvd, e_xmit)])
+
+    stats.STATS.count('hours', len(e_hours))
+    with stats.STATS.timer('aggregate'):
+        e_per, e_rcvd, e_xmit = rollup(e_hours, [e_net, e_rcvd, e_xmit], period)
+        g_per, = rollup(g_hours, [g_net], period)
+
+    with stats.STATS.timer('output'):
+        if args.columns or args.format != 'text':
+            from report import write
+            write([('gas', g_per), ('electricity', e_per), ('received', e_rcvd), ('delivered', e_xmit)], args.format, args.output)
+        else:
+            for t in sorted(e_per.keys()):
+                print("%s %10.5f %10.5f %10.5f %10.5f" % (t, g_per[t], e_per[t], e_rcvd[t], e_xmit[t]))
 
 if __name__=='__main__':
     main()
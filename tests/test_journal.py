@@ -0,0 +1,79 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from journal import Journal
+
+WEEK = timedelta(days=7)
+HEADER = {"account": "home", "kind": "week"}
+
+
+class TestJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, "journal")
+        self.windows = [datetime(2021, 1, 4) + i*WEEK for i in range(4)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def journal(self, resume=True, header=HEADER):
+        return Journal(self.filename, header, resume)
+
+    def test_resume(self):
+        j = self.journal()
+        for t in self.windows[:2]:
+            j.complete(t, t+WEEK)
+        j.close()
+        j = self.journal()
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows[2:])
+        j.close()
+
+    def test_without_resume(self):
+        j = self.journal()
+        j.complete(self.windows[0], self.windows[0]+WEEK)
+        j.close()
+        j = self.journal(resume=False)
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows)
+        j.close()
+        # the checkpoint is kept for a later resume
+        j = self.journal()
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows[1:])
+        j.close()
+
+    def test_other_header(self):
+        j = self.journal()
+        j.complete(self.windows[0], self.windows[0]+WEEK)
+        j.close()
+        j = self.journal(header={"account": "other", "kind": "week"})
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows)
+        j.close()
+
+    def test_cut_short(self):
+        j = self.journal()
+        j.complete(self.windows[0], self.windows[0]+WEEK)
+        j.close()
+        with open(self.filename, "a") as fh:
+            fh.write("2021-01-11 2021-")
+        j = self.journal()
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows[1:])
+        j.complete(self.windows[1], self.windows[1]+WEEK)
+        j.close()
+        j = self.journal()
+        self.assertEqual(j.pending(self.windows, WEEK), self.windows[2:])
+        j.close()
+
+    def test_open_window(self):
+        # windows which can still change are not recorded
+        j = self.journal()
+        t = datetime.now() - timedelta(days=1)
+        j.complete(t, t+WEEK)
+        self.assertFalse(j.iscomplete(t, t+WEEK))
+        j.close()
+
+    def test_align(self):
+        j = self.journal()
+        j.complete(self.windows[0], self.windows[0]+WEEK)
+        self.assertEqual(j.align(datetime(2021, 2, 3, 12), WEEK), datetime(2021, 2, 1))
+        j.close()
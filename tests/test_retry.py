@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+
+from retry import Retrier, retryafter
+
+
+class Response:
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class TestRetry(unittest.TestCase):
+    def retrier(self, **kwargs):
+        r = Retrier(**kwargs)
+        r.slept = []
+        r.sleep = lambda delay: r.slept.append(r.waiting(delay))
+        return r
+
+    def test_retryafter(self):
+        self.assertEqual(retryafter(Response(429, {'retry-after': '7'})), 7.0)
+        self.assertIsNone(retryafter(Response(429)))
+        self.assertIsNone(retryafter(Response(429, {'retry-after': 'soon'})))
+        self.assertEqual(retryafter(Response(503, {'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})), 0.0)
+
+    def test_retry_after_header(self):
+        r = self.retrier(cap=10)
+        responses = iter([Response(429, {'retry-after': '3'}), Response(503, {'retry-after': '30'}), Response(200)])
+        self.assertEqual(r.call(lambda: next(responses), "https://example.com/x").status, 200)
+        # the delay is capped
+        self.assertEqual(r.slept, [3.0, 10])
+        self.assertEqual((r.requests, r.retries), (3, 2))
+
+    def test_last_response(self):
+        r = self.retrier(tries=3, threshold=10)
+        self.assertEqual(r.call(lambda: Response(500, {'retry-after': '0'}), "https://example.com/x").status, 500)
+        self.assertEqual(r.requests, 3)
+
+    def test_not_idempotent(self):
+        r = self.retrier()
+        self.assertEqual(r.call(lambda: Response(503), "https://example.com/login", idempotent=False).status, 503)
+        self.assertEqual((r.requests, r.slept), (1, []))
+
+    def test_exceptions(self):
+        r = self.retrier(tries=2, threshold=10)
+        def fail():
+            raise ConnectionResetError("reset")
+        with self.assertRaises(ConnectionResetError):
+            r.call(fail, "https://example.com/x")
+        self.assertEqual(r.requests, 2)
+        with self.assertRaises(ValueError):
+            r.call(mock.Mock(side_effect=ValueError), "https://example.com/x")
+
+    def test_circuit(self):
+        r = self.retrier(tries=1, threshold=2, cooldown=30)
+        for _ in range(2):
+            r.call(lambda: Response(503), "https://example.com/x")
+        self.assertGreater(r.circuitdelay("example.com"), 29)
+        self.assertLessEqual(r.circuitdelay("other.com"), 0)
+        # the next request to the host waits for the cooldown
+        self.assertEqual(r.call(lambda: Response(200), "https://example.com/x").status, 200)
+        self.assertEqual(len(r.slept), 1)
+        self.assertGreater(r.slept[0], 29)
+        # a success resets the failure count
+        r.call(lambda: Response(503), "https://example.com/x")
+        r.call(lambda: Response(200), "https://example.com/x")
+        r.call(lambda: Response(503), "https://example.com/x")
+        self.assertEqual(r.failures["example.com"], 1)
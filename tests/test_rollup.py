@@ -0,0 +1,61 @@
+import unittest
+import random
+from array import array
+from datetime import datetime, timedelta
+
+from rollup import rollup, streamrollup, foldrollup, ContractPeriods, EPOCH, hournumber
+
+
+def hoursfrom(t0, n):
+    return array('l', range(hournumber(t0), hournumber(t0) + n))
+
+
+class TestRollup(unittest.TestCase):
+    def test_period_boundaries(self):
+        # the last hour of january and the first hours of february
+        hours = array('l', [hournumber(datetime(2021, 1, 31, 23)), hournumber(datetime(2021, 2, 1, 0)), hournumber(datetime(2021, 2, 1, 1))])
+        values = array('d', [1, 2, 4])
+        self.assertEqual(dict(rollup(hours, [values], 'month')[0]), {"2021-01": 1, "2021-02": 6})
+        self.assertEqual(dict(rollup(hours, [values], 'day')[0]), {"2021-01-31": 1, "2021-02-01": 6})
+        self.assertEqual(dict(rollup(hours, [values], 'year')[0]), {"2021": 7})
+        # 2021-02-01 is a monday
+        self.assertEqual(dict(rollup(hours, [values], 'week')[0]), {"2021:04": 1, "2021:05": 6})
+
+    def test_year_boundary(self):
+        hours = hoursfrom(datetime(2020, 12, 31, 22), 4)
+        values = array('d', [1, 2, 4, 8])
+        self.assertEqual(dict(rollup(hours, [values], 'year')[0]), {"2020": 3, "2021": 12})
+        # 2021-01-01 is a friday, in week 00 of 2021
+        self.assertEqual(dict(rollup(hours, [values], 'week')[0]), {"2020:52": 3, "2021:00": 12})
+
+    def test_contract_periods(self):
+        contracts = ContractPeriods.parse("2020-07-01, 2021-07-01")
+        hours = array('l', [hournumber(datetime(2020, 6, 30, 23)), hournumber(datetime(2020, 7, 1, 0)),
+                hournumber(datetime(2021, 6, 30, 23)), hournumber(datetime(2021, 7, 1, 0))])
+        values = array('d', [1, 2, 4, 8])
+        self.assertEqual(dict(rollup(hours, [values], contracts)[0]), {"2019": 1, "2020": 6, "2021": 8})
+        same = ContractPeriods.parse("2020-01-01 2020-07-01")
+        self.assertEqual(dict(rollup(hours, [values], same)[0]), {"2020-01-01": 1, "2020-07-01": 14})
+
+    def test_unsorted_and_unique(self):
+        hours = array('l', [30, 10, 30, 20])
+        values = array('d', [1, 2, 4, 8])
+        self.assertEqual(dict(rollup(hours, [values], 'day')[0]), {"1970-01-01": 10, "1970-01-02": 5})
+        self.assertEqual(dict(rollup(hours, [values], 'day', unique=True)[0]), {"1970-01-01": 10, "1970-01-02": 1})
+
+    def test_stream_and_fold(self):
+        rnd = random.Random(1)
+        hours = hoursfrom(datetime(2020, 1, 1), 2*366*24)
+        values = array('d', [rnd.random() for _ in hours])
+        for period in ('hour', 'day', 'week', 'month', 'year', ContractPeriods.parse("2020-03-15")):
+            expected = dict(rollup(hours, [values], period)[0])
+            streamed = {l: s[0] for l, s in streamrollup(((h, (v,)) for h, v in zip(hours, values)), period)}
+            self.assertEqual(streamed.keys(), expected.keys())
+            for l in expected:
+                self.assertAlmostEqual(streamed[l], expected[l])
+            shuffled = list(zip(hours, values))
+            rnd.shuffle(shuffled)
+            folded = foldrollup(((h, (v,)) for h, v in shuffled), 1, period)[0]
+            self.assertEqual(folded.keys(), expected.keys())
+            for l in expected:
+                self.assertAlmostEqual(folded[l], expected[l])
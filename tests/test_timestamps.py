@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from rollup import hournumber
+from timestamps import TimeZoneTable, isohour, clockhour
+
+AMS = ZoneInfo("Europe/Amsterdam")
+
+
+def utchour(y, m, d, h):
+    return hournumber(datetime(y, m, d, h))
+
+
+class TestTimeZoneTable(unittest.TestCase):
+    def setUp(self):
+        self.tz = TimeZoneTable("Europe/Amsterdam")
+
+    def test_parse(self):
+        self.assertEqual(isohour("2021-03-28T01:00:00Z"), utchour(2021, 3, 28, 1))
+        self.assertEqual(isohour("2021-03-28"), utchour(2021, 3, 28, 0))
+        self.assertEqual(clockhour("2021-10-31", "02:00"), utchour(2021, 10, 31, 2))
+
+    def test_start_of_dst(self):
+        # 2021-03-28 02:00 local does not exist, the clock moves from 02:00 to 03:00
+        self.assertEqual(self.tz.local(utchour(2021, 3, 28, 0)), utchour(2021, 3, 28, 1))
+        self.assertEqual(self.tz.local(utchour(2021, 3, 28, 1)), utchour(2021, 3, 28, 3))
+        self.assertEqual(self.tz.utc(utchour(2021, 3, 28, 1)), utchour(2021, 3, 28, 0))
+        self.assertEqual(self.tz.utc(utchour(2021, 3, 28, 3)), utchour(2021, 3, 28, 1))
+        # the skipped hour uses the offset before the transition
+        self.assertEqual(self.tz.utc(utchour(2021, 3, 28, 2)), utchour(2021, 3, 28, 1))
+
+    def test_end_of_dst(self):
+        # 2021-10-31 02:00 local occurs twice, at 00:00 and 01:00 utc
+        self.assertEqual(self.tz.local(utchour(2021, 10, 31, 0)), utchour(2021, 10, 31, 2))
+        self.assertEqual(self.tz.local(utchour(2021, 10, 31, 1)), utchour(2021, 10, 31, 2))
+        self.assertEqual(self.tz.utc(utchour(2021, 10, 31, 2), 0), utchour(2021, 10, 31, 0))
+        self.assertEqual(self.tz.utc(utchour(2021, 10, 31, 2), 1), utchour(2021, 10, 31, 1))
+        self.assertEqual(self.tz.utc(utchour(2021, 10, 31, 1), 1), utchour(2021, 10, 30, 23))
+        self.assertEqual(self.tz.utc(utchour(2021, 10, 31, 3)), utchour(2021, 10, 31, 2))
+
+    def test_zoneinfo(self):
+        # every hour of two years against zoneinfo, in both directions
+        h0 = utchour(2020, 1, 1, 0)
+        for h in range(h0, h0 + 2*366*24):
+            lt = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(hours=h)
+            lt = lt.astimezone(AMS)
+            lh = hournumber(lt.replace(tzinfo=None))
+            self.assertEqual(self.tz.local(h), lh)
+            self.assertEqual(self.tz.utc(lh, lt.fold), h)
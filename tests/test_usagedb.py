@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+from datetime import datetime
+
+import benchmark
+import summarizeeneco
+import summarizevatten
+from rollup import ContractPeriods
+from usagedb import UsageDB, enecorows, vattenfallrows, accounttotals
+
+
+class TestUsageDB(unittest.TestCase):
+    """
+    The database totals against the plain dump summaries, for data spanning
+    both DST changes.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.enecofn, cls.vattenfn = benchmark.generate(cls.tmp.name, 0.85, datetime(2021, 1, 4))
+        cls.dbfn = os.path.join(cls.tmp.name, "usage.db")
+        db = UsageDB(cls.dbfn)
+        with open(cls.enecofn) as fh:
+            db.upsert(enecorows('home', summarizeeneco.getdata(summarizeeneco.readlines(fh))))
+        with open(cls.vattenfn) as fh:
+            db.upsert(vattenfallrows('home', summarizevatten.readlines(fh)))
+        db.close()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def assertTotals(self, actual, expected):
+        for a, e in zip(actual, expected):
+            self.assertEqual(sorted(a), sorted(e))
+            for label in e:
+                self.assertAlmostEqual(a[label], e[label], places=6, msg=label)
+
+    def test_eneco(self):
+        for period in ('week', 'month', 'year', 'eneco'):
+            expected = summarizeeneco.streamtotals([self.enecofn], summarizeeneco.enecoperiod(period))
+            self.assertTotals(accounttotals(self.dbfn, 'eneco', period, 'home')[:2], expected)
+
+    def test_eneco_day(self):
+        expected = summarizeeneco.streamtotals([self.enecofn], 'day')
+        db = UsageDB(self.dbfn, readonly=True)
+        self.assertTotals(db.totals('eneco', 'home', 'day')[:2], expected)
+        db.close()
+
+    def test_vattenfall(self):
+        for period in ('day', 'week', 'month', 'year'):
+            expected = summarizevatten.streamtotals([self.vattenfn], period)
+            self.assertTotals(accounttotals(self.dbfn, 'vattenfall', period, 'home'), expected)
+
+    def test_other_contracts(self):
+        contracts = ContractPeriods.parse("2021-05-01")
+        expected = summarizeeneco.streamtotals([self.enecofn], contracts)
+        self.assertTotals(accounttotals(self.dbfn, 'eneco', 'eneco', 'home', contracts)[:2], expected)
+
+    def test_refresh(self):
+        # loading changed values for a window updates the rollups as a rebuild does
+        dbfn = os.path.join(self.tmp.name, "refresh.db")
+        db = UsageDB(dbfn)
+        with open(self.vattenfn) as fh:
+            responses = list(summarizevatten.readlines(fh))
+        db.upsert(vattenfallrows('home', responses))
+        window = responses[len(responses)//2]
+        for header in window['ConsumptionHeaderSet']:
+            for item in header['ConsumptionSet']:
+                item['DeliveryQuantity'] = "1.000"
+        db.upsert(vattenfallrows('home', [window]))
+        refreshed = {p: db.totals('vattenfall', 'home', p) for p in ('day', 'week', 'month', 'year')}
+        db.rebuild()
+        for period, sums in refreshed.items():
+            self.assertTotals(sums, db.totals('vattenfall', 'home', period))
+        self.assertNotEqual(refreshed['year'], accounttotals(self.dbfn, 'vattenfall', 'year', 'home'))
+        db.close()
@@ -0,0 +1,118 @@
+"""
+Conversion of the timestamps in the eneco and vattenfall data to hour numbers.
+
+Hour numbers are hours since 1970-01-01 00:00, as used by rollup.py and
+hourstore.py. The timestamps have a fixed format, so they are parsed by
+slicing, with the day number cached per date, instead of building a datetime
+for every sample.
+
+Conversion between utc and Europe/Amsterdam hour numbers uses a table of the
+utc offsets per day, computed from zoneinfo once for each day, with the hour
+of the DST transition on the days which have one.
+"""
+from datetime import datetime, timezone
+
+from rollup import daynumber
+
+
+_dates = {}
+
+def datehour(ymd):
+    """
+    Converts a "%Y-%m-%d" date to the hour number of it's midnight.
+    """
+    h = _dates.get(ymd)
+    if h is None:
+        h = _dates[ymd] = daynumber(int(ymd[:4]), int(ymd[5:7]), int(ymd[8:10])) * 24
+    return h
+
+
+def isohour(t):
+    """
+    Converts "2021-03-24T23:00:00Z" or "2021-03-24" to an hour number.
+    """
+    if len(t) > 10:
+        return datehour(t[:10]) + int(t[11:13])
+    return datehour(t)
+
+
+def clockhour(ymd, hm):
+    """
+    Converts a vattenfall DateFrom and TimeFrom to an hour number.
+    """
+    return datehour(ymd) + int(hm[:2]) if hm else datehour(ymd)
+
+
+class TimeZoneTable:
+    """
+    utc offsets in whole hours for a timezone, cached per utc day.
+
+    `localdays` caches the offset per local day without a transition nearby,
+    so `utc` usually needs a single lookup.
+    """
+    def __init__(self, name="Europe/Amsterdam"):
+        self.name = name
+        self.tz = None
+        self.days = {}
+        self.localdays = {}
+
+    def zoneoffset(self, h):
+        if self.tz is None:
+            from zoneinfo import ZoneInfo
+            self.tz = ZoneInfo(self.name)
+        return int(datetime.fromtimestamp(h*3600, tz=timezone.utc).astimezone(self.tz).utcoffset().total_seconds()) // 3600
+
+    def day(self, day):
+        """
+        Returns (offset, transition hour or None, offset after the transition) for a utc day.
+        """
+        entry = self.days.get(day)
+        if entry is None:
+            h = day*24
+            before, after = self.zoneoffset(h), self.zoneoffset(h+24)
+            change = None
+            if before != after:
+                change = next(h+i for i in range(1, 25) if self.zoneoffset(h+i) == after)
+            entry = self.days[day] = (before, change, after)
+        return entry
+
+    def offset(self, h):
+        """
+        Returns the utc offset in hours at utc hour `h`.
+        """
+        before, change, after = self.day(h//24)
+        return before if change is None or h < change else after
+
+    def local(self, h):
+        """
+        Converts a utc hour number to a local hour number.
+        """
+        return h + self.offset(h)
+
+    def utc(self, lh, fold=0):
+        """
+        Converts a local hour number to a utc hour number.
+
+        The hour repeated at the end of DST is the first occurrence for
+        fold=0, and the second for fold=1, like datetime.fold. An hour skipped
+        at the start of DST uses the offset before the transition for fold=0.
+        """
+        offset = self.localdays.get(lh // 24)
+        if offset is None:
+            day = lh // 24
+            before, after = self.offset(day*24 - 26), self.offset(day*24 + 49)
+            offset = self.localdays[day] = before if before == after else False
+        if offset is not False:
+            return lh - offset
+        before, after = self.offset(lh - 26), self.offset(lh + 26)
+        if before == after:
+            return lh - before
+        valid = sorted(lh - o for o in (before, after) if self.offset(lh - o) == o)
+        if len(valid) == 2:
+            return valid[min(fold, 1)]
+        if valid:
+            return valid[0]
+        return lh - (before if fold == 0 else after)
+
+
+AMSTERDAM = TimeZoneTable("Europe/Amsterdam")
@@ -0,0 +1,89 @@
+"""
+On-disk cache for usage responses.
+
+The usage for a window which ended a while ago no longer changes, so those
+responses are stored on disk, keyed by a hash of provider, customer, endpoint
+and window. Entries expire after `ttl` seconds, and the least recently used
+entries are removed when the cache grows beyond `maxsize` bytes.
+"""
+import os
+import json
+import time
+import hashlib
+from datetime import datetime, timedelta
+
+# the number of days after the end of a window before it's data is considered final.
+SETTLEDAYS = 3
+
+
+def isclosed(tend, now=None):
+    """
+    True when the window ending at `tend` (exclusive) will no longer change.
+    """
+    return tend + timedelta(days=SETTLEDAYS) <= (now or datetime.now())
+
+
+class UsageCache:
+    def __init__(self, path, ttl=400*86400, maxsize=256*1024*1024):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+    def key(self, *parts):
+        return hashlib.sha256("\0".join(str(_) for _ in parts).encode('utf-8')).hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + ".json")
+
+    def get(self, key):
+        fn = self.filename(key)
+        try:
+            st = os.stat(fn)
+            if st.st_mtime + self.ttl < time.time():
+                os.unlink(fn)
+                return
+            with open(fn, "rb") as fh:
+                obj = json.load(fh)
+            # the mtime is used for LRU eviction
+            os.utime(fn)
+            return obj
+        except (OSError, ValueError):
+            return
+
+    def put(self, key, obj):
+        fn = self.filename(key)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        tmp = "%s.%d.tmp" % (fn, os.getpid())
+        with open(tmp, "w") as fh:
+            json.dump(obj, fh)
+        os.replace(tmp, fn)
+        self.evict()
+
+    def entries(self):
+        for d in os.scandir(self.path):
+            if not d.is_dir():
+                continue
+            for f in os.scandir(d.path):
+                if f.name.endswith(".json"):
+                    yield f.path, f.stat()
+
+    def evict(self):
+        """
+        Remove expired entries, then the oldest entries until the total size
+        is below `maxsize`.
+        """
+        now = time.time()
+        l = []
+        total = 0
+        for fn, st in self.entries():
+            if st.st_mtime + self.ttl < now:
+                os.unlink(fn)
+                continue
+            l.append((st.st_mtime, st.st_size, fn))
+            total += st.st_size
+        l.sort()
+        for _, size, fn in l:
+            if total <= self.maxsize:
+                break
+            os.unlink(fn)
+            total -= size
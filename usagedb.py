@@ -0,0 +1,566 @@
+"""
+A SQLite database with the normalized hourly records of several accounts.
+
+There is one row per provider, account, hour and product:
+
+    provider      'eneco' or 'vattenfall'
+    account       the account name, as in the `eneco:<name>` config sections
+    hour          int      hours since 1970-01-01 00:00 UTC
+    product       'G' or 'E'
+    high, low     float    m3 or kWh, for vattenfall all usage is in high
+    redelivery    float    kWh
+    highcost, lowcost, fixedcost, totalcost    float, eneco only
+    status, collector, errors                  text, eneco only
+    doubletariff, doublemeter                  int, eneco only
+    quality       int      data quality flags, see quality.py
+
+A partial index on the rows with quality flags finds the flagged hours
+without reading the others.
+
+The primary key (provider, account, hour, product) is the index used for all
+queries, rows are stored in index order. Loading the same records again
+replaces the existing rows, so loading is idempotent, and a later fetch of an
+hour replaces an earlier one.
+
+The `rollups` table holds the gas, electricity, received and delivered totals
+and the number of hours with data, per day, week, month, year, and for eneco
+per contract period, on the same
+timeline as the summarize tools use: utc hours for eneco, local time for
+vattenfall. After each load, the totals of the days with new hours are
+recomputed from the hours, and the totals of the longer periods containing
+those days from the day totals.
+"""
+import os
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+
+from rollup import periodsfor, daylabel, labeler, ContractPeriods
+from timestamps import isohour, AMSTERDAM
+from stats import STATS
+
+FIELDS = ['high', 'low', 'redelivery', 'highcost', 'lowcost', 'fixedcost', 'totalcost',
+          'status', 'collector', 'errors', 'doubletariff', 'doublemeter', 'quality']
+COLUMNS = ['provider', 'account', 'hour', 'product'] + FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    hour INTEGER NOT NULL,
+    product TEXT NOT NULL,
+    high REAL, low REAL, redelivery REAL,
+    highcost REAL, lowcost REAL, fixedcost REAL, totalcost REAL,
+    status TEXT, collector TEXT, errors TEXT,
+    doubletariff INTEGER, doublemeter INTEGER,
+    quality INTEGER,
+    PRIMARY KEY (provider, account, hour, product)
+) WITHOUT ROWID
+"""
+
+QUALITYINDEX = "CREATE INDEX IF NOT EXISTS usage_quality ON usage (provider, account, hour) WHERE quality != 0"
+
+CONTRACTSCHEMA = """
+CREATE TABLE IF NOT EXISTS contracts (
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    dates TEXT NOT NULL,
+    PRIMARY KEY (provider, account)
+)
+"""
+
+ROLLUPSCHEMA = """
+CREATE TABLE IF NOT EXISTS rollups (
+    provider TEXT NOT NULL,
+    account TEXT NOT NULL,
+    period TEXT NOT NULL,
+    first INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    gas REAL, elec REAL, received REAL, delivered REAL,
+    hours INTEGER,
+    PRIMARY KEY (provider, account, period, first)
+) WITHOUT ROWID
+"""
+
+UPSERT = "INSERT INTO usage (%s) VALUES (%s) ON CONFLICT (provider, account, hour, product) DO UPDATE SET %s" % (
+    ", ".join(COLUMNS), ", ".join("?" for _ in COLUMNS), ", ".join("%s=excluded.%s" % (_, _) for _ in FIELDS))
+
+# the eneco electricity usage is in either high or low, as in summarizeeneco.
+ENECOELEC = "CASE WHEN high THEN high ELSE IFNULL(low, 0) END"
+
+# the gas, electricity, received and delivered values per hour, as in the summarize tools.
+VALUES = {
+    'eneco': [
+        "CASE product WHEN 'G' THEN IFNULL(high, 0) END",
+        "CASE product WHEN 'E' THEN %s END" % ENECOELEC,
+        "CASE product WHEN 'E' THEN %s END" % ENECOELEC,
+        "CASE product WHEN 'E' THEN IFNULL(redelivery, 0) END",
+    ],
+    'vattenfall': [
+        "CASE product WHEN 'G' THEN IFNULL(high, 0) - IFNULL(redelivery, 0) END",
+        "CASE product WHEN 'E' THEN IFNULL(high, 0) - IFNULL(redelivery, 0) END",
+        "CASE product WHEN 'E' THEN IFNULL(high, 0) END",
+        "CASE product WHEN 'E' THEN IFNULL(redelivery, 0) END",
+    ],
+}
+
+# the schema version, in PRAGMA user_version
+VERSION = 2
+
+# the materialized periods longer than a day, 'eneco' are the contract periods.
+ROLLUPS = {
+    'eneco': ['week', 'month', 'year', 'eneco'],
+    'vattenfall': ['week', 'month', 'year'],
+}
+
+
+def isdb(path):
+    """
+    True when `path` is a sqlite database file.
+    """
+    try:
+        with open(path, "rb") as fh:
+            return fh.read(16) == b"SQLite format 3\0"
+    except (IsADirectoryError, FileNotFoundError):
+        return False
+
+
+class UsageDB:
+    def __init__(self, filename, batchsize=50000, readonly=False):
+        """
+        Opens or creates the database, and upgrades a database created by an
+        older version. A `readonly` database is opened without any writes, so
+        it can be on a read-only file or mount, and must be up to date.
+        """
+        # imported here, the summarize tools import this module for isdb
+        import sqlite3
+        self.filename = os.path.expanduser(filename)
+        self.batchsize = batchsize
+        if readonly:
+            import urllib.parse
+            uri = "file:%s?mode=ro" % urllib.parse.quote(os.path.abspath(self.filename))
+            try:
+                self.db = sqlite3.connect(uri, uri=True)
+                version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            except sqlite3.OperationalError:
+                # the wal index can not be created on read-only media. immutable ignores
+                # the wal and the locks, so it is only used when no writes are pending.
+                if os.path.exists(self.filename + "-wal") and os.path.getsize(self.filename + "-wal"):
+                    raise
+                self.db = sqlite3.connect(uri + "&immutable=1", uri=True)
+                version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            if version < VERSION:
+                self.db.close()
+                raise Exception("%s was created by an older version, run `usagedb.py %s` to upgrade it" % (filename, filename))
+            return
+        self.db = sqlite3.connect(self.filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(SCHEMA)
+        self.db.execute(ROLLUPSCHEMA)
+        self.db.execute(CONTRACTSCHEMA)
+        self.db.commit()
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < VERSION:
+            self.upgrade()
+            self.db.execute("PRAGMA user_version=%d" % VERSION)
+        self.db.execute(QUALITYINDEX)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def upgrade(self):
+        """
+        Add the columns missing in databases created by older versions, and
+        compute the rollups.
+        """
+        from quality import flags
+        with self.db:
+            if 'quality' not in self.columnnames('usage'):
+                self.db.execute("ALTER TABLE usage ADD COLUMN quality INTEGER")
+                rows = self.db.execute("SELECT status, collector, errors, doubletariff, doublemeter, product, provider, account, hour FROM usage WHERE provider='eneco'").fetchall()
+                self.db.executemany("UPDATE usage SET quality=? WHERE product=? AND provider=? AND account=? AND hour=?",
+                        [(flags(*r[:5], r[5] == 'E'), *r[5:]) for r in rows])
+            if 'hours' not in self.columnnames('rollups'):
+                self.db.execute("ALTER TABLE rollups ADD COLUMN hours INTEGER")
+        self.rebuild()
+
+    def columnnames(self, table):
+        return [row[1] for row in self.db.execute("PRAGMA table_info(%s)" % table)]
+
+    def upsert(self, rows):
+        """
+        Insert or replace `rows`, tuples in COLUMNS order, in one transaction,
+        in batches of `batchsize`, and update the rollups for the hours loaded.
+        Returns the number of rows.
+        """
+        n = 0
+        rows = iter(rows)
+        touched = defaultdict(set)
+        with self.db:
+            with STATS.timer('db_upsert'):
+                while batch := list(islice(rows, self.batchsize)):
+                    self.db.executemany(UPSERT, batch)
+                    for r in batch:
+                        touched[r[:2]].add(r[2])
+                    n += len(batch)
+            with STATS.timer('db_rollups'):
+                for (provider, account), hours in touched.items():
+                    self.refresh(provider, account, hours)
+        STATS.count('db_rows', n)
+        return n
+
+    def rebuild(self):
+        """
+        Recompute all rollups.
+        """
+        with self.db:
+            self.db.execute("DELETE FROM rollups")
+            for provider, account in self.accounts():
+                hours = [h for h, in self.db.execute("SELECT DISTINCT hour FROM usage WHERE provider=? AND account=?", (provider, account))]
+                self.refresh(provider, account, hours)
+
+    def refresh(self, provider, account, hours):
+        """
+        Recompute the rollups for the periods containing `hours`, utc hour numbers.
+        """
+        tl = timeline(provider)
+        days = sorted({tl(h)//24 for h in hours})
+        if not days:
+            return
+
+        # day totals from the hours, a local day starts at most 2 hours before the utc day.
+        affected = set(days)
+        sums = {}
+        uh, columns = self.hourcolumns(provider, account, VALUES[provider], days[0]*24-2, (days[-1]+1)*24)
+        for i, h in enumerate(uh):
+            day = tl(h)//24
+            if day in affected:
+                s = sums.setdefault(day, [0.0]*len(columns) + [0])
+                for j, col in enumerate(columns):
+                    s[j] += col[i]
+                s[-1] += 1
+        self.db.executemany("INSERT OR REPLACE INTO rollups VALUES (?, ?, 'day', ?, ?, ?, ?, ?, ?, ?)",
+                [(provider, account, day*24, daylabel(day), *s) for day, s in sums.items()])
+
+        # longer periods from the day totals, the periods are determined over all days of
+        # the account, so a period has the same start as when summarizing all hours.
+        first, last = self.db.execute("SELECT MIN(first), MAX(first) FROM rollups WHERE provider=? AND account=? AND period='day'",
+                (provider, account)).fetchone()
+        for period in ROLLUPS[provider]:
+            periods = periodsfor(self.contractperiods(provider, account) if period == 'eneco' else period)
+            starts = list(periods(first//24, last//24)) + [(None, last//24+1)]
+            for (label, a), (_, b) in zip(starts, starts[1:]):
+                i = bisect_left(days, a)
+                if i == len(days) or days[i] >= b:
+                    continue
+                self.db.execute("DELETE FROM rollups WHERE provider=? AND account=? AND period=? AND first>=? AND first<?",
+                        (provider, account, period, a*24, b*24))
+                self.db.execute("INSERT INTO rollups SELECT provider, account, ?, ?, ?, TOTAL(gas), TOTAL(elec), TOTAL(received), TOTAL(delivered), SUM(hours) "
+                        "FROM rollups WHERE provider=? AND account=? AND period='day' AND first>=? AND first<?",
+                        (period, a*24, label, provider, account, a*24, b*24))
+
+    def hourcounts(self, provider, account, period, h0=None, h1=None):
+        """
+        Returns a defaultdict(int), label -> the number of hours with data,
+        for the utc hours from h0 upto h1. Without bounds the materialized
+        counts are used, otherwise the hours in the range are counted, so a
+        period cut by h0 or h1 counts the same hours as `flagged` returns.
+        """
+        counts = defaultdict(int)
+        if h0 is None and h1 is None:
+            for label, n in self.db.execute("SELECT label, hours FROM rollups WHERE provider=? AND account=? AND period=? ORDER BY first",
+                    (provider, account, period)):
+                counts[label] += n
+            return counts
+        label = labeler(period)
+        tl = timeline(provider)
+        for h, in self.db.execute("SELECT DISTINCT hour FROM usage WHERE provider=? AND account=? AND hour>=? AND hour<?",
+                (provider, account, -2**31 if h0 is None else h0, 2**31 if h1 is None else h1)):
+            counts[label(tl(h))] += 1
+        return counts
+
+    def flagged(self, provider, account, mask, product=None, h0=None, h1=None):
+        """
+        Returns a list of (hour, product, quality) for the rows with any of
+        the quality flags in `mask`, from hour h0 upto h1, using the quality index.
+        """
+        q = "SELECT hour, product, quality FROM usage INDEXED BY usage_quality WHERE provider=? AND account=? AND quality != 0 AND hour>=? AND hour<? AND quality & ?"
+        params = [provider, account, -2**31 if h0 is None else h0, 2**31 if h1 is None else h1, mask]
+        if product:
+            q += " AND product=?"
+            params.append(product)
+        return self.db.execute(q + " ORDER BY hour, product", params).fetchall()
+
+    def contractperiods(self, provider, account):
+        """
+        Returns the contract periods for the account.
+        """
+        row = self.db.execute("SELECT dates FROM contracts WHERE provider=? AND account=?", (provider, account)).fetchone()
+        if row:
+            return ContractPeriods.parse(row[0])
+        from summarizeeneco import ENECOCONTRACTS
+        return ENECOCONTRACTS
+
+    def setcontracts(self, provider, account, contracts):
+        """
+        Set the contract periods for the account, and recompute it's contract
+        period totals when these changed.
+        """
+        if contracts == self.contractperiods(provider, account):
+            return
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO contracts VALUES (?, ?, ?)", (provider, account, str(contracts)))
+            self.db.execute("DELETE FROM rollups WHERE provider=? AND account=? AND period='eneco'", (provider, account))
+            hours = [h for h, in self.db.execute("SELECT DISTINCT hour FROM usage WHERE provider=? AND account=?", (provider, account))]
+            self.refresh(provider, account, hours)
+
+    def totals(self, provider, account, period):
+        """
+        Returns the gas, electricity, received and delivered totals for a
+        materialized period, as defaultdict(float) label -> total.
+        """
+        sums = [defaultdict(float) for _ in range(4)]
+        for row in self.db.execute("SELECT label, gas, elec, received, delivered FROM rollups "
+                "WHERE provider=? AND account=? AND period=? ORDER BY first", (provider, account, period)):
+            for s, v in zip(sums, row[1:]):
+                s[row[0]] += v
+        return sums
+
+    def daytotals(self, provider, account, period):
+        """
+        Returns the totals for a period which is not materialized, like other
+        contract periods, summed from the day totals, as `totals`.
+        """
+        label = labeler(period)
+        sums = [defaultdict(float) for _ in range(4)]
+        for row in self.db.execute("SELECT first, gas, elec, received, delivered FROM rollups "
+                "WHERE provider=? AND account=? AND period='day' ORDER BY first", (provider, account)):
+            l = label(row[0])
+            for s, v in zip(sums, row[1:]):
+                s[l] += v
+        return sums
+
+    def accounts(self, provider=None):
+        """
+        Returns a list of (provider, account) in the database.
+        """
+        if provider:
+            return self.db.execute("SELECT DISTINCT provider, account FROM usage WHERE provider=?", (provider,)).fetchall()
+        return self.db.execute("SELECT DISTINCT provider, account FROM usage").fetchall()
+
+    def lasthour(self, provider, account):
+        """
+        Returns the newest hour for the account, or None
+        """
+        return self.db.execute("SELECT MAX(hour) FROM usage WHERE provider=? AND account=?", (provider, account)).fetchone()[0]
+
+    def range(self, provider, account, h0=None, h1=None, product=None):
+        """
+        Returns a cursor over the rows of the account from hour h0 upto h1, ordered by hour.
+        """
+        q = "SELECT %s FROM usage WHERE provider=? AND account=? AND hour>=? AND hour<?" % ", ".join(COLUMNS)
+        params = [provider, account, -2**31 if h0 is None else h0, 2**31 if h1 is None else h1]
+        if product:
+            q += " AND product=?"
+            params.append(product)
+        return self.db.execute(q + " ORDER BY hour, product", params)
+
+    def hourcolumns(self, provider, account, expressions, h0=None, h1=None):
+        """
+        Returns an array of hours, and an array of sums per hour for each of
+        the sql `expressions`, for the account from hour h0 upto h1.
+        """
+        q = "SELECT hour, %s FROM usage WHERE provider=? AND account=? AND hour>=? AND hour<? GROUP BY hour ORDER BY hour" % (
+            ", ".join("TOTAL(%s)" % _ for _ in expressions))
+        params = [provider, account, -2**31 if h0 is None else h0, 2**31 if h1 is None else h1]
+        hours = array('l')
+        columns = [array('d') for _ in expressions]
+        for row in self.db.execute(q, params):
+            hours.append(row[0])
+            for col, v in zip(columns, row[1:]):
+                col.append(v)
+        return hours, columns
+
+
+def timeline(provider):
+    """
+    Returns a function converting a utc hour number to the hour number on the
+    timeline used for the totals of `provider`.
+    """
+    if provider == 'vattenfall':
+        return AMSTERDAM.local
+    return lambda h: h
+
+
+def measurementrow(provider, account, hour, product, m, redelivery=None, quality=0):
+    errors = m.get('errorCodes')
+    return (provider, account, hour, product,
+            m.get('high'), m.get('low'), redelivery,
+            m.get('highCostInclVat'), m.get('lowCostInclVat'), m.get('fixedCostInclVat'), m.get('totalCostInclVat'),
+            m.get('status'), m.get('collectorType'), ",".join(errors) if errors else None,
+            m.get('isDoubleTariff'), m.get('isDoubleMeter'), quality)
+
+
+def enecorows(account, records):
+    """
+    yields the rows for eneco `actual` records.
+    """
+    from quality import recordflags
+    for d in records:
+        if not (d and d.get('date')):
+            continue
+        h = isohour(d['date'])
+        gasflags, elecflags = recordflags(d)
+        if gas := d.get('gas'):
+            yield measurementrow('eneco', account, h, 'G', gas, None, gasflags)
+        if elec := d.get('electricity'):
+            redelivery = d.get('redelivery') or {}
+            yield measurementrow('eneco', account, h, 'E', elec, (redelivery.get('high') or 0) + (redelivery.get('low') or 0), elecflags)
+
+
+def vattenfallrows(account, responses):
+    """
+    yields the rows for vattenfall consumption responses.
+    """
+    from summarizevatten import gethours
+    for j in responses:
+        # the hour repeated at the end of DST is reported twice with the same local time.
+        seen = {}
+        for product, lh, q, qr in gethours([j]):
+            fold = seen[(product, lh)] = seen.get((product, lh), -1) + 1
+            h = AMSTERDAM.utc(lh, fold)
+            yield ('vattenfall', account, h, product, q, None, qr) + (None,)*9 + (0,)
+
+
+def storerows(account, path):
+    """
+    yields the rows for an hourly store.
+    """
+    from hourstore import HourStore
+    store = HourStore(path)
+    cols = store.load()
+    if store.provider == 'vattenfall':
+        for h, g, e, r in zip(cols['hour'], cols['gas'], cols['elec_high'], cols['redelivery']):
+            yield ('vattenfall', account, h, 'E', e, None, r) + (None,)*9 + (0,)
+            yield ('vattenfall', account, h, 'G', g, None, 0.0) + (None,)*9 + (0,)
+        return
+    from hourstore import enecorecord
+    from quality import recordflags, OTHERUSAGE
+    for i in range(len(cols['hour'])):
+        d = enecorecord(store, cols, i)
+        gasflags, elecflags = recordflags(d)
+        if cols['redelivery'][i]:
+            elecflags |= OTHERUSAGE
+        yield measurementrow('eneco', account, cols['hour'][i], 'G', d['gas'], None, gasflags)
+        yield measurementrow('eneco', account, cols['hour'][i], 'E', d['electricity'], cols['redelivery'][i], elecflags)
+
+
+def defaultaccount(db, provider, account=None):
+    """
+    Returns `account`, or the only account for `provider` in the database.
+    """
+    if account:
+        return account
+    names = [a for p, a in db.accounts(provider)]
+    if len(names) != 1:
+        raise Exception("specify one of the %s accounts: %s" % (provider, ", ".join(names)))
+    return names[0]
+
+
+def enecocolumns(filename, account=None):
+    """
+    returns the hour, gas and electricity arrays for an eneco account, as getstorecolumns.
+    """
+    db = UsageDB(filename, readonly=True)
+    hours, (gas, elec) = db.hourcolumns('eneco', defaultaccount(db, 'eneco', account), [
+            "CASE product WHEN 'G' THEN IFNULL(high, 0) END",
+            "CASE product WHEN 'E' THEN %s END" % ENECOELEC])
+    db.close()
+    return hours, gas, elec
+
+
+def accounttotals(filename, provider, period, account=None, contracts=None):
+    """
+    Returns the materialized totals for a period, see UsageDB.totals.
+    Totals for other `contracts` than those in the database are summed from
+    the day totals.
+    """
+    db = UsageDB(filename, readonly=True)
+    account = defaultaccount(db, provider, account)
+    if contracts and period == 'eneco' and contracts != db.contractperiods(provider, account):
+        sums = db.daytotals(provider, account, contracts)
+    else:
+        sums = db.totals(provider, account, period)
+    db.close()
+    return sums
+
+
+def enecorecords(filename, account=None):
+    """
+    yields `actual` like records for an eneco account, as used by summarizeeneco.
+    """
+    def measurement(row):
+        return dict(zip(['high', 'low', 'redelivery', 'highCostInclVat', 'lowCostInclVat', 'fixedCostInclVat', 'totalCostInclVat',
+                'status', 'collectorType', 'errorCodes', 'isDoubleTariff', 'isDoubleMeter'], row[4:]),
+                errorCodes = row[13].split(",") if row[13] else None,
+                isDoubleTariff = bool(row[14]), isDoubleMeter = bool(row[15]))
+
+    from hourstore import hourtime
+    db = UsageDB(filename, readonly=True)
+    d = None
+    for row in db.range('eneco', defaultaccount(db, 'eneco', account)):
+        if d is None or d['hour'] != row[2]:
+            if d:
+                yield d
+            d = dict(hour = row[2], date = f"{hourtime(row[2]):%Y-%m-%dT%H:%M:%S}Z")
+        d['gas' if row[3] == 'G' else 'electricity'] = measurement(row)
+    if d:
+        yield d
+    db.close()
+
+
+def vattenfallhours(filename, account=None):
+    """
+    yields (product, utc hour number, local hour number, quantity, backquantity) tuples
+    for a vattenfall account.
+    """
+    db = UsageDB(filename, readonly=True)
+    for row in db.range('vattenfall', defaultaccount(db, 'vattenfall', account)):
+        yield (row[3], row[2], AMSTERDAM.local(row[2]), row[4] or 0.0, row[6] or 0.0)
+    db.close()
+
+
+def main():
+    """
+    Load dumps or hourly stores into a database.
+    """
+    import argparse
+    import stats
+    parser = argparse.ArgumentParser(description='load eneco or vattenfall dumps or stores into a usage database')
+    parser.add_argument('--provider', choices=['eneco', 'vattenfall'], default='eneco')
+    parser.add_argument('--account', '-a', type=str, default='default', help='account name, default: default')
+    stats.addarguments(parser)
+    parser.add_argument('database', type=str)
+    parser.add_argument('filenames', type=str, nargs='*', help='dump files or store directories, without files the database is only upgraded')
+    args = parser.parse_args()
+    stats.fromargs(args)
+
+    db = UsageDB(args.database)
+    for fn in args.filenames:
+        if os.path.isdir(fn):
+            n = db.upsert(storerows(args.account, fn))
+        else:
+            with open(fn, "r") as fh:
+                if args.provider == 'eneco':
+                    from summarizeeneco import readlines, getdata
+                    n = db.upsert(enecorows(args.account, getdata(readlines(fh))))
+                else:
+                    from summarizevatten import readlines
+                    n = db.upsert(vattenfallrows(args.account, readlines(fh)))
+        print("%s: %d rows" % (fn, n))
+    db.close()
+
+if __name__=='__main__':
+    main()
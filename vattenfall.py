@@ -8,16 +8,26 @@ manually extract the auth code and customerid from your browser, for instance
 by looking at requests in the debug view.
 """
 import re
-import urllib.request
 import urllib.parse
-import http.cookiejar
 import json
 from datetime import datetime, timezone, timedelta
 import binascii
+import os
+import time
+import threading
+from fetcher import fetchwindows, afetchwindows
+from httppool import ConnectionPool, AsyncConnectionPool
+from retry import Retrier, requesterrors
+from usagecache import UsageCache, isclosed, SETTLEDAYS
+from hourstore import HourStore, isstore, vattenfallrows, localtime
+from journal import Journal
+from config import loadconfig
+from rollup import hournumber
+from stats import STATS
 
 
 class Vattenfall:
-    def __init__(self, args):
+    def __init__(self, args, pool=None):
         self.args = args
         # from: https://www.vattenfall.nl/service/mijn-vattenfall/main.efd1d01bec9ac539.js
         # 814633e3eccb4bcc931190267d169b52  chatbotSubscriptionKey: chatbotEndpoint: "https://api.vattenfall.nl/chatbot-api",
@@ -33,23 +43,19 @@ class Vattenfall:
         # customer_id / ?
         self.customerid = args.customerid
 
-        handlers = []
-        if args.debug:
-            handlers.append(urllib.request.HTTPSHandler(debuglevel=1))
-        self.opener = urllib.request.build_opener(*handlers)
+        self.pool = pool or ConnectionPool(args.poolsize, args.timeout, debuglevel=1 if args.debug else 0, retrier=Retrier(args.retries))
+        self.cache = UsageCache(args.cache) if args.cache else None
+        self.ratelimit = None
+        self.limits = WindowLimits(os.path.join(os.path.expanduser(args.cache), "vattenfall-limits.json") if args.cache else None)
 
     def logprint(self, *args):
         if self.args.debug:
             print(*args)
 
-    def httpreq(self, url, data=None):
+    def requestheaders(self, data):
         """
-        Generic http request function.
-        Does a http-POST when the 'data' argument is present.
-
-        Adds the nesecesary xsrf and auth headers.
+        Returns the encoded request body, and the headers with the apikey and auth headers.
         """
-        self.logprint(">", url)
         hdrs = { }
         if data and type(data)==str:
             data = data.encode('utf-8')
@@ -58,30 +64,50 @@ class Vattenfall:
             hdrs["Ocp-Apim-Subscription-Key"] = self.apikey
         if self.auth:
             hdrs['Authorization'] = "Bearer " + self.auth
-        req = urllib.request.Request(url, headers=hdrs)
-        kwargs = dict()
-        if data:
-            kwargs["data"] = data
-
-        for tries in range(3):
-            try:
-                response = self.opener.open(req, **kwargs)
-            except urllib.error.HTTPError as e:
-                self.logprint("!", str(e))
-                response = e
-            try:
-                data = response.read()
-            except http.client.IncompleteRead as e:
-                print("retrying - %s" % e)
-                continue
-            if response.headers.get("content-type", '').find("application/json")>=0:
+        return data, hdrs
+
+    def decoderesponse(self, response, host, t0):
+        """
+        Returns the decoded json, or the raw data of a response.
+        """
+        if response.status >= 400:
+            self.logprint("!", str(response))
+        data = response.read()
+        STATS.observe('http_request', time.perf_counter() - t0, host=host, status=response.status)
+        STATS.count('http_received_bytes', len(data), host=host)
+        if response.headers.get("content-type", '').find("application/json")>=0:
+            with STATS.timer('json_decode'):
                 js = json.loads(data)
-                self.logprint(js)
-                self.logprint()
-                return js
-            self.logprint(data)
+            self.logprint(js)
             self.logprint()
-            return data
+            return js
+        self.logprint(data)
+        self.logprint()
+        return data
+
+    def httpreq(self, url, data=None):
+        """
+        Generic http request function.
+        Does a http-POST when the 'data' argument is present.
+
+        Adds the nesecesary xsrf and auth headers.
+        """
+        self.logprint(">", url)
+        data, hdrs = self.requestheaders(data)
+
+        def send():
+            if self.ratelimit:
+                self.ratelimit.wait()
+            return self.pool.request(url, data or None, hdrs)
+
+        host = urllib.parse.urlsplit(url).hostname
+        t0 = time.perf_counter()
+        try:
+            response = self.pool.retrier.call(send, url, idempotent=data is None)
+        except requesterrors() as e:
+            STATS.count('http_failures', host=host)
+            raise Exception("failed to connect to %s: %s" % (url, e))
+        return self.decoderesponse(response, host, t0)
     def login(self, username, password):
         captchatoken = ""  # TODO: get this from browser.
         q = {
@@ -103,6 +129,20 @@ class Vattenfall:
         """
         NOTE: tend is inclusive
         """
+        url, key = self.usagerequest(tstart, tend, interval)
+        if key is None:
+            return self.httpreq(url)
+        j = self.cache.get(key)
+        if j is None:
+            j = self.httpreq(url)
+            if type(j)==dict and j.get('ConsumptionHeaderSet'):
+                self.cache.put(key, j)
+        return j
+
+    def usagerequest(self, tstart, tend, interval):
+        """
+        Returns the url for a consumption window, and it's cache key, or None when it is not cached.
+        """
         start = f"{tstart:%Y-%m-%d}"
         end = f"{tend:%Y-%m-%d}"
         q = dict(
@@ -115,43 +155,393 @@ class Vattenfall:
             GetComparedConsumption = False,
             DateFrom = start,
             DateTo = end)
-        return self.httpreq(f"{self.baseurl}/consumptions/consumptions/{self.customerid}/{interval}/?"+urllib.parse.urlencode(q))
+        url = f"{self.baseurl}/consumptions/consumptions/{self.customerid}/{interval}/?"+urllib.parse.urlencode(q)
+
+        # only windows which ended a while ago are cached.
+        if not self.cache or not isclosed(datetime(tend.year, tend.month, tend.day) + timedelta(days=1)):
+            return url, None
+        return url, self.cache.key("vattenfall", self.customerid, "consumptions", start, end, interval)
+
+
+    def getrange(self, tstart, tend, interval):
+        """
+        Returns a list of responses for tstart upto tend (inclusive).
+        When the api refuses the window, or returns less than requested,
+        the window is split in two, and the window limits are updated.
+        """
+        j = self.getusage(tstart, tend, interval)
+        probe = None
+        if t := self.probedate(j, tend, interval):
+            probe = self.getusage(t, tend, interval)
+        mid = self.splitwindow(j, tstart, tend, interval, probe)
+        if mid is None:
+            return [j]
+        return self.getrange(tstart, mid-timedelta(days=1), interval) + self.getrange(mid, tend, interval)
+
+    def probedate(self, j, tend, interval):
+        """
+        Returns the day after the last date in response `j`, when it ends
+        before `tend` or the last settled day, and the api did not return later data yet.
+        A request from that day tells a truncated response from data which is
+        not available yet. Otherwise None.
+        """
+        last = lastdates(j)
+        if interval not in (5, 3) or not last:
+            return
+        first = min(last.values())
+        if first >= f"{min(tend, datetime.now() - timedelta(days=SETTLEDAYS)):%Y-%m-%d}":
+            return
+        if any(date < self.limits.newest.get((interval, product), '') for product, date in last.items()):
+            # known to be truncated
+            return
+        return decode_datetime(first) + timedelta(days=1)
+
+    def splitwindow(self, j, tstart, tend, interval, probe=None):
+        """
+        Updates the window limits from response `j`, and the `probe` response
+        for the rest of the window, returns where to split the window, or None
+        when `j` is the complete result.
+        """
+        days = (tend - tstart).days + 1
+        for r in (j, probe):
+            for product, date in lastdates(r).items():
+                self.limits.seen(interval, product, date)
+        if iscomplete(j, tend, interval, self.limits.newest):
+            self.limits.accepted(interval, days)
+            return
+        if days == 1:
+            return
+        self.limits.rejected(interval, days)
+        self.logprint("splitting %d day window" % days)
+        return tstart + timedelta(days=days//2)
+
+
+class AsyncVattenfall(Vattenfall):
+    """
+    The Vattenfall client for asyncio, using an AsyncConnectionPool.
+
+    There is no login, like the blocking client this uses the Authorization
+    header from the `auth` option of the configuration.
+    """
+    def __init__(self, args, pool=None):
+        super().__init__(args, pool or AsyncConnectionPool(args.poolsize, args.timeout, debuglevel=1 if args.debug else 0, retrier=Retrier(args.retries)))
+
+    async def httpreq(self, url, data=None):
+        self.logprint(">", url)
+        data, hdrs = self.requestheaders(data)
+
+        async def send():
+            import asyncio
+            if self.ratelimit and (delay := self.ratelimit.delay()) > 0:
+                await asyncio.sleep(delay)
+            return await self.pool.request(url, data or None, hdrs)
+
+        host = urllib.parse.urlsplit(url).hostname
+        t0 = time.perf_counter()
+        try:
+            response = await self.pool.retrier.acall(send, url, idempotent=data is None)
+        except requesterrors() as e:
+            STATS.count('http_failures', host=host)
+            raise Exception("failed to connect to %s: %s" % (url, e))
+        return self.decoderesponse(response, host, t0)
+
+    async def close(self):
+        """
+        Nothing to wait for, like AsyncEneco.close the pool is left open.
+        """
+
+    async def getusage(self, tstart, tend, interval):
+        url, key = self.usagerequest(tstart, tend, interval)
+        if key is None:
+            return await self.httpreq(url)
+        j = self.cache.get(key)
+        if j is None:
+            j = await self.httpreq(url)
+            if type(j)==dict and j.get('ConsumptionHeaderSet'):
+                self.cache.put(key, j)
+        return j
+
+    async def getrange(self, tstart, tend, interval):
+        j = await self.getusage(tstart, tend, interval)
+        probe = None
+        if t := self.probedate(j, tend, interval):
+            probe = await self.getusage(t, tend, interval)
+        mid = self.splitwindow(j, tstart, tend, interval, probe)
+        if mid is None:
+            return [j]
+        return await self.getrange(tstart, mid-timedelta(days=1), interval) + await self.getrange(mid, tend, interval)
+
+
+def lastdates(j):
+    """
+    Returns the last DateFrom per product in a consumption response.
+    """
+    if type(j)!=dict:
+        return {}
+    last = {}
+    for cc in j.get('ConsumptionHeaderSet') or []:
+        if items := cc.get('ConsumptionSet'):
+            last[cc.get('Product')] = max(c.get('DateFrom') or '' for c in items)
+    return last
+
+
+def iscomplete(j, tend, interval, newest):
+    """
+    Checks if a consumption response is not an error, and, for the hourly and
+    daily intervals, that it is not truncated: ending before `tend`, while the
+    api did return later data for that product, `newest` maps (interval, product)
+    to the last date returned. Recent data which is not available yet is no truncation.
+    """
+    if type(j)!=dict or j.get('ConsumptionHeaderSet') is None:
+        return False
+    if interval not in (5, 3):
+        return True
+    end = f"{tend:%Y-%m-%d}"
+    for product, last in lastdates(j).items():
+        if last < min(end, newest.get((interval, product), '')):
+            return False
+    return True
+
+
+class WindowLimits:
+    """
+    Keeps track of the largest window in days which the api accepted, and
+    the smallest it refused, per interval. These are saved between runs.
+    During a run the last date the api returned per interval and product is
+    kept, to tell a truncated response from data which is not available yet.
 
+    The window size doubles until a window is refused, after that the limit
+    is found by bisecting between the accepted and refused sizes.
+    """
+    # initial window size in days per interval, 5 = hour, 3 = day, 1 = month, 6 = year
+    INITIAL = { 5: 7, 3: 31, 1: 366, 6: 366 }
+    MAXIMUM = { 5: 366, 3: 5*366, 1: 10*366, 6: 20*366 }
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.limits = {}
+        self.newest = {}
+        try:
+            with open(filename, "r") as fh:
+                self.limits = { int(k): v for k, v in json.load(fh).items() }
+        except (TypeError, OSError, ValueError):
+            pass
+
+    def span(self, interval):
+        """
+        Returns the window size in days to use for `interval`.
+        """
+        good, bad = self.limits.get(interval, (None, None))
+        if good is None:
+            return self.INITIAL.get(interval, 7) if bad is None else max(1, bad//2)
+        if bad is None:
+            return min(2*good, self.MAXIMUM.get(interval, 366))
+        return max(good, (good+bad)//2)
+
+    def seen(self, interval, product, date):
+        with self.lock:
+            if date > self.newest.get((interval, product), ''):
+                self.newest[(interval, product)] = date
+
+    def accepted(self, interval, days):
+        with self.lock:
+            good, bad = self.limits.get(interval, (None, None))
+            if good is not None and days <= good:
+                return
+            if bad is not None and days >= bad:
+                bad = None
+            self.limits[interval] = (days, bad)
+
+    def rejected(self, interval, days):
+        with self.lock:
+            good, bad = self.limits.get(interval, (None, None))
+            if bad is not None and days >= bad:
+                return
+            if good is not None and days <= good:
+                good = None
+            self.limits[interval] = (good, days)
+
+    def save(self):
+        if not self.filename:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        with open(self.filename, "w") as fh:
+            json.dump(self.limits, fh)
+
+
+def lastsamples(filename):
+    """
+    Returns a dict: product -> (newest time, number of records with that time)
+
+    The count is needed for the hour which occurs twice when DST ends,
+    vattenfall reports local times.
+    """
+    from summarizevatten import readlines, getdata
+    last = {}
+    if isstore(filename):
+        hours = HourStore(filename).mmap(['hour'])['hour']
+        if len(hours):
+            h = max(hours)
+            t = localtime(h)
+            n = 1 + (localtime(h-1) == t and (h-1) in hours[-2:])
+            last = { 'E': (t, n), 'G': (t, n) }
+        return last
+    try:
+        with open(filename, "r") as fh:
+            for product, t, q, qr in getdata(readlines(fh)):
+                lt, n = last.get(product, (None, 0))
+                if lt is None or t > lt:
+                    last[product] = (t, 1)
+                elif t == lt:
+                    last[product] = (t, n+1)
+    except FileNotFoundError:
+        pass
+    return last
+
+class SyncFilter:
+    """
+    Selects the records newer than those already stored from the consumption responses.
+    """
+    def __init__(self, last):
+        self.last = dict(last)
+
+    def add(self, j):
+        """
+        Returns a copy of `j` containing only the new ConsumptionSet records,
+        or None when there is nothing new.
+        """
+        from summarizevatten import mkdate
+        if type(j)!=dict or not j.get('ConsumptionHeaderSet'):
+            return
+        headers = []
+        for cc in j['ConsumptionHeaderSet']:
+            product = cc.get('Product')
+            lt, n = self.last.get(product, (None, 0))
+            k = 0
+            new = []
+            for c in cc.get('ConsumptionSet') or []:
+                t = mkdate(c.get('DateFrom'), c.get('TimeFrom') or '00:00')
+                if lt is not None and t < lt:
+                    continue
+                if t == lt:
+                    # skip the occurrences of this time which are already stored
+                    k += 1
+                    if k <= n:
+                        continue
+                    n += 1
+                else:
+                    lt, n, k = t, 1, 1
+                new.append(c)
+            self.last[product] = (lt, n)
+            if new:
+                headers.append(dict(cc, ConsumptionSet=new))
+        if headers:
+            return dict(j, ConsumptionHeaderSet=headers)
 
 def decode_datetime(t):
     return datetime.strptime(t, "%Y-%m-%d")
 
-def loadconfig(cfgfile):
+def windows(t0, t1, td):
+    """
+    list of the start times of all `td` sized windows from t0 upto t1.
     """
-    Load config from .energierc
+    l = []
+    t = t0
+    while t < t1:
+        l.append(t)
+        t += td
+    return l
+
+def fetchconsumptions(en, t0, t1, interval, jobs=1, executor=None, journal=None):
     """
-    with open(cfgfile, 'r') as fh:
-        txt = fh.read()
-    txt = "[root]\n" + txt
-    import configparser
-    config = configparser.ConfigParser()
-    config.read_string(txt)
+    yields the consumption responses from t0 until t1, using the
+    largest window size which the api accepts.
 
-    return config
+    With a `journal`, windows already completed are skipped, and each window
+    is recorded as completed once the caller has processed it's responses.
+    """
+    td = timedelta(days=en.limits.span(interval))
+    def fetchwindow(t):
+        return en.getrange(t, t+td-timedelta(days=1), interval)
+
+    if journal:
+        t0 = journal.align(t0, td)
+    ws = windows(t0, t1, td)
+    if journal:
+        ws = journal.pending(ws, td)
+    for t, l in fetchwindows(fetchwindow, ws, jobs, executor):
+        yield from l
+        if journal:
+            journal.complete(t, t+td)
+    en.limits.save()
+
+async def afetchconsumptions(en, t0, t1, interval, jobs=1, journal=None):
+    """
+    Like fetchconsumptions, for an AsyncVattenfall client.
+    """
+    td = timedelta(days=en.limits.span(interval))
+    def fetchwindow(t):
+        return en.getrange(t, t+td-timedelta(days=1), interval)
+
+    if journal:
+        t0 = journal.align(t0, td)
+    ws = windows(t0, t1, td)
+    if journal:
+        ws = journal.pending(ws, td)
+    async for t, l in afetchwindows(fetchwindow, ws, jobs):
+        for j in l:
+            yield j
+        if journal:
+            journal.complete(t, t+td)
+    en.limits.save()
+
+def sync(en, path, t0, t1, interval=5, jobs=1, executor=None):
+    """
+    Append the records newer than the newest in `path`, a dump file or store.
+    When `path` has no data yet, t0 upto t1 is fetched.
+    """
+    last = lastsamples(path)
+    if last:
+        lt = min(t for t, n in last.values())
+        t0 = datetime(lt.year, lt.month, lt.day)
+        t1 = datetime.now()
+    if t0==t1:
+        print("nothing to do, %s is empty, specify nr of weeks(-w), or --from + --until" % path)
+        return
 
+    sf = SyncFilter(last)
+    if isstore(path):
+        store = HourStore(path, 'vattenfall')
+        for j in fetchconsumptions(en, t0, t1, interval, jobs, executor):
+            if j := sf.add(j):
+                store.append(vattenfallrows(j, { (p, hournumber(t)): n for p, (t, n) in last.items() }))
+        return
+    with open(path, "a") as fh:
+        for j in fetchconsumptions(en, t0, t1, interval, jobs, executor):
+            if j := sf.add(j):
+                print(json.dumps(j), file=fh)
+                fh.flush()
 
 def applyconfig(cfg, args):
     """
     Apply the configuration read from .energierc to the `args` dictionary,
     which is used to configure everything.
     """
-    if not args.username and cfg.has_option('vattenfall', 'user'):
-        args.username = cfg.get('vattenfall', 'user')
-    if not args.password and cfg.has_option('vattenfall', 'pass'):
-        args.password = cfg.get('vattenfall', 'pass')
-    if not args.auth and cfg.has_option('vattenfall', 'auth'):
-        args.auth = cfg.get('vattenfall', 'auth')
-    if not args.customerid and cfg.has_option('vattenfall', 'customerid'):
-        args.customerid = cfg.get('vattenfall', 'customerid')
+    section = cfg.get('vattenfall', {})
+    if not args.username and 'user' in section:
+        args.username = section['user']
+    if not args.password and 'pass' in section:
+        args.password = section['pass']
+    if not args.auth and 'auth' in section:
+        args.auth = section['auth']
+    if not args.customerid and 'customerid' in section:
+        args.customerid = section['customerid']
 
 
 def main():
     import argparse
+    import stats
     parser = argparse.ArgumentParser(description='Vattenfall per hour info')
     parser.add_argument('--debug', '-d', action='store_true', help='print all intermediate steps')
     parser.add_argument('--verbose', action='store_true')
@@ -165,12 +555,24 @@ def main():
     parser.add_argument('--since', '--from', type=str, help='get usage from')
     parser.add_argument('--until', type=str, help='get usage until, default=now')
     parser.add_argument('--weeks', '-n', type=int, default=0)
+    parser.add_argument('--poolsize', type=int, default=4, help=argparse.SUPPRESS) # 'number of keep-alive connections per host'
+    parser.add_argument('--cache', type=str, default='~/.cache/energie', help='directory for caching past usage, default=~/.cache/energie')
+    parser.add_argument('--nocache', dest='cache', action='store_const', const=None, help='do not use the usage cache')
+    parser.add_argument('--timeout', type=float, default=60, help='timeout per request in seconds')
+    parser.add_argument('--retries', type=int, default=5, help='number of tries per request')
+    stats.addarguments(parser)
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='number of windows to request concurrently')
+    parser.add_argument('--sync', type=str, help='append the records newer than the last one in STORE to STORE, a dump file or store directory', metavar='STORE')
+    parser.add_argument('--summarize', '-s', choices=['hour', 'day', 'week', 'month', 'year'], help='print the totals per period, instead of the json data')
+    parser.add_argument('--resume', action='store_true', help='skip the windows completed by a previous interrupted run')
+    parser.add_argument('--journal', type=str, default='~/.cache/energie/vattenfall-journal.txt', help=argparse.SUPPRESS) # 'file recording the completed windows'
     parser.add_argument('--username', '-u', type=str)
     parser.add_argument('--password', '-p', type=str)
     parser.add_argument('--auth', type=str)
     parser.add_argument('--customerid', type=str)
     parser.add_argument('--config', help='specify configuration file.', default='~/.energierc')
     args = parser.parse_args()
+    stats.fromargs(args)
 
     if args.config.startswith("~/"):
         import os
@@ -225,14 +627,24 @@ def main():
     elif args.perjaar:
         interval = 6
 
+    if args.sync:
+        sync(en, args.sync, t0, t1, interval, args.jobs)
+        return
+
     if t0==t1:
         print("nothing to do, specify nr of weeks(-w), or --from + --until")
         return
-    t = t0
-    while t < t1:
-        j = en.getusage(t, t+td-timedelta(days=1), interval)
-        print(json.dumps(j))
-        t += td
+    if args.summarize:
+        from summarizevatten import hourvalues
+        from rollup import streamrollup
+        for t, (g, e, rcvd, xmit) in streamrollup(hourvalues(fetchconsumptions(en, t0, t1, interval, args.jobs)), args.summarize):
+            print("%s %10.5f %10.5f %10.5f %10.5f" % (t, g, e, rcvd, xmit), flush=True)
+        return
+
+    journal = Journal(args.journal, dict(provider='vattenfall', customerid=args.customerid, interval=interval), args.resume)
+    for j in fetchconsumptions(en, t0, t1, interval, args.jobs, journal=journal):
+        print(json.dumps(j), flush=True)
+    journal.close()
 
 
 if __name__ == '__main__':